@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Compares the latency and peak memory usage of the admin app's
+GET /releases/<name> endpoint with the cache freezing the values that are put
+in it (the current behaviour), and deep copying them on every get and put (the
+previous behaviour). Each mode is run in its own process, so that their peak
+RSS can be measured independently."""
+
+import argparse
+import logging
+import resource
+import subprocess
+import sys
+import time
+from copy import deepcopy
+
+PLATFORMS = ("WINNT_x86-msvc", "WINNT_x86_64-msvc", "WINNT_aarch64-msvc", "Darwin_x86_64-gcc3", "Darwin_aarch64-gcc3", "Linux_x86-gcc3", "Linux_x86_64-gcc3")
+
+
+def make_release(name, locales):
+    """Builds a schema 1 release with a similar shape (and size) to a Firefox
+    release with all of its locales."""
+    platforms = {}
+    for platform in PLATFORMS:
+        platform_locales = {}
+        for i in range(locales):
+            locale = "l{}".format(i)
+            platform_locales[locale] = {
+                "partial": {
+                    "filesize": 1234567,
+                    "from": "Firefox-1.0-build1",
+                    "hashValue": "{:0128x}".format(i),
+                    "fileUrl": "http://good.com/{}/{}/partial.mar".format(platform, locale),
+                },
+                "complete": {
+                    "filesize": 7654321,
+                    "from": "*",
+                    "hashValue": "{:0128x}".format(i + 1),
+                    "fileUrl": "http://good.com/{}/{}/complete.mar".format(platform, locale),
+                },
+            }
+        platforms[platform] = {"buildID": "20240101000000", "locales": platform_locales}
+    return {"name": name, "schema_version": 1, "appv": "1.0", "extv": "1.0", "hashFunction": "sha512", "platforms": platforms}
+
+
+def deepcopying_get(self, name, key, value_getter=None):
+    if name not in self.caches:
+        return value_getter() if callable(value_getter) else None
+    value = self.caches[name].get(key, None)
+    if value is None and callable(value_getter):
+        value = value_getter()
+        self.caches[name].put(key, deepcopy(value))
+    return deepcopy(value)
+
+
+def deepcopying_put(self, name, key, value):
+    if name in self.caches:
+        self.caches[name].put(key, deepcopy(value))
+
+
+def run(mode, requests, locales):
+    from auslib.blobs.base import createBlob
+    from auslib.global_state import cache, dbo
+    from auslib.web.admin.base import app
+
+    logging.disable(logging.CRITICAL)
+    cache.make_copies = True
+    if mode == "deepcopy":
+        cache.get = deepcopying_get.__get__(cache)
+        cache.put = deepcopying_put.__get__(cache)
+    cache.make_cache("blob", 500, 3600)
+    cache.make_cache("blob_schema", 50, 24 * 60 * 60)
+
+    dbo.setDb("sqlite:///:memory:")
+    dbo.create()
+    name = "Firefox-2.0-build1"
+    dbo.releases.t.insert().execute(name=name, product="Firefox", data=createBlob(make_release(name, locales)), data_version=1)
+
+    app.config["CORS_ORIGINS"] = "*"
+    client = app.test_client()
+    client.get("/releases/{}".format(name))
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        ret = client.get("/releases/{}".format(name))
+        timings.append(time.perf_counter() - start)
+        assert ret.status_code == 200, ret.data
+
+    timings.sort()
+    # ru_maxrss is in kilobytes on Linux
+    print(
+        "{:<10} median {:>8.2f}ms  p95 {:>8.2f}ms  peak RSS {:>8.1f}MB".format(
+            mode,
+            timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.95)] * 1000,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--requests", type=int, default=50, help="Number of requests to make in each mode")
+    parser.add_argument("-l", "--locales", type=int, default=100, help="Number of locales in each platform of the release")
+    parser.add_argument("--mode", choices=("deepcopy", "frozen"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.requests, args.locales)
+        return
+
+    for mode in ("deepcopy", "frozen"):
+        subprocess.run([sys.executable, __file__, "--mode", mode, "-n", str(args.requests), "-l", str(args.locales)], check=True)
+
+
+if __name__ == "__main__":
+    main()
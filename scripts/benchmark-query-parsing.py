@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Compares the throughput of building update queries from the parameters of
+update URLs with auslib.web.public.client.getQueryFromURL, which builds an
+UpdateQuery in a single pass, against the dict based functions that it
+replaced (which are copied below). The previous functions also found the
+query version by matching a regex against the request's URL, which is
+included in their timings."""
+
+import argparse
+import re
+import timeit
+from urllib.parse import unquote
+
+from auslib.AUS import FORCE_FALLBACK_MAPPING, FORCE_MAIN_MAPPING
+from auslib.web.public.client import getHeaderArchitecture, getQueryFromURL, getSystemCapabilities
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0"
+URLS = (
+    (
+        "https://aus5.mozilla.org/update/6/Firefox/128.0/20240704121409/WINNT_x86_64-msvc-x64/en-US/release/"
+        "Windows_NT%2010.0.0.0.19045.4529%20(x64)/ISET:SSE4_2,MEM:16270/default/default/update.xml",
+        {
+            "product": "Firefox",
+            "version": "128.0",
+            "buildID": "20240704121409",
+            "buildTarget": "WINNT_x86_64-msvc-x64",
+            "locale": "en-US",
+            "channel": "release",
+            "osVersion": "Windows_NT%2010.0.0.0.19045.4529%20(x64)",
+            "systemCapabilities": "ISET:SSE4_2,MEM:16270",
+            "distribution": "default",
+            "distVersion": "default",
+        },
+        6,
+    ),
+    (
+        "https://aus5.mozilla.org/update/3/GMP/128.0/20240704121409/Linux_x86_64-gcc3/de/release/Linux%206.1.0/default/default/update.xml?force=1",
+        {
+            "product": "GMP",
+            "version": "128.0",
+            "buildID": "20240704121409",
+            "buildTarget": "Linux_x86_64-gcc3",
+            "locale": "de",
+            "channel": "release",
+            "osVersion": "Linux%206.1.0",
+            "distribution": "default",
+            "distVersion": "default",
+            "force": "1",
+        },
+        3,
+    ),
+)
+
+
+def legacy_extract_query_version(request_url):
+    version = 0
+    pattern = r"^.*/update/(\d+)/.*\.xml.*$"
+    match = re.match(pattern, request_url)
+    if match:
+        version = int(match.group(1))
+    return version
+
+
+def legacy_get_clean_query_from_url(url):
+    query = url.copy()
+    for field in query:
+        if field == "queryVersion":
+            continue
+        query[field] = query[field].encode("ascii", "replace").decode()
+    if "force" in query and "avast" in query["force"]:
+        force_value = query["force"]
+        force_split = force_value.split("?", 1)
+
+        if len(force_split) < 2:
+            force_split = force_value.split("%3F", 1)
+
+        query["force"] = force_split[0]
+
+        avast_parameter = force_split[1]
+        avast_split = avast_parameter.split("=")
+        query[avast_split[0]] = int(avast_split[1])
+
+    if "locale" in query:
+        query["locale"] = query["locale"].replace("x86 ", "")
+
+    return query
+
+
+def legacy_get_query_from_url(request_url, url, ua):
+    url = dict(url, queryVersion=legacy_extract_query_version(request_url))
+    query = legacy_get_clean_query_from_url(url)
+    if "systemCapabilities" in query:
+        query.update(getSystemCapabilities(url["systemCapabilities"]))
+        del query["systemCapabilities"]
+    query["osVersion"] = unquote(query["osVersion"])
+    query["headerArchitecture"] = getHeaderArchitecture(query["buildTarget"], ua)
+    force = query.get("force")
+    query["force"] = {FORCE_MAIN_MAPPING.query_value: FORCE_MAIN_MAPPING, FORCE_FALLBACK_MAPPING.query_value: FORCE_FALLBACK_MAPPING}.get(force)
+    if "mig64" in query:
+        if query.get("mig64") == "1":
+            query["mig64"] = True
+        else:
+            query["mig64"] = False
+    else:
+        query["mig64"] = None
+    return query
+
+
+def bench(name, func, number, operations):
+    """Runs func number times, and prints how many operations per second it
+    managed, where each run performs the given number of operations."""
+    elapsed = min(timeit.repeat(func, number=number, repeat=5))
+    print("{:<40} {:>12,.0f} ops/s".format(name, number * operations / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=10000, help="Number of iterations of each benchmark")
+    args = parser.parse_args()
+
+    for request_url, url, query_version in URLS:
+        legacy = legacy_get_query_from_url(request_url, url, USER_AGENT)
+        query = getQueryFromURL(url, query_version, USER_AGENT)
+        assert query == legacy, (query, legacy)
+
+    def parse_legacy():
+        for request_url, url, _ in URLS:
+            legacy_get_query_from_url(request_url, url, USER_AGENT)
+
+    def parse():
+        for _, url, query_version in URLS:
+            getQueryFromURL(url, query_version, USER_AGENT)
+
+    legacy_queries = [legacy_get_query_from_url(request_url, url, USER_AGENT) for request_url, url, _ in URLS]
+    queries = [getQueryFromURL(url, query_version, USER_AGENT) for _, url, query_version in URLS]
+
+    def key_legacy():
+        for query in legacy_queries:
+            tuple(sorted(query.items()))
+
+    def key():
+        for query in queries:
+            query.key()
+
+    print("dict")
+    bench("  queries parsed", parse_legacy, args.number, len(URLS))
+    bench("  cache keys", key_legacy, args.number, len(URLS))
+    print("UpdateQuery")
+    bench("  queries parsed", parse, args.number, len(URLS))
+    bench("  cache keys", key, args.number, len(URLS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Compares the latency and throughput of the public app's update URLs when
+they are handled by Connexion (the default), and by UpdateFastPath (see
+auslib.web.public.fastpath). The caches are set up like they are in
+uwsgi/public.wsgi (optionally including the "update_responses" cache), and
+are warmed up before anything is measured, so this shows the cost of handling
+requests that are served from the caches. Requests are made through the app's
+WSGI interface, from a number of threads at once."""
+
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+PLATFORMS = ("WINNT_x86_64-msvc", "Darwin_x86_64-gcc3", "Linux_x86_64-gcc3")
+QUERY = "/update/6/Firefox/1.0/20230101000000/Linux_x86_64-gcc3/l{}/release/Linux%206.1.0/ISET:SSE4_2,MEM:16000/default/default/update.xml?force=1"
+
+
+def make_release(name, locales):
+    """Builds a schema 1 release with the given number of locales, each of
+    which has a partial and a complete update."""
+    platforms = {}
+    for platform in PLATFORMS:
+        platform_locales = {}
+        for i in range(locales):
+            locale = "l{}".format(i)
+            platform_locales[locale] = {
+                "partial": {
+                    "filesize": 1234567,
+                    "from": "Firefox-1.0-build1",
+                    "hashValue": "{:0128x}".format(i),
+                    "fileUrl": "http://good.com/{}/{}/partial.mar".format(platform, locale),
+                },
+                "complete": {
+                    "filesize": 7654321,
+                    "from": "*",
+                    "hashValue": "{:0128x}".format(i + 1),
+                    "fileUrl": "http://good.com/{}/{}/complete.mar".format(platform, locale),
+                },
+            }
+        platforms[platform] = {"buildID": "20240101000000", "locales": platform_locales}
+    return {"name": name, "schema_version": 1, "appv": "2.0", "extv": "2.0", "hashFunction": "sha512", "platforms": platforms}
+
+
+def setup(locales, response_cache):
+    from auslib.global_state import cache, dbo
+    from auslib.web.public.base import app
+
+    logging.disable(logging.CRITICAL)
+    for name, maxsize, timeout in (
+        ("blob", 500, 3600),
+        ("releases", 500, 3600),
+        ("releases_data_version", 500, 3600),
+        ("release_assets", 500, 3600),
+        ("release_assets_data_versions", 5000, 3600),
+        ("assembled_releases", 500, 3600),
+        ("blob_schema", 50, 3600),
+        ("blob_version", 500, 3600),
+        ("rules_index", 1, 3600),
+        ("rules_data_versions", 1, 3600),
+        ("release_blobs", 500, 3600),
+        ("release_fragments", 20000, 3600),
+        ("emergency_shutoffs", 1, 3600),
+        ("missing_releases", 1000, 3600),
+        ("pin_mappings", 1, 3600),
+    ) + ((("update_responses", 1000, 3600),) if response_cache else ()):
+        cache.make_cache(name, maxsize, timeout)
+
+    # Each thread gets its own connection, which means the database can't be in memory.
+    fd, db = tempfile.mkstemp(suffix=".sqlite")
+    os.close(fd)
+    dbo.setDb("sqlite:///{}".format(db))
+    dbo.create()
+    dbo.setDomainAllowlist({"good.com": ("Firefox",)})
+    for name in ("Firefox-1.0-build1", "Firefox-2.0-build1"):
+        # Like the admin app does, each locale is stored as an asset of its own.
+        release = make_release(name, locales)
+        for platform, platform_data in release["platforms"].items():
+            for locale, locale_data in platform_data.pop("locales").items():
+                path = ".platforms.{}.locales.{}".format(platform, locale)
+                dbo.release_assets.t.insert().execute(name=name, path=path, data=locale_data, data_version=1)
+        dbo.releases_json.t.insert().execute(name=name, product="Firefox", data=release, data_version=1)
+    dbo.rules.t.insert().execute(priority=100, backgroundRate=100, mapping="Firefox-2.0-build1", update_type="minor", product="Firefox", data_version=1)
+
+    app.config["ALLOWLISTED_DOMAINS"] = {"good.com": ("Firefox",)}
+    app.config["SPECIAL_FORCE_HOSTS"] = ()
+    return app, db
+
+
+def run(app, fast_path, requests, concurrency, locales):
+    from werkzeug.test import Client
+
+    app.config["UPDATE_FAST_PATH"] = fast_path
+    queries = [QUERY.format(i % locales) for i in range(requests)]
+    # Warm up the caches, and make sure that the responses are what we expect.
+    for query in queries[:locales]:
+        response = Client(app).get(query)
+        assert response.status_code == 200 and b"<update " in response.data, response.status
+
+    timings = []
+
+    def worker(queries):
+        client = Client(app)
+        for query in queries:
+            start = time.perf_counter()
+            client.get(query).data
+            timings.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(queries[i::concurrency],)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    print(
+        "{:<10} {:>8.0f} req/s  median {:>7.2f}ms  p95 {:>7.2f}ms  p99 {:>7.2f}ms".format(
+            "fastpath" if fast_path else "connexion",
+            requests / elapsed,
+            timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.95)] * 1000,
+            timings[int(len(timings) * 0.99)] * 1000,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="Number of requests to make in each mode")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Number of threads to make requests from")
+    parser.add_argument("-l", "--locales", type=int, default=20, help="Number of locales in each platform of the release (and distinct queries)")
+    parser.add_argument("--response-cache", action="store_true", help="Cache entire responses, like UPDATE_RESPONSE_CACHE_SIZE does")
+    args = parser.parse_args()
+
+    app, db = setup(args.locales, args.response_cache)
+    try:
+        for fast_path in (False, True):
+            run(app, fast_path, args.requests, args.concurrency, args.locales)
+    finally:
+        os.unlink(db)
+
+
+if __name__ == "__main__":
+    main()
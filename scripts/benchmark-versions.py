@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Compares the parse and compare throughput of auslib.util.versions against
+the distutils based version classes that it replaced. distutils is gone as of
+Python 3.12, so this needs to be run with an older Python or with setuptools
+installed (which provides a copy of it)."""
+
+import argparse
+import itertools
+import timeit
+import warnings
+
+from auslib.util import versions
+
+try:
+    from distutils.version import LooseVersion, StrictVersion
+except ImportError:
+    raise SystemExit("distutils is not available, nothing to compare against")
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+VERSIONS = ("3.6", "3.6.3plugin1", "1.5.0.12", "60.0", "60.0.1", "68.0a1", "78.8.0", "102.0.1", "115.3.1", "120.0a1", "128.0")
+GLOBS = ("78.*", "102.0.*", "120.*")
+LOOSE_VERSIONS = ("2.4.1", "2.10", "2.10.1", "3.0.0", "2.2beta29")
+
+
+class DistutilsPostModernMozillaVersion(StrictVersion):
+    version_re = versions.PostModernMozillaVersion.version_re
+
+
+class DistutilsModernMozillaVersion(StrictVersion):
+    version_re = versions.ModernMozillaVersion.version_re
+
+
+class DistutilsAncientMozillaVersion(StrictVersion):
+    version_re = versions.AncientMozillaVersion.version_re
+
+
+class DistutilsGlobVersion(StrictVersion):
+    version_re = versions.GlobVersion.version_re
+    prerelease = None
+
+    def parse(self, vstring):
+        self.vstring = vstring
+        if not self.version_re.match(vstring):
+            raise ValueError("invalid version number '%s'" % vstring)
+        self.version = versions.GlobVersionTuple(int(i) for i in vstring.split(".") if i != "*")
+
+    def __eq__(self, value):
+        return str(value).startswith(self.vstring.rstrip("*"))
+
+    def __str__(self):
+        return self.vstring
+
+
+def distutils_mozilla_version(version):
+    if version.count(".") in (1, 2):
+        if int(version.split(".")[0]) > 4:
+            if version.endswith(".*"):
+                return DistutilsGlobVersion(version)
+            return DistutilsPostModernMozillaVersion(version)
+        return DistutilsModernMozillaVersion(version)
+    return DistutilsAncientMozillaVersion(version)
+
+
+# MozillaVersion is memoized, which would make the parsing benchmark meaningless.
+tuple_mozilla_version = versions.MozillaVersion.__wrapped__
+
+
+def bench(name, func, number, operations):
+    """Runs func number times, and prints how many operations per second it
+    managed, where each run performs the given number of operations."""
+    elapsed = min(timeit.repeat(func, number=number, repeat=5))
+    print("{:<40} {:>12,.0f} ops/s".format(name, number * operations / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=1000, help="Number of iterations of each benchmark")
+    args = parser.parse_args()
+
+    strings = VERSIONS + GLOBS
+    pairs = list(itertools.product(VERSIONS, strings))
+    loose_pairs = list(itertools.product(LOOSE_VERSIONS, repeat=2))
+
+    for label, parse, loose in (
+        ("distutils", distutils_mozilla_version, LooseVersion),
+        ("auslib.util.versions", tuple_mozilla_version, versions.LooseVersion),
+    ):
+        parsed = {v: parse(v) for v in strings}
+        parsed_loose = {v: loose(v) for v in LOOSE_VERSIONS}
+        parsed_pairs = [(parsed[a], parsed[b]) for a, b in pairs]
+        parsed_loose_pairs = [(parsed_loose[a], parsed_loose[b]) for a, b in loose_pairs]
+
+        def parse_all():
+            for v in strings:
+                parse(v)
+
+        def compare_all():
+            for a, b in parsed_pairs:
+                a < b
+                a == b
+
+        def compare_loose():
+            for a, b in parsed_loose_pairs:
+                a < b
+                a == b
+
+        print(label)
+        bench("  MozillaVersion parses", parse_all, args.number, len(strings))
+        bench("  MozillaVersion comparisons", compare_all, args.number, len(parsed_pairs) * 2)
+        bench("  LooseVersion comparisons", compare_loose, args.number, len(parsed_loose_pairs) * 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from sqlalchemy.engine.url import make_url
 
 from auslib.blobs.base import createBlob  # noqa: E402
 from auslib.db import AUSDatabase  # noqa: E402
+from auslib.util.timestamp import getMillisecondTimestamp  # noqa: E402
 
 logging.basicConfig(level=logging.INFO)
 
@@ -45,6 +46,18 @@ AND (STR_TO_DATE(RIGHT(name, 14), "%%%%Y%%%%m%%%%d%%%%H%%%%i%%%%S") < NOW() - IN
         trans.execute("DELETE releases FROM releases" + query)
 
 
+def cleanup_change_log(db, trans, age, dryrun=True):
+    # The public apps only look at changes that were made since they last
+    # checked, which they do every few seconds, so there's no reason to keep
+    # them around for long.
+    before = getMillisecondTimestamp() - age * 24 * 60 * 60 * 1000
+    if dryrun:
+        count = db.changeLog.count(where=[db.changeLog.timestamp < before], transaction=trans)
+        print("Change log rows to be deleted: %d" % count)
+    else:
+        db.changeLog.prune(before, transaction=trans)
+
+
 def chunk_list(list_object, n):
     """
     Yield successive n-sized chunks from list_object.
@@ -203,5 +216,7 @@ if __name__ == "__main__":
         with db.begin() as trans:
             if action == "cleanup":
                 cleanup_releases(trans, nightly_age, dryrun=False)
+                cleanup_change_log(db, trans, 1, dryrun=False)
             else:
                 cleanup_releases(trans, nightly_age, dryrun=True)
+                cleanup_change_log(db, trans, 1, dryrun=True)
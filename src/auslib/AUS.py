@@ -2,11 +2,10 @@ import functools
 import logging
 from random import randint
 
-from auslib.blobs.base import createBlob
 from auslib.errors import BadDataError
 from auslib.global_state import cache, dbo
 from auslib.services import releases
-from auslib.util.versions import MozillaVersion, PinVersion
+from auslib.util.versions import MozillaVersion, parse_pin_version
 
 try:
     from urlparse import urlparse
@@ -60,6 +59,9 @@ class AUS:
         self.log = logging.getLogger(self.__class__.__name__)
 
     def updates_are_disabled(self, product, channel, transaction=None):
+        if cache.has_cache("emergency_shutoffs"):
+            return (product, channel) in dbo.emergencyShutoffs.getShutoffs(transaction=transaction)
+
         cache_key = (product, channel)
         v = cache.get("updates_disabled", cache_key)
         if v is not None:
@@ -71,30 +73,68 @@ class AUS:
         cache.put("updates_disabled", cache_key, v)
         return v
 
-    def evaluateRules(self, updateQuery, transaction=None):
+    def getMatchingRule(self, updateQuery, transaction=None):
+        """Returns the highest priority rule that matches updateQuery, or None
+        if there isn't one, or if updates are disabled for its product and
+        channel."""
         self.log.debug("Looking for rules that apply to:")
         self.log.debug(updateQuery)
 
-        eval_metadata = dict(rule_id="unknown", rule_data_version="unknown")
-
         if self.updates_are_disabled(updateQuery["product"], updateQuery["channel"], transaction) or self.updates_are_disabled(
             updateQuery["product"], getFallbackChannel(updateQuery["channel"]), transaction
         ):
             log_message = "Updates are disabled for {}/{}.".format(updateQuery["product"], updateQuery["channel"])
             self.log.debug(log_message)
-            return None, None, eval_metadata
+            return None
 
         rules = dbo.rules.getRulesMatchingQuery(updateQuery, fallbackChannel=getFallbackChannel(updateQuery["channel"]), transaction=transaction)
 
         # TODO: throw any N->N update rules and keep the highest priority remaining one?
         if len(rules) < 1:
-            return None, None, eval_metadata
+            return None
 
         rules = sorted(rules, key=lambda rule: rule["priority"], reverse=True)
-        rule = rules[0]
+        return rules[0]
 
-        eval_metadata["rule_id"] = rule["rule_id"]
-        eval_metadata["rule_data_version"] = rule["data_version"]
+    def evaluateRules(self, updateQuery, transaction=None):
+        rule = self.getMatchingRule(updateQuery, transaction)
+        if rule is None:
+            return None, None, dict(rule_id="unknown", rule_data_version="unknown")
+        return self.evaluateRule(updateQuery, rule, transaction)
+
+    def evaluateRulesForProducts(self, updateQuery, products, transaction=None):
+        """Evaluates the rules for a copy of updateQuery with each of the given
+        products (eg: the response products of a GMP superblob). The matching
+        rules for all of the products are found first, so that all of the
+        releases that they point at can be looked up at once. Returns a list of
+        (product query, release, update type, eval metadata) tuples, in the
+        same order as products."""
+        matches = []
+        for product in products:
+            product_query = updateQuery.copy()
+            product_query["product"] = product
+            matches.append((product_query, self.getMatchingRule(product_query, transaction)))
+
+        names = set()
+        for _, rule in matches:
+            if rule is not None:
+                names.update((rule["mapping"], rule["fallbackMapping"]))
+        names.discard(None)
+
+        results = []
+        with releases.memoize_release_blobs(transaction, names):
+            for product_query, rule in matches:
+                if rule is None:
+                    results.append((product_query, None, None, dict(rule_id="unknown", rule_data_version="unknown")))
+                else:
+                    results.append((product_query,) + self.evaluateRule(product_query, rule, transaction))
+        return results
+
+    def evaluateRule(self, updateQuery, rule, transaction=None):
+        """Returns the release that the given rule (which must match
+        updateQuery) would serve to it, along with the update type and the
+        rule's metadata."""
+        eval_metadata = dict(rule_id=rule["rule_id"], rule_data_version=rule["data_version"])
 
         self.log.debug("Matching rule: %s" % rule)
 
@@ -125,15 +165,9 @@ class AUS:
         #    * version decreases
         #    * version is the same and buildID doesn't increase
         def get_blob(mapping):
-            release = releases.get_release(mapping, transaction, include_sc=False)
-            blob = None
-            if release:
-                blob = createBlob(release["blob"])
-            # TODO: remove me when old releases table dies
-            else:
-                release = dbo.releases.getReleases(name=mapping, limit=1, transaction=transaction)[0]
-                blob = release["data"]
-            return blob
+            # evaluateRulesForProducts looks up all of the releases that it needs in advance.
+            memo = releases.get_current_release_blob_memo()
+            return memo.get(mapping) if memo else releases.find_release_blob(mapping, transaction)
 
         blob = get_blob(mapping)
         if not blob or not blob.shouldServeUpdate(updateQuery):
@@ -142,7 +176,7 @@ class AUS:
         version_pin = updateQuery.get("pin")
         if version_pin is not None:
             try:
-                version_pin = PinVersion(version_pin)
+                version_pin = parse_pin_version(version_pin)
             except ValueError:
                 raise BadDataError(f"Version Pin String '{version_pin}' is invalid.")
             blob_version = blob.getApplicationVersion(updateQuery["buildTarget"], updateQuery["locale"])
@@ -152,7 +186,9 @@ class AUS:
                 # something newer. If we unconditionally returned the pinned version, we would do
                 # incorrect things like skipping watersheds.
                 if blob_version > version_pin:
-                    pin_mapping = dbo.pinnable_releases.getPinMapping(updateQuery["product"], getFallbackChannel(updateQuery["channel"]), str(version_pin))
+                    pin_mapping = dbo.pinnable_releases.getPinMapping(
+                        updateQuery["product"], getFallbackChannel(updateQuery["channel"]), str(version_pin), transaction=transaction
+                    )
                     # Note that we fall back to serving the original update if the pin is not found
                     # in the pin table, even if the version that we will serve is past the pinned
                     # version. This is because, if there is something wrong with the update pin,
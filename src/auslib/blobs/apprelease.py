@@ -1,9 +1,9 @@
 import itertools
 
 from auslib.AUS import getFallbackChannel, isForbiddenUrl, isSpecialURL
-from auslib.blobs.base import XMLBlob, createBlob
+from auslib.blobs.base import XMLBlob
 from auslib.errors import BadDataError, BlobValidationError
-from auslib.global_state import dbo
+from auslib.global_state import cache
 from auslib.services import releases
 from auslib.util.comparison import has_operator, strip_operator
 from auslib.util.rulematching import matchBuildID, matchChannel, matchVersion
@@ -92,37 +92,64 @@ class ReleaseBlobBase(XMLBlob):
         # Because we know it doesn't exist in the database it's wasteful to
         # even attempt to look it up.
         if patch["from"] != "*":
-            try:
-                release = releases.get_release(patch["from"], None, include_sc=False)
-                if release:
-                    return createBlob(release["blob"])
-                else:
-                    return dbo.releases.getReleaseBlob(name=patch["from"])
-            except KeyError:
-                # Release doesn't exist
-                return None
+            return releases.get_memoized_release_blob(patch["from"])
         else:
             return None
 
     def _getAdditionalPatchAttributes(self, patch):
         return {}
 
-    def _getSpecificPatchXML(self, patchKey, patchType, patch, updateQuery, allowlistedDomains, specialForceHosts):
-        fromRelease = self._getFromRelease(patch)
+    def _getCachedFragment(self, key, renderer):
+        """Returns a fragment of this release's response from the
+        "release_fragments" cache, using renderer to create it if it's not
+        there yet. key must include everything from the update query that
+        the fragment depends on. The release's name and data versions are
+        added to it, so changes to the release are never served from the
+        cache. Releases without data versions are never cached."""
+        if self.data_versions is None:
+            return renderer()
+        return cache.get("release_fragments", (self["name"], self.data_versions) + key, renderer)
+
+    def getCachedReferencedReleases(self):
+        return self._getCachedFragment(("referenced_releases",), lambda: frozenset(self.getReferencedReleases()))
+
+    def _getAliases(self, buildTarget):
         # Find all the alias' for this build target so we can look for the current platform
         # in the fromRelease
-        unaliasedBuildTarget = self["platforms"][updateQuery["buildTarget"]].get("alias", updateQuery["buildTarget"])
+        unaliasedBuildTarget = self["platforms"][buildTarget].get("alias", buildTarget)
         aliases = set([unaliasedBuildTarget])
         for bt in self["platforms"]:
             if self["platforms"][bt].get("alias", "") == unaliasedBuildTarget:
                 aliases.add(bt)
+        return frozenset(aliases)
+
+    def _getSpecificPatchXML(self, patchKey, patchType, patch, updateQuery, allowlistedDomains, specialForceHosts):
+        fromRelease = self._getFromRelease(patch)
         # don't return an update if we don't match the from restriction
-        if fromRelease and not fromRelease.matchesUpdateQuery(updateQuery, aliases):
-            return None
+        if fromRelease:
+            aliases = self._getCachedFragment(("aliases", updateQuery["buildTarget"]), lambda: self._getAliases(updateQuery["buildTarget"]))
+            if not fromRelease.matchesUpdateQuery(updateQuery, aliases):
+                return None
         # don't return an update if an older release isn't in the DB for some reason
         if patch["from"] != "*" and fromRelease is None:
             return None
 
+        # Everything else only depends on the parts of the query that are in this key.
+        key = (
+            "patch",
+            patchKey,
+            patchType,
+            patch["from"],
+            patch.get("hashValue"),
+            updateQuery["product"],
+            updateQuery["buildTarget"],
+            updateQuery["locale"],
+            updateQuery["channel"],
+            updateQuery["force"],
+        )
+        return self._getCachedFragment(key, lambda: self._renderPatchXML(patchKey, patchType, patch, updateQuery, allowlistedDomains, specialForceHosts))
+
+    def _renderPatchXML(self, patchKey, patchType, patch, updateQuery, allowlistedDomains, specialForceHosts):
         try:
             url = self._getUrl(updateQuery, patchKey, patch, specialForceHosts)
         except ValueError:
@@ -159,8 +186,11 @@ class ReleaseBlobBase(XMLBlob):
 
         return patchXML
 
+    def _getUpdateLineCacheKey(self, updateQuery, update_type):
+        return ("update", updateQuery["buildTarget"], updateQuery["locale"], update_type)
+
     def getInnerHeaderXML(self, updateQuery, update_type, allowlistedDomains, specialForceHosts):
-        return self._getUpdateLineXML(updateQuery, update_type)
+        return self._getCachedFragment(self._getUpdateLineCacheKey(updateQuery, update_type), lambda: self._getUpdateLineXML(updateQuery, update_type))
 
     def getInnerFooterXML(self, updateQuery, update_type, allowlistedDomains, specialForceHosts):
         return "    </update>"
@@ -979,6 +1009,18 @@ class ReleaseBlobV9(ProofXMLMixin, ReleaseBlobBase, MultipleUpdatesXMLMixin, Uni
         if "schema_version" not in self.keys():
             self["schema_version"] = 9
 
+    def _getUpdateLineCacheKey(self, updateQuery, update_type):
+        # updateLine groups can match on the channel, version and buildID in
+        # the query too. Only the parts that are actually used are included,
+        # so that releases that don't use versions or buildIDs can be cached
+        # for every version and buildID at once.
+        conditions = set(condition for group in self.get("updateLine", []) for condition in group["for"])
+        return super(ReleaseBlobV9, self)._getUpdateLineCacheKey(updateQuery, update_type) + (
+            updateQuery["channel"] if "channels" in conditions else None,
+            updateQuery["version"] if "versions" in conditions else None,
+            updateQuery["buildID"] if "buildIDs" in conditions else None,
+        )
+
     def _getUpdateLineXML(self, updateQuery, update_type):
         attrs = {
             "appVersion": self.getLocaleOrTopLevelParam(updateQuery["buildTarget"], updateQuery["locale"], "appVersion"),
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 from os import path
@@ -11,9 +12,10 @@ from auslib.errors import BlobValidationError
 from auslib.global_state import cache
 
 
-def createBlob(data):
-    """Takes a string form of a blob (eg from DB or API) and converts into an
-    actual blob, taking care to notice the schema"""
+@functools.lru_cache(maxsize=None)
+def _get_blob_map():
+    """Returns a dict of schema versions to the Blob classes that implement
+    them. This is only built once, rather than every time a Blob is created."""
     # These imports need to be done here to avoid errors due to circular
     # between this module and specific blob modules like apprelease.
     from auslib.blobs.apprelease import (
@@ -32,7 +34,7 @@ def createBlob(data):
     from auslib.blobs.superblob import SuperBlob
     from auslib.blobs.systemaddons import SystemAddonsBlob
 
-    blob_map = {
+    return {
         1: ReleaseBlobV1,
         2: ReleaseBlobV2,
         3: ReleaseBlobV3,
@@ -48,6 +50,12 @@ def createBlob(data):
         10000: GuardianBlob,
     }
 
+
+def createBlob(data):
+    """Takes a string form of a blob (eg from DB or API) and converts into an
+    actual blob, taking care to notice the schema"""
+    blob_map = _get_blob_map()
+
     if isinstance(data, str):
         data = json.loads(data)
     schema_version = data.get("schema_version")
@@ -134,6 +142,9 @@ def merge_dicts(ancestor, left, right):
 
 class Blob(dict):
     jsonschema = None
+    # A hashable identifier of the database rows that this Blob was built
+    # from, if it's known. See auslib.services.releases.get_release_blob.
+    data_versions = None
 
     def __init__(self, *args, **kwargs):
         super(Blob, self).__init__(self, *args, **kwargs)
@@ -193,6 +204,12 @@ class Blob(dict):
         """
         return set()
 
+    def getCachedReferencedReleases(self):
+        """Returns the same releases as getReferencedReleases, which subclasses
+        may cache for as long as the Blob is unchanged. The return value must
+        not be modified."""
+        return self.getReferencedReleases()
+
 
 # We should be able to kill this Blob and its subclasses at some point by using
 # GenericBlob, and fully encapsulating the response in getResponse
@@ -1,7 +1,6 @@
-from distutils.version import LooseVersion
-
 from auslib.AUS import isForbiddenUrl
 from auslib.blobs.base import GenericBlob
+from auslib.util.versions import parse_loose_version
 
 
 class GuardianBlob(GenericBlob):
@@ -14,7 +13,7 @@ class GuardianBlob(GenericBlob):
     def shouldServeUpdate(self, updateQuery):
         if updateQuery["buildTarget"] not in self.get("platforms", {}):
             return False
-        if LooseVersion(updateQuery["version"]) >= LooseVersion(self["version"]):
+        if parse_loose_version(updateQuery["version"]) >= parse_loose_version(self["version"]):
             return False
 
         return True
@@ -3,6 +3,7 @@ import json
 import logging
 import pprint
 import re
+import threading
 import time
 from collections import defaultdict
 from copy import copy
@@ -13,7 +14,7 @@ import migrate.versioning.schema
 import sqlalchemy.event
 import sqlalchemy.types
 from aiohttp import ClientSession
-from sqlalchemy import JSON, BigInteger, Boolean, Column, Integer, MetaData, String, Table, Text, create_engine, func, join, select
+from sqlalchemy import JSON, BigInteger, Boolean, Column, Integer, MetaData, String, Table, Text, create_engine, func, join, select, union_all
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.sql.expression import null
 from sqlalchemy.sql.functions import max as sql_max
@@ -22,17 +23,9 @@ from auslib.blobs.base import createBlob, merge_dicts
 from auslib.errors import PermissionDeniedError, ReadOnlyError, SignoffRequiredError
 from auslib.global_state import cache
 from auslib.util.compat import query_param, query_params, whereclause
-from auslib.util.rulematching import (
-    matchBoolean,
-    matchBuildID,
-    matchChannel,
-    matchCsv,
-    matchLocale,
-    matchMemory,
-    matchRegex,
-    matchSimpleExpression,
-    matchVersion,
-)
+from auslib.util.data_structures import thaw
+from auslib.util.ruleindex import RuleIndex
+from auslib.util.rulematching import RulePredicate, matchRegex
 from auslib.util.timestamp import getMillisecondTimestamp
 from auslib.util.versions import get_version_class
 
@@ -237,6 +230,40 @@ class AUSTransaction(object):
         self.trans.rollback()
 
 
+class LazyAUSTransaction(AUSTransaction):
+    """An AUSTransaction that doesn't connect to the database until the first
+    statement is executed in it, so that requests which are served entirely
+    from caches don't need a connection at all."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+        self.trans = None
+        self.log = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def connected(self):
+        return self.conn is not None
+
+    def execute(self, statement):
+        if self.conn is None:
+            self.conn = self.engine.connect()
+            self.trans = self.conn.begin()
+        return super(LazyAUSTransaction, self).execute(statement)
+
+    def close(self):
+        if self.conn is not None:
+            super(LazyAUSTransaction, self).close()
+
+    def commit(self):
+        if self.trans is not None:
+            super(LazyAUSTransaction, self).commit()
+
+    def rollback(self):
+        if self.trans is not None:
+            super(LazyAUSTransaction, self).rollback()
+
+
 class AUSTable(object):
     """Base class for all AUS Tables. By default, all tables have a history
     table created for them, too, which mirrors their own structure and adds
@@ -278,6 +305,15 @@ class AUSTable(object):
     :type onDelete: callable
     :param onUpdate: See onInsert
     :type onUpdate: callable
+    :param logChanges: Whether or not changes to this table should be recorded
+                       in the ChangeLog, which the public app uses to evict
+                       stale entries from its caches. Defaults to False.
+    :type logChanges: bool
+    :param changeKey: The name of the primary key column whose value is recorded
+                      with each change when logChanges is True. When None,
+                      changes are recorded without a key, which means that
+                      the entire table should be considered changed.
+    :type changeKey: str
     """
 
     def __init__(
@@ -292,6 +328,8 @@ class AUSTable(object):
         onInsert=None,
         onUpdate=None,
         onDelete=None,
+        logChanges=False,
+        changeKey=None,
     ):
         self.db = db
         self.t = self.table
@@ -302,6 +340,8 @@ class AUSTable(object):
         self.onInsert = onInsert
         self.onUpdate = onUpdate
         self.onDelete = onDelete
+        self.logChanges = logChanges
+        self.changeKey = changeKey
         # Mirror the columns as attributes for easy access
         self.primary_key = []
         for col in self.table.columns:
@@ -418,8 +458,18 @@ class AUSTable(object):
             pk_values = ret.inserted_primary_key
             pk_args = dict(zip(pk_columns, pk_values))
             self.onInsert(self, "INSERT", changed_by, query, trans, additional_columns=unconsumed_columns, pk_args=pk_args)
+        self._logChange(data, trans)
         return data, ret
 
+    def _logChange(self, row, trans):
+        """Records a change to the given row in the ChangeLog, if this table's
+        changes are being logged. This is done in the same transaction as the
+        change itself, so that nothing is recorded if it is rolled back."""
+        if not self.logChanges:
+            return
+        key = row[self.changeKey] if self.changeKey else None
+        self.db.changeLog.record(self.t.name, key, transaction=trans)
+
     def _prepareInsert(self, trans, changed_by, **columns):
         data, ret = self._sharedPrepareInsert(trans, changed_by, **columns)
         if self.history:
@@ -534,6 +584,7 @@ class AUSTable(object):
                 sc_where.append(getattr(self.scheduled_changes, "base_%s" % pk.name) == row[pk.name])
             if self.scheduled_changes.select(where=sc_where, transaction=trans):
                 raise ChangeScheduledError("Cannot delete rows that have changes scheduled.")
+        self._logChange(row, trans)
 
         return row, ret
 
@@ -695,6 +746,7 @@ class AUSTable(object):
             raise OutdatedDataError("Failed to update row, old_data_version doesn't match current data_version")
         if self.scheduled_changes:
             self.scheduled_changes.mergeUpdate(orig_row, what, changed_by, trans)
+        self._logChange(orig_row, trans)
         return new_row, ret
 
     def _prepareUpdate(self, trans, where, what, changed_by, old_data_version):
@@ -1799,7 +1851,9 @@ class Rules(AUSTable):
             Column("comment", String(500)),
         )
 
-        AUSTable.__init__(self, db, dialect, scheduled_changes=True, historyClass=HistoryTable)
+        AUSTable.__init__(self, db, dialect, scheduled_changes=True, historyClass=HistoryTable, logChanges=True)
+        # Held while the rules index is rebuilt (see getRuleIndex).
+        self.rule_index_lock = threading.Lock()
 
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
         potential_required_signoffs = {}
@@ -1864,6 +1918,37 @@ class Rules(AUSTable):
         """Returns all of the rules, sorted in ascending order"""
         return self.select(where=where, order_by=(self.priority, self.version, self.mapping), transaction=transaction)
 
+    def getDataVersions(self, transaction=None):
+        """Returns a tuple of (rule_id, data_version) pairs for every rule. Any
+        insert, update or delete of a rule will change the returned value."""
+        rows = self.select(columns=[self.rule_id, self.data_version], order_by=[self.rule_id], transaction=transaction)
+        return tuple((row["rule_id"], row["data_version"]) for row in rows)
+
+    def getRuleIndex(self, transaction=None):
+        """Returns a RuleIndex of the entire rules table. The index is kept in
+        the "rules_index" cache, and is only rebuilt when the data versions of
+        the rules table (which are cached in "rules_data_versions") change.
+        Only one thread rebuilds it at a time, and the others wait for it."""
+        data_versions = cache.get("rules_data_versions", "rules", lambda: self.getDataVersions(transaction=transaction))
+        index = cache.get("rules_index", "rules")
+        if index is not None and index.data_versions == data_versions:
+            return index
+
+        with self.rule_index_lock:
+            # If another thread rebuilt the index while we were waiting, the
+            # cached data versions are the ones that it was built from.
+            data_versions = cache.get("rules_data_versions", "rules", lambda: self.getDataVersions(transaction=transaction))
+            index = cache.get("rules_index", "rules")
+            if index is None or index.data_versions != data_versions:
+                self.log.debug("Building rules index")
+                rules = self.select(order_by=[self.rule_id], transaction=transaction)
+                index = RuleIndex(rules, tuple((rule["rule_id"], rule["data_version"]) for rule in rules))
+                cache.put("rules_index", "rules", index)
+                # The rules we just loaded may be newer than the cached data versions
+                # (but never older), so we refresh those too.
+                cache.put("rules_data_versions", "rules", index.data_versions)
+        return index
+
     def getRulesMatchingQuery(self, updateQuery, fallbackChannel, transaction=None):
         """Returns all of the rules that match the given update query.
         For cases where a particular updateQuery channel has no
@@ -1886,63 +1971,82 @@ class Rules(AUSTable):
                 where.extend([(self.distVersion == null())])
 
             self.log.debug("where: %s", where)
-            return self.select(where=where, transaction=transaction)
-
-        # This cache key is constructed from all parts of the updateQuery that
-        # are used in the select() to get the "raw" rule matches. For the most
-        # part, product and buildTarget will be the only applicable ones which
-        # means we should get very high cache hit rates, as there's not a ton
-        # of variability of possible combinations for those.
-        cache_key = "%s:%s:%s:%s:%s" % (
-            updateQuery["product"],
-            updateQuery["buildTarget"],
-            updateQuery.get("headerArchitecture"),
-            updateQuery.get("distVersion"),
-            updateQuery.get("force"),
-        )
-        rules = cache.get("rules", cache_key, getRawMatches)
+            return [RulePredicate(rule) for rule in self.select(where=where, transaction=transaction)]
+
+        if cache.has_cache("rules_index"):
+            # When the rules index is enabled, the "raw" matches come from an
+            # in-memory index of the entire rules table instead of the database.
+            rules = self.getRuleIndex(transaction=transaction).lookup(updateQuery, fallbackChannel)
+        else:
+            # This cache key is constructed from all parts of the updateQuery that
+            # are used in the select() to get the "raw" rule matches. For the most
+            # part, product and buildTarget will be the only applicable ones which
+            # means we should get very high cache hit rates, as there's not a ton
+            # of variability of possible combinations for those.
+            cache_key = "%s:%s:%s:%s:%s" % (
+                updateQuery["product"],
+                updateQuery["buildTarget"],
+                updateQuery.get("headerArchitecture"),
+                updateQuery.get("distVersion"),
+                updateQuery.get("force"),
+            )
+            rules = cache.get("rules", cache_key, getRawMatches)
 
         self.log.debug("Raw matches:")
 
+        versionClass = get_version_class(updateQuery["product"])
+        # The parts of the query that rules are matched against are looked up
+        # once, rather than for every rule.
+        channel = updateQuery["channel"]
+        version = updateQuery["version"]
+        buildID = updateQuery.get("buildID", "")
+        memory = updateQuery.get("memory")
+        osVersion = updateQuery.get("osVersion", "")
+        instructionSet = updateQuery.get("instructionSet", "")
+        distribution = updateQuery.get("distribution", "")
+        locale = updateQuery.get("locale", "")
+        mig64 = updateQuery.get("mig64")
+        jaws = updateQuery.get("jaws")
         matchingRules = []
-        for rule in rules:
+        for predicate in rules:
+            rule = predicate.rule
             self.log.debug(rule)
 
             # Resolve special means for channel, version, and buildID - dropping
             # rules that don't match after resolution.
-            if not matchChannel(rule["channel"], updateQuery["channel"], fallbackChannel):
-                self.log.debug("%s doesn't match %s", rule["channel"], updateQuery["channel"])
+            if not predicate.matchChannel(channel, fallbackChannel):
+                self.log.debug("%s doesn't match %s", rule["channel"], channel)
                 continue
-            if not matchVersion(rule["version"], updateQuery["version"], get_version_class(updateQuery["product"])):
-                self.log.debug("%s doesn't match %s", rule["version"], updateQuery["version"])
+            if not predicate.matchVersion(version, versionClass):
+                self.log.debug("%s doesn't match %s", rule["version"], version)
                 continue
-            if not matchBuildID(rule["buildID"], updateQuery.get("buildID", "")):
-                self.log.debug("%s doesn't match %s", rule["buildID"], updateQuery["buildID"])
+            if not predicate.matchBuildID(buildID):
+                self.log.debug("%s doesn't match %s", rule["buildID"], buildID)
                 continue
-            if not matchMemory(rule["memory"], updateQuery.get("memory")):
-                self.log.debug("%s doesn't match %s", rule["memory"], updateQuery.get("memory"))
+            if not predicate.matchMemory(memory):
+                self.log.debug("%s doesn't match %s", rule["memory"], memory)
                 continue
             # To help keep the rules table compact, multiple OS versions may be
-            # specified in a single rule. They are comma delimited, so we need to
-            # break them out and create clauses for each one.
-            if not matchSimpleExpression(rule["osVersion"], updateQuery.get("osVersion", "")):
-                self.log.debug("%s doesn't match %s", rule["osVersion"], updateQuery["osVersion"])
+            # specified in a single rule. They are comma delimited, and were
+            # broken out when the predicate was created.
+            if not predicate.matchOsVersion(osVersion):
+                self.log.debug("%s doesn't match %s", rule["osVersion"], osVersion)
                 continue
-            if not matchCsv(rule["instructionSet"], updateQuery.get("instructionSet", ""), substring=False):
-                self.log.debug("%s doesn't match %s", rule["instructionSet"], updateQuery.get("instructionSet"))
+            if not predicate.matchInstructionSet(instructionSet):
+                self.log.debug("%s doesn't match %s", rule["instructionSet"], instructionSet)
                 continue
-            if not matchCsv(rule["distribution"], updateQuery.get("distribution", ""), substring=False):
-                self.log.debug("%s doesn't match %s", rule["distribution"], updateQuery.get("distribution"))
+            if not predicate.matchDistribution(distribution):
+                self.log.debug("%s doesn't match %s", rule["distribution"], distribution)
                 continue
             # Locales may be a comma delimited rule too, exact matches only
-            if not matchLocale(rule["locale"], updateQuery.get("locale", "")):
-                self.log.debug("%s doesn't match %s", rule["locale"], updateQuery["locale"])
+            if not predicate.matchLocale(locale):
+                self.log.debug("%s doesn't match %s", rule["locale"], locale)
                 continue
-            if not matchBoolean(rule["mig64"], updateQuery.get("mig64")):
-                self.log.debug("%s doesn't match %s", rule["mig64"], updateQuery.get("mig64"))
+            if not predicate.matchMig64(mig64):
+                self.log.debug("%s doesn't match %s", rule["mig64"], mig64)
                 continue
-            if not matchBoolean(rule["jaws"], updateQuery.get("jaws")):
-                self.log.debug("%s doesn't match %s", rule["jaws"], updateQuery.get("jaws"))
+            if not predicate.matchJaws(jaws):
+                self.log.debug("%s doesn't match %s", rule["jaws"], jaws)
                 continue
 
             matchingRules.append(rule)
@@ -2044,7 +2148,15 @@ class Releases(AUSTable):
             # Can't have history without a bucket
             historyClass = None
         AUSTable.__init__(
-            self, db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=historyClass, historyKwargs=historyKwargs
+            self,
+            db,
+            dialect,
+            scheduled_changes=True,
+            scheduled_changes_kwargs={"conditions": ["time"]},
+            historyClass=historyClass,
+            historyKwargs=historyKwargs,
+            logChanges=True,
+            changeKey="name",
         )
 
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
@@ -2284,7 +2396,9 @@ class Releases(AUSTable):
                     tip_release = self.getReleases(name=name, transaction=transaction)[0]
                     tip_blob = tip_release.get("data")
                     try:
-                        what["data"] = createBlob(merge_dicts(ancestor_blob, tip_blob, blob))
+                        # The tip and incoming blobs may have come from the cache, and be frozen.
+                        # merge_dicts needs all of them to be made of the same types.
+                        what["data"] = createBlob(merge_dicts(ancestor_blob, thaw(tip_blob), thaw(blob)))
                         self.log.warning("Successfully merged release %s at data_version %s with the latest version.", name, old_data_version)
                         # ancestor_change is checked for None a few lines up
                         self.log.warning(
@@ -2326,7 +2440,7 @@ class Releases(AUSTable):
         if not self.db.hasPermission(changed_by, "release_locale", "modify", product, transaction):
             raise PermissionDeniedError("%s is not allowed to add builds for product %s" % (changed_by, product))
 
-        releaseBlob = self.getReleaseBlob(name, transaction=transaction)
+        releaseBlob = thaw(self.getReleaseBlob(name, transaction=transaction))
         if "platforms" not in releaseBlob:
             releaseBlob["platforms"] = {}
 
@@ -2471,7 +2585,46 @@ class ReleasesJSON(AUSTable):
             scheduled_changes_kwargs={"conditions": ["time"]},
             historyClass=historyClass,
             historyKwargs=historyKwargs,
+            logChanges=True,
+            changeKey="name",
+        )
+
+    def getReleasesWithAssets(self, names, versions_only=False, transaction=None):
+        """Returns the base row and asset rows of each of the named releases,
+        which are all retrieved with a single query. The return value is a dict
+        of release names to (base_row, asset_rows) tuples, where base_row is
+        None for releases that don't exist in this table, and asset_rows is
+        ordered by path. Names that don't match any rows at all are left out.
+
+        If versions_only is True, the data columns of the rows are None,
+        which is useful for checking whether cached copies of them are still
+        current."""
+        assets = self.db.release_assets
+        data = null().label("data") if versions_only else self.data
+        asset_data = null().label("data") if versions_only else assets.data
+        base_query = select([self.name, null().label("path"), self.product, self.read_only, data, self.data_version]).where(self.name.in_(names))
+        assets_query = select([assets.name, assets.path, null().label("product"), null().label("read_only"), asset_data, assets.data_version]).where(
+            assets.name.in_(names)
         )
+        query = union_all(base_query, assets_query).order_by("name", "path")
+
+        if transaction:
+            rows = transaction.execute(query).fetchall()
+        else:
+            rows = self.getEngine().execute(query).fetchall()
+
+        releases = {}
+        for row in rows_to_dicts(rows):
+            base_row, asset_rows = releases.get(row["name"], (None, []))
+            path = row.pop("path")
+            if path is None:
+                base_row = row
+            else:
+                del row["product"], row["read_only"]
+                row["path"] = path
+                asset_rows.append(row)
+            releases[row["name"]] = (base_row, asset_rows)
+        return releases
 
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
         potential_required_signoffs = defaultdict(list)
@@ -2562,7 +2715,14 @@ class ReleaseAssets(AUSTable):
             historyClass = None
 
         super(ReleaseAssets, self).__init__(
-            db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=historyClass, historyKwargs=historyKwargs
+            db,
+            dialect,
+            scheduled_changes=True,
+            scheduled_changes_kwargs={"conditions": ["time"]},
+            historyClass=historyClass,
+            historyKwargs=historyKwargs,
+            logChanges=True,
+            changeKey="name",
         )
 
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
@@ -2877,6 +3037,60 @@ class Permissions(AUSTable):
         return username in usernames
 
 
+class ChangeLog(AUSTable):
+    """Records changes made to the tables that the public app caches (see the
+    logChanges argument of AUSTable). Every change gets a new change_id, which
+    only ever increases, so consumers can find out whether anything has changed
+    by comparing the latest one to the last one they've seen, and then find out
+    what has changed by retrieving the rows in between.
+
+    row_key contains the value of the changed row's changeKey column, or NULL
+    when the table doesn't have one."""
+
+    def __init__(self, db, metadata, dialect):
+        self.table = Table(
+            "change_log",
+            metadata,
+            Column("change_id", Integer, primary_key=True, autoincrement=True),
+            Column("table_name", String(100), nullable=False),
+            Column("row_key", String(100)),
+        )
+        # See the comment in HistoryTable about why SQLite gets a plain Integer.
+        if dialect == "sqlite":
+            self.table.append_column(Column("timestamp", Integer, nullable=False))
+        else:
+            self.table.append_column(Column("timestamp", BigInteger, nullable=False))
+        AUSTable.__init__(self, db, dialect, historyClass=None, versioned=False)
+
+    def record(self, table_name, row_key=None, transaction=None):
+        return self.insert(transaction=transaction, table_name=table_name, row_key=row_key, timestamp=getMillisecondTimestamp())
+
+    def getLatestChangeId(self, transaction=None):
+        """Returns the change_id of the most recent change, or 0 if nothing has
+        been recorded."""
+        query = select([func.max(self.change_id)])
+        if transaction:
+            latest = transaction.execute(query).scalar()
+        else:
+            with AUSTransaction(self.getEngine()) as trans:
+                latest = trans.execute(query).scalar()
+        return latest or 0
+
+    def getChangesSince(self, change_id, transaction=None):
+        """Returns the changes that have been recorded after change_id, in the order they were made."""
+        return self.select(where=[self.change_id > change_id], order_by=[self.change_id], transaction=transaction)
+
+    def prune(self, timestamp, transaction=None):
+        """Deletes changes that were recorded before timestamp. Consumers that
+        haven't checked for changes since then will miss them."""
+        query = self.t.delete().where(self.timestamp < timestamp)
+        if transaction:
+            return transaction.execute(query).rowcount
+        else:
+            with AUSTransaction(self.getEngine()) as trans:
+                return trans.execute(query).rowcount
+
+
 class Dockerflow(AUSTable):
     def __init__(self, db, metadata, dialect):
         self.table = Table("dockerflow", metadata, Column("watchdog", Integer, nullable=False))
@@ -2914,7 +3128,9 @@ class EmergencyShutoffs(AUSTable):
             Column("channel", String(75), nullable=False, primary_key=True),
             Column("comment", String(500)),
         )
-        AUSTable.__init__(self, db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=HistoryTable)
+        AUSTable.__init__(
+            self, db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=HistoryTable, logChanges=True
+        )
 
     def insert(self, changed_by, transaction=None, dryrun=False, **columns):
         if not self.db.hasPermission(changed_by, "emergency_shutoff", "create", columns.get("product"), transaction):
@@ -2924,6 +3140,17 @@ class EmergencyShutoffs(AUSTable):
         if not dryrun:
             return ret.last_inserted_params()
 
+    def getShutoffs(self, transaction=None):
+        """Returns a frozenset of the (product, channel) of every emergency
+        shutoff. It's kept in the "emergency_shutoffs" cache, when it exists.
+        The table only ever has a handful of rows, so reading all of them is
+        as cheap as checking whether or not any of them have changed."""
+
+        def getProductChannels():
+            return frozenset((row["product"], row["channel"]) for row in self.select(columns=[self.product, self.channel], transaction=transaction))
+
+        return cache.get("emergency_shutoffs", "emergency_shutoffs", getProductChannels)
+
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
         potential_required_signoffs = {"rs": []}
         row = affected_rows[-1]
@@ -2956,7 +3183,9 @@ class PinnableReleasesTable(AUSTable):
             Column("channel", String(75), nullable=False, primary_key=True),
             Column("mapping", String(100), nullable=False),
         )
-        AUSTable.__init__(self, db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=HistoryTable)
+        AUSTable.__init__(
+            self, db, dialect, scheduled_changes=True, scheduled_changes_kwargs={"conditions": ["time"]}, historyClass=HistoryTable, logChanges=True
+        )
 
     def getPotentialRequiredSignoffs(self, affected_rows, transaction=None):
         # Implementing this is required to schedule changes to this table
@@ -3006,7 +3235,23 @@ class PinnableReleasesTable(AUSTable):
     def mappingHasPin(self, mapping, transaction=None):
         return self.count(where=[self.mapping == mapping], transaction=transaction) > 0
 
+    def getPinMappings(self, transaction=None):
+        """Returns the mappings of every pin, keyed by (product, channel, version).
+        They're kept in the "pin_mappings" cache, when it exists. The whole
+        table is reloaded when it expires, rather than when the data versions of
+        its rows change, because a pin can be deleted and added again with a
+        different mapping but the same data_version."""
+
+        def getMappings():
+            rows = self.select(columns=[self.product, self.channel, self.version, self.mapping], transaction=transaction)
+            return {(row["product"], row["channel"], row["version"]): row["mapping"] for row in rows}
+
+        return cache.get("pin_mappings", "pinnable_releases", getMappings)
+
     def getPinMapping(self, product, channel, version, transaction=None):
+        if cache.has_cache("pin_mappings"):
+            return self.getPinMappings(transaction=transaction).get((product, channel, version))
+
         rows = self.select(where=[self.product == product, self.channel == channel, self.version == version], columns=[self.mapping], transaction=transaction)
         if len(rows) == 0:
             return None
@@ -3175,6 +3420,7 @@ class AUSDatabase(object):
         self.permissionsRequiredSignoffsTable = PermissionsRequiredSignoffsTable(self, self.metadata, dialect)
         self.emergencyShutoffsTable = EmergencyShutoffs(self, self.metadata, dialect)
         self.pinnableReleasesTable = PinnableReleasesTable(self, self.metadata, dialect)
+        self.changeLogTable = ChangeLog(self, self.metadata, dialect)
         self.metadata.bind = self.engine
 
     def setSystemAccounts(self, systemAccounts):
@@ -3262,7 +3508,9 @@ class AUSDatabase(object):
         self.engine = None
         self.metadata.bind = None
 
-    def begin(self):
+    def begin(self, lazy=False):
+        if lazy:
+            return LazyAUSTransaction(self.engine)
         return AUSTransaction(self.engine)
 
     @property
@@ -3304,3 +3552,7 @@ class AUSDatabase(object):
     @property
     def pinnable_releases(self):
         return self.pinnableReleasesTable
+
+    @property
+    def changeLog(self):
+        return self.changeLogTable
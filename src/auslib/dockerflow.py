@@ -2,7 +2,7 @@ from os import path
 
 from flask import Response, jsonify
 
-from auslib.global_state import dbo
+from auslib.global_state import cache, dbo
 
 
 def _heartbeat_database_fn(dbo):
@@ -36,6 +36,17 @@ def get_version(version_file):
         return jsonify({"source": "https://github.com/mozilla-releng/balrog", "version": "unknown", "commit": "unknown"})
 
 
+def cache_stats_response(sizes=False):
+    """Not part of the Dockerflow spec, but in the same spirit: respond to
+    /__cache__ with the statistics of this process' caches (see
+    auslib.util.cache.MaybeCacher.stats). Estimating the sizes of the caches
+    means walking through everything in them, which is far too expensive to
+    do for anyone who asks, so it's only done when `sizes` is True."""
+    response = jsonify(cache.stats(sizes=sizes))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 # Keeping flask dockerflow endpoints here to maintain the admin api compatibility.
 def create_dockerflow_endpoints(app, heartbeat_database_fn=_heartbeat_database_fn):
     """Wrapper that creates the endpoints required by CloudOps' Dockerflow spec:
@@ -61,3 +72,7 @@ def create_dockerflow_endpoints(app, heartbeat_database_fn=_heartbeat_database_f
     def version():
         version_file = app.config.get("VERSION_FILE")
         return get_version(version_file)
+
+    @app.route("/__cache__")
+    def cache_stats():
+        return cache_stats_response(sizes=app.config.get("CACHE_STATS_SIZES", False))
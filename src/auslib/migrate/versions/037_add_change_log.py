@@ -0,0 +1,26 @@
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table
+
+
+def upgrade(migrate_engine):
+    metadata = MetaData(bind=migrate_engine)
+    if migrate_engine.name == "mysql":
+        bigintType = BigInteger
+    elif migrate_engine.name == "sqlite":
+        bigintType = Integer
+
+    change_log = Table(  # noqa
+        "change_log",
+        metadata,
+        Column("change_id", Integer, primary_key=True, autoincrement=True),
+        Column("table_name", String(100), nullable=False),
+        Column("row_key", String(100)),
+        Column("timestamp", bigintType, nullable=False),
+    )
+
+    metadata.create_all()
+
+
+def downgrade(migrate_engine):
+    metadata = MetaData(bind=migrate_engine)
+
+    Table("change_log", metadata, autoload=True).drop()
@@ -0,0 +1,36 @@
+import logging
+import threading
+import time
+
+from ..global_state import cache
+
+log = logging.getLogger(__name__)
+
+
+class CacheStatsLogger(object):
+    """Logs the statistics of every cache (see MaybeCacher.stats) at most once
+    every `interval` seconds, as one line per cache. The statistics are passed
+    to the logger as extra fields, which JsonLogFormatter includes in its
+    output. Estimating the size of the caches means walking everything in
+    them, so that's only done when `sizes` is True."""
+
+    def __init__(self, interval, sizes=False):
+        self.interval = interval
+        self.sizes = sizes
+        self.next_log = time.time() + interval
+        self.lock = threading.Lock()
+
+    def check(self):
+        """Logs the statistics of the caches if it's time to. Returns True if
+        they were logged."""
+        now = time.time()
+        if now < self.next_log or not self.lock.acquire(blocking=False):
+            return False
+
+        try:
+            self.next_log = now + self.interval
+            for name, stats in cache.stats(sizes=self.sizes).items():
+                log.info("Cache stats for %s", name, extra=dict(stats, cache=name))
+            return True
+        finally:
+            self.lock.release()
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+from ..global_state import cache, dbo
+
+log = logging.getLogger(__name__)
+
+# Caches whose entries are keyed on release names, which are evicted when
+# a release with that name is changed.
+RELEASE_CACHES = ("releases", "releases_data_version", "release_assets", "release_assets_data_versions", "release_blobs", "missing_releases")
+EVICTED_CACHES = {
+    "releases": ("blob", "blob_version") + RELEASE_CACHES,
+    "releases_json": RELEASE_CACHES,
+    "release_assets": RELEASE_CACHES,
+}
+# Caches that can't be evicted from by key, which are cleared when anything in
+# the table changes. Update responses are keyed on the data versions of the
+# releases they were rendered from, but not on those of the releases that their
+# partials are from, which is why they're cleared whenever any release changes.
+CLEARED_CACHES = {
+    "rules": ("rules", "rules_data_versions"),
+    "releases": ("update_responses",),
+    "releases_json": ("update_responses",),
+    "release_assets": ("update_responses",),
+    "emergency_shutoffs": ("emergency_shutoffs", "updates_disabled"),
+    "pinnable_releases": ("pin_mappings",),
+}
+
+
+def evict(table_name, row_key):
+    """Evicts the cache entries that were built from the changed row, or
+    from any row of the table when row_key is None."""
+    for name in EVICTED_CACHES.get(table_name, ()):
+        if row_key is None:
+            cache.clear(name)
+        else:
+            cache.invalidate(name, row_key)
+    for name in CLEARED_CACHES.get(table_name, ()):
+        cache.clear(name)
+
+
+class CacheInvalidator(object):
+    """Watches the ChangeLog for changes made by the admin app, and evicts
+    the cache entries that were built from the changed rows, which lets the
+    caches hold on to entries for much longer than they otherwise could.
+
+    The ChangeLog is checked at most once every `interval` seconds. Changes are
+    numbered in the order that they're made, which isn't necessarily the order
+    that they're committed in, so a change may become visible after one with a
+    higher change_id. To make sure that those aren't missed, every check looks
+    at the changes that come after the `lookback` most recent ones that we've
+    seen, and skips the ones that we've already handled.
+
+    The first check only finds out where the ChangeLog is up to (unless
+    `start` has already done so). Nothing is evicted by it, because it's
+    assumed to happen before anything is cached. When the caches are filled
+    in advance (see auslib.services.warmup), `start` must be called before
+    they are, so that the changes made while they're being filled are evicted
+    by the first check.
+
+    Functions in `listeners` are called with the table_name and row_key of
+    every change, after the cache entries affected by it have been evicted."""
+
+    def __init__(self, interval, lookback=50):
+        self.interval = interval
+        self.lookback = lookback
+        self.change_id = None
+        self.seen = set()
+        self.listeners = []
+        self.next_check = 0
+        self.lock = threading.Lock()
+
+    def start(self, transaction=None):
+        """Finds out where the ChangeLog is up to. Changes made after this are
+        evicted by the next check."""
+        self.change_id = dbo.changeLog.getLatestChangeId(transaction=transaction)
+        self.seen = {c["change_id"] for c in dbo.changeLog.getChangesSince(self.change_id - self.lookback, transaction=transaction)}
+
+    def check(self, transaction=None):
+        """Evicts the cache entries affected by any changes made since the
+        last check, if it's time for another one. Returns the number of new
+        changes that were found."""
+        now = time.time()
+        if now < self.next_check or not self.lock.acquire(blocking=False):
+            return 0
+
+        try:
+            self.next_check = now + self.interval
+            if self.change_id is None:
+                self.start(transaction=transaction)
+                return 0
+
+            changes = [c for c in dbo.changeLog.getChangesSince(self.change_id - self.lookback, transaction=transaction) if c["change_id"] not in self.seen]
+            for change in changes:
+                evict(change["table_name"], change["row_key"])
+                for listener in self.listeners:
+                    listener(change["table_name"], change["row_key"])
+                self.seen.add(change["change_id"])
+                self.change_id = max(self.change_id, change["change_id"])
+            if changes:
+                log.debug("Evicted cache entries for %d changes, up to change %d", len(changes), self.change_id)
+            self.seen = {change_id for change_id in self.seen if change_id > self.change_id - self.lookback}
+            return len(changes)
+        finally:
+            self.lock.release()
@@ -1,5 +1,7 @@
 import asyncio
+import contextvars
 import logging
+from contextlib import contextmanager
 from copy import deepcopy
 
 from aiohttp import ClientError
@@ -14,7 +16,7 @@ from auslib.util.versions import MozillaVersion
 from ..blobs.base import createBlob
 from ..errors import PermissionDeniedError, ReadOnlyError, SignoffRequiredError
 from ..global_state import cache, dbo
-from ..util.data_structures import ensure_path_exists, get_by_path, infinite_defaultdict, set_by_path
+from ..util.data_structures import HashCachingTuple, ensure_path_exists, get_by_path, infinite_defaultdict, set_by_path
 from ..util.signoffs import serialize_signoff_requirements
 from ..util.timestamp import getMillisecondTimestamp
 
@@ -331,45 +333,122 @@ def get_asset_rows(name, trans):
 
 
 def get_asset_data_versions(name, trans):
-    return (
-        dbo.release_assets.select(where={"name": name}, columns=[dbo.release_assets.data_version], order_by=[dbo.release_assets.path], transaction=trans) or []
+    rows = dbo.release_assets.select(
+        where={"name": name}, columns=[dbo.release_assets.path, dbo.release_assets.data_version], order_by=[dbo.release_assets.path], transaction=trans
     )
+    return asset_data_versions(rows or [])
 
 
-def get_release(name, trans, include_sc=True):
-    # Get all of the base and asset information, potentially from a cache
-    base_row = cache.get("releases", name, lambda: get_base_row(name, trans))
-    base_data_version = cache.get("releases_data_version", name, lambda: get_base_data_version(name, trans))
-    asset_rows = cache.get("release_assets", name, lambda: get_asset_rows(name, trans))
-    asset_data_versions = cache.get("release_assets_data_versions", name, lambda: get_asset_data_versions(name, trans))
+def load_releases(names, trans):
+    """Caches the base and asset rows of the named releases, and their data
+    versions, for any of them that aren't cached already. Everything that's
+    missing is retrieved with a single query, rather than the (up to) four
+    that get_release would make for each release. This should be called
+    before looking up a number of releases with get_release."""
+    if not cache.has_cache("releases"):
+        return
 
-    data_versions = infinite_defaultdict()
-    sc_data_versions = infinite_defaultdict()
-    base_blob = {}
-    sc_blob = {}
+    missing_rows = []
+    missing_versions = []
+    for name in dict.fromkeys(names):
+        if not cache.contains("releases", name) or not cache.contains("release_assets", name):
+            missing_rows.append(name)
+        elif not cache.contains("releases_data_version", name) or not cache.contains("release_assets_data_versions", name):
+            missing_versions.append(name)
+
+    if missing_rows:
+        releases = dbo.releases_json.getReleasesWithAssets(missing_rows, transaction=trans)
+        for name in missing_rows:
+            base_row, asset_rows = releases.get(name, (None, []))
+            cache.put("releases", name, base_row)
+            cache.put("release_assets", name, asset_rows)
+            cache.put("releases_data_version", name, base_row["data_version"] if base_row else None)
+            cache.put("release_assets_data_versions", name, asset_data_versions(asset_rows))
+
+    if missing_versions:
+        releases = dbo.releases_json.getReleasesWithAssets(missing_versions, versions_only=True, transaction=trans)
+        for name in missing_versions:
+            base_row, asset_rows = releases.get(name, (None, []))
+            cache.put("releases_data_version", name, base_row["data_version"] if base_row else None)
+            cache.put("release_assets_data_versions", name, asset_data_versions(asset_rows))
+
+
+def asset_data_versions(asset_rows):
+    """Returns the paths and data versions of the given asset rows, in a form
+    that can be used as part of a cache key."""
+    return HashCachingTuple((r["path"], r["data_version"]) for r in asset_rows)
+
+
+def assemble_release(base_row, asset_rows):
+    """Builds the blob and data versions of a release out of its base row and
+    asset rows, without modifying either of them. Only the dicts that assets
+    are inserted into are copied, everything else is shared with the rows."""
+    blob = {}
+    data_versions = {}
     if base_row:
-        # base_data_version is cached for a shorter period of time than the overall row
-        # because it's cheap to retrieve. if the cached row's data_version is older than
-        # the cached data_version we will forcibly update it to make sure we minimize
-        # the time we're serving old release data
-        if base_row["data_version"] < base_data_version:
-            base_row = get_base_row(name, trans)
-        base_blob = base_row["data"]
+        blob = dict(base_row["data"])
         data_versions["."] = base_row["data_version"]
 
-    # same thing here for the assets -- if any of the full asset data versions
-    # do not match the cached asset data versions, we forcibly update
-    if [r["data_version"] for r in asset_rows] != [r["data_version"] for r in asset_data_versions]:
-        asset_rows = get_asset_rows(name, trans)
-
+    copied = {}
     for asset in asset_rows:
         path = asset["path"].split(".")[1:]
-        ensure_path_exists(base_blob, path)
-        set_by_path(base_blob, path, asset["data"])
-        set_by_path(data_versions, path, asset["data_version"])
-        if sc_blob:
-            ensure_path_exists(sc_blob, path)
-            set_by_path(sc_blob, path, asset["data"])
+        parent = blob
+        versions = data_versions
+        for i, key in enumerate(path[:-1]):
+            prefix = tuple(path[: i + 1])
+            node = copied.get(prefix)
+            if node is None:
+                node = copied[prefix] = dict(parent.get(key, {}))
+                parent[key] = node
+            parent = node
+            versions = versions.setdefault(key, {})
+        parent[path[-1]] = asset["data"]
+        versions[path[-1]] = asset["data_version"]
+
+    return blob, data_versions
+
+
+def get_assembled_release(name, trans):
+    """Returns the blob of the named release, its data versions, and those
+    data versions flattened (see flatten_data_versions), all of which may be
+    shared with other callers (through the "assembled_releases" cache), so
+    they must not be modified."""
+    # Get all of the base and asset information, potentially from a cache
+    base_row = cache.get("releases", name, lambda: get_base_row(name, trans))
+    base_data_version = cache.get("releases_data_version", name, lambda: get_base_data_version(name, trans))
+    asset_versions = cache.get("release_assets_data_versions", name, lambda: get_asset_data_versions(name, trans))
+
+    # base_data_version is cached for a shorter period of time than the overall row
+    # because it's cheap to retrieve. if the cached row's data_version is older than
+    # the cached data_version we will forcibly update it to make sure we minimize
+    # the time we're serving old release data
+    if base_row and base_row["data_version"] < base_data_version:
+        base_row = get_base_row(name, trans)
+
+    def assemble():
+        asset_rows = cache.get("release_assets", name, lambda: get_asset_rows(name, trans))
+        # same thing here for the assets -- if any of the full asset data versions
+        # do not match the cached asset data versions, we forcibly update
+        if asset_data_versions(asset_rows) != asset_versions:
+            asset_rows = get_asset_rows(name, trans)
+        blob, data_versions = assemble_release(base_row, asset_rows)
+        return blob, data_versions, flatten_data_versions(data_versions)
+
+    # Putting the releases together is relatively expensive for releases with many
+    # assets, so we cache the result for each combination of data versions we see.
+    assembled_key = (name, base_row["data_version"] if base_row else None, asset_versions)
+    return cache.get("assembled_releases", assembled_key, assemble)
+
+
+def get_release(name, trans, include_sc=True):
+    """Returns the blob and data versions of the named release, and those of
+    its scheduled changes if include_sc is True. The blob and data versions
+    may be shared with other callers (through the "assembled_releases" cache),
+    so they must not be modified."""
+    base_blob, data_versions, _ = get_assembled_release(name, trans)
+
+    sc_data_versions = infinite_defaultdict()
+    sc_blob = {}
 
     if include_sc:
         scheduled_row = dbo.releases_json.scheduled_changes.select(where={"base_name": name, "complete": False}, transaction=trans)
@@ -398,6 +477,161 @@ def get_release(name, trans, include_sc=True):
         return None
 
 
+def flatten_data_versions(data_versions):
+    """Converts nested data versions (as returned by get_release) into a sorted
+    tuple of (path, data_version) pairs, which can be used as part of a cache key."""
+
+    def flatten(data_versions, path):
+        for key, value in data_versions.items():
+            if isinstance(value, dict):
+                yield from flatten(value, path + (key,))
+            else:
+                yield (".".join(path + (key,)), value)
+
+    return HashCachingTuple(sorted(flatten(data_versions, ())))
+
+
+def get_release_blob(name, trans):
+    """Returns the named release as a Blob, or None if it doesn't exist. The
+    Blob's data_versions are set to the flattened data versions of the rows it
+    was built from.
+
+    When the "release_blobs" cache exists, constructed Blobs are cached by name
+    and only rebuilt when the data versions of the release change. Blobs that
+    come from the cache are shared between requests, so callers must not
+    modify them."""
+    # The flattened data versions come from the "assembled_releases" cache
+    # too, so that they aren't rebuilt (and compared item by item) each time.
+    base_blob, _, data_versions = get_assembled_release(name, trans)
+    if not base_blob:
+        return None
+    blob = cache.get("release_blobs", name)
+    if blob is None or (blob.data_versions is not data_versions and blob.data_versions != data_versions):
+        blob = createBlob(base_blob)
+        blob.data_versions = data_versions
+        cache.put("release_blobs", name, blob)
+    return blob
+
+
+def _find_release_blob(name, trans):
+    blob = get_release_blob(name, trans)
+    # TODO: remove me when old releases table dies
+    if blob is None:
+        try:
+            blob = dbo.releases.getReleaseBlob(name=name, transaction=trans)
+        except KeyError:
+            blob = None
+    if blob is None:
+        cache.put("missing_releases", name, True)
+    return blob
+
+
+def find_release_blob(name, trans):
+    """Returns the named release's Blob, looking for it in the old releases
+    table too, or None if it exists in neither. Releases that don't exist are
+    remembered in the "missing_releases" cache, and aren't looked for again
+    until their entries expire or are evicted."""
+    if cache.get("missing_releases", name):
+        return None
+    return _find_release_blob(name, trans)
+
+
+class ReleaseBlobMemo(object):
+    """Looks up release Blobs (including ones that only exist in the old
+    releases table) within a single transaction, and remembers the ones it
+    has found, so each release is only looked up once."""
+
+    def __init__(self, trans):
+        self.trans = trans
+        self.blobs = {}
+
+    def load(self, names):
+        """Looks up all of the given releases that haven't been already,
+        retrieving the ones that aren't cached with a single query."""
+        missing = [name for name in dict.fromkeys(names) if name not in self.blobs]
+        # Releases that we've recently found not to exist (eg: old names that
+        # partials or fallbackMappings still point at) aren't looked for again
+        # until their entries in the "missing_releases" cache expire or are evicted.
+        for name in missing:
+            if cache.get("missing_releases", name):
+                self.blobs[name] = None
+        missing = [name for name in missing if name not in self.blobs]
+        if not missing:
+            return
+
+        load_releases(missing, self.trans)
+        for name in missing:
+            self.blobs[name] = _find_release_blob(name, self.trans)
+
+    def get(self, name):
+        """Returns the named release's Blob, or None if it doesn't exist."""
+        self.load([name])
+        return self.blobs[name]
+
+
+_release_blob_memo = contextvars.ContextVar("release_blob_memo", default=None)
+
+
+@contextmanager
+def memoize_release_blobs(trans, names=()):
+    """Makes get_memoized_release_blob look up releases within the given
+    transaction, and remember them, until the context exits. Typically this
+    wraps the rendering of a single response. The given releases are looked
+    up in advance, all at once."""
+    memo = ReleaseBlobMemo(trans)
+    memo.load(names)
+    token = _release_blob_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _release_blob_memo.reset(token)
+
+
+def get_memoized_release_blob(name):
+    """Returns the named release's Blob, or None if it doesn't exist. Inside of
+    memoize_release_blobs this uses its transaction and memo, otherwise the
+    release is looked up in a transaction of its own."""
+    memo = _release_blob_memo.get()
+    if memo is None:
+        memo = ReleaseBlobMemo(None)
+    return memo.get(name)
+
+
+def get_current_release_blob_memo():
+    """Returns the ReleaseBlobMemo of the innermost memoize_release_blobs
+    context, or None outside of one."""
+    return _release_blob_memo.get()
+
+
+def get_release_products(names, trans):
+    """Returns the products of the named releases, keyed by name. Releases
+    whose rows are in the "releases" cache don't need to be queried for, and
+    the rest are looked up with (at most) one query of each releases table.
+    Releases that don't exist are left out."""
+    products = {}
+    missing = []
+    for name in names:
+        base_row = cache.get("releases", name)
+        if base_row:
+            products[name] = base_row["product"]
+        else:
+            missing.append(name)
+
+    if missing:
+        table = dbo.releases_json
+        for row in table.select(where=[table.name.in_(missing)], columns=[table.name, table.product], transaction=trans):
+            products[row["name"]] = row["product"]
+        missing = [name for name in missing if name not in products]
+
+    # TODO: remove me when old releases table dies
+    if missing:
+        table = dbo.releases
+        for row in table.select(where=[table.name.in_(missing)], columns=[table.name, table.product], transaction=trans):
+            products[row["name"]] = row["product"]
+
+    return products
+
+
 def get_product(name, trans):
     if not exists(name, trans):
         return None
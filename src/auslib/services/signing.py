@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ..global_state import dbo
+from ..util.autograph import make_hash, make_session, sign_hash
+
+log = logging.getLogger(__name__)
+
+# Changes to these tables can change the responses that we've signed.
+RESPONSE_TABLES = ("rules", "releases", "releases_json", "release_assets")
+
+
+class SigningError(Exception):
+    """Raised when content that has to be served couldn't be signed in time."""
+
+
+class Signature(object):
+    __slots__ = ("signature", "x5u", "signed_at", "used")
+
+    def __init__(self, signature, x5u, signed_at):
+        self.signature = signature
+        self.x5u = x5u
+        self.signed_at = signed_at
+        # Whether or not the signature has been served since it was obtained.
+        self.used = False
+
+    @property
+    def headers(self):
+        return {"Content-Signature": f"x5u={self.x5u}; p384ecdsa={self.signature}"}
+
+
+class SigningService(object):
+    """Gets content signatures from Autograph in background threads, so that
+    requests rarely wait for it. Signatures are kept for the hashes of the
+    content that they sign, and are looked up with get_headers. Content that
+    doesn't have a signature yet is signed before it's returned, because
+    clients reject unsigned content, but requests wait no longer than
+    `timeout` seconds for that (and are told to try again later if they
+    have to), and only one of them asks Autograph for it. The responses that
+    are most likely to be asked for are signed before uWSGI forks the workers
+    (see auslib.web.public.client.presign_responses).
+
+    Signatures are obtained again once they're `refresh_after` seconds old,
+    which is done in the background (and ahead of time, by check, for the
+    ones that are being used), and are no longer served once they're
+    `max_age` seconds old.
+
+    Responses that may need to be signed again are registered with remember,
+    along with the names of the releases that they were built from, and a
+    function that renders them. When one of those releases (or any rule)
+    changes, release_changed renders the response again, and signs the new
+    content before any request asks for it. This should be registered as a
+    listener of the CacheInvalidator, which is what finds those changes.
+
+    All requests to Autograph are made with one Session, which keeps the
+    connections to it open. The threads that make them are only started when
+    there's something to sign, so the service can be created before uWSGI
+    forks its workers."""
+
+    def __init__(self, app, workers=4, maxsize=1000, refresh_after=20 * 60 * 60, max_age=25 * 60 * 60, interval=60, max_responses=100, timeout=5):
+        self.app = app
+        self.maxsize = maxsize
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.interval = interval
+        self.max_responses = max_responses
+        self.timeout = timeout
+        self.session = make_session(workers)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="SigningService")
+        self.lock = threading.Lock()
+        self.signatures = OrderedDict()
+        # The keys of the content that's being signed, and Events that are set
+        # once that's done.
+        self.pending = {}
+        self.responses = OrderedDict()
+        self.next_check = time.time() + interval
+
+    def _needs_signing(self, key, now):
+        """Returns True if the content identified by key needs to be signed,
+        and marks it as pending if so. Must be called with the lock held."""
+        if key in self.pending:
+            return False
+        entry = self.signatures.get(key)
+        if entry and now - entry.signed_at < self.refresh_after:
+            return False
+        self.pending[key] = threading.Event()
+        return True
+
+    def _get_servable(self, key, now):
+        """Returns the signature of the content identified by key, if there's
+        one that isn't too old to serve. Must be called with the lock held."""
+        entry = self.signatures.get(key)
+        if entry and now - entry.signed_at < self.max_age:
+            return entry
+        return None
+
+    def _sign(self, key):
+        product, hash_ = key
+        prefix = product + "_" if product else ""
+        config = self.app.config
+        try:
+            signature, x5u = sign_hash(
+                config["AUTOGRAPH_%sURL" % prefix],
+                config["AUTOGRAPH_%sKEYID" % prefix],
+                config["AUTOGRAPH_%sUSERNAME" % prefix],
+                config["AUTOGRAPH_%sPASSWORD" % prefix],
+                hash_,
+                self.session,
+            )
+        except Exception:
+            log.exception("Failed to sign content for %s", product or "the default key")
+            with self.lock:
+                self.pending.pop(key).set()
+            return None
+
+        entry = Signature(signature, x5u, time.time())
+        with self.lock:
+            self.pending.pop(key).set()
+            self.signatures[key] = entry
+            self.signatures.move_to_end(key)
+            while len(self.signatures) > self.maxsize:
+                self.signatures.popitem(last=False)
+        return entry
+
+    def get_headers(self, content, product):
+        """Returns the Content-Signature header for content. Content that
+        doesn't have a signature that can be served is signed first, and
+        SigningError is raised if that fails, or takes longer than `timeout`
+        seconds. Signatures that only need refreshing are refreshed in the
+        background."""
+        key = (product, make_hash(content))
+        now = time.time()
+        with self.lock:
+            entry = self._get_servable(key, now)
+            if entry:
+                entry.used = True
+                self.signatures.move_to_end(key)
+            submit = self._needs_signing(key, now)
+            done = self.pending.get(key)
+        if submit:
+            self.executor.submit(self._sign, key)
+        if entry:
+            return entry.headers
+
+        # Another request (or the executor) may already be signing it, in which
+        # case we wait for that rather than asking Autograph again.
+        done.wait(self.timeout)
+        with self.lock:
+            entry = self._get_servable(key, time.time())
+            if entry:
+                entry.used = True
+        if not entry:
+            raise SigningError("Content for {} wasn't signed within {} seconds".format(product or "the default key", self.timeout))
+        return entry.headers
+
+    def presign(self, content, product):
+        """Signs content in the calling thread, unless it already has a signature
+        that doesn't need refreshing, or is already being signed. Returns True
+        if it was signed."""
+        key = (product, make_hash(content))
+        with self.lock:
+            if not self._needs_signing(key, time.time()):
+                return False
+        return self._sign(key) is not None
+
+    def remember(self, key, product, names, render):
+        """Registers a response to be signed again when any of the named
+        releases change. render is called with a transaction, and returns the
+        content of the response (or None, if there isn't one anymore)."""
+        with self.lock:
+            self.responses[key] = (product, frozenset(names), render)
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.max_responses:
+                self.responses.popitem(last=False)
+
+    def _render_and_sign(self, product, render):
+        try:
+            with self.app.app_context():
+                with dbo.begin() as trans:
+                    content = render(trans)
+        except Exception:
+            log.exception("Failed to render a response to sign")
+            return False
+        if content is None:
+            return False
+        return self.presign(content, product)
+
+    def release_changed(self, table_name, row_key):
+        """Re-renders and signs the remembered responses that the changed row
+        may affect, in the background. row_key is the name of the release
+        that changed, or None if it's unknown. Returns the number of responses
+        that will be signed."""
+        if table_name not in RESPONSE_TABLES:
+            return 0
+        with self.lock:
+            affected = [(product, render) for product, names, render in self.responses.values() if table_name == "rules" or row_key is None or row_key in names]
+        for product, render in affected:
+            self.executor.submit(self._render_and_sign, product, render)
+        return len(affected)
+
+    def check(self):
+        """Signs the content whose signatures have been used, and will need
+        refreshing before the next check, and forgets the signatures that are
+        too old to serve. This happens at most once every `interval` seconds.
+        Returns the number of signatures that will be refreshed."""
+        now = time.time()
+        if now < self.next_check:
+            return 0
+
+        refresh = []
+        with self.lock:
+            if now < self.next_check:
+                return 0
+            self.next_check = now + self.interval
+            for key, entry in list(self.signatures.items()):
+                age = now - entry.signed_at
+                if age >= self.max_age and key not in self.pending:
+                    del self.signatures[key]
+                elif entry.used and age >= self.refresh_after - self.interval and key not in self.pending:
+                    self.pending[key] = threading.Event()
+                    refresh.append(key)
+        for key in refresh:
+            self.executor.submit(self._sign, key)
+        if refresh:
+            log.debug("Refreshing %d content signatures", len(refresh))
+        return len(refresh)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,107 @@
+import logging
+import time
+
+from ..AUS import getFallbackChannel
+from ..global_state import cache, dbo
+from .releases import ReleaseBlobMemo
+
+log = logging.getLogger(__name__)
+
+
+def warm_rules(trans):
+    """Caches the rules table (as an index, when the "rules_index" cache
+    exists), and returns all of its rules."""
+    if cache.has_cache("rules_index"):
+        return dbo.rules.getRuleIndex(transaction=trans).rules
+    return dbo.rules.select(transaction=trans)
+
+
+def warm_emergency_shutoffs(rules, trans):
+    """Caches the emergency shutoffs. When they're cached individually (in
+    "updates_disabled"), whether or not updates are disabled is cached for
+    every product and channel that the given rules apply to, and for those
+    that have been shut off."""
+    shutoffs = dbo.emergencyShutoffs.getShutoffs(transaction=trans)
+    if cache.has_cache("emergency_shutoffs"):
+        return
+
+    product_channels = set(shutoffs)
+    for rule in rules:
+        # Rules that don't specify a product or channel, or that use globs,
+        # can't tell us what products and channels will be queried for.
+        if rule["product"] and rule["channel"] and not rule["channel"].endswith("*"):
+            product_channels.add((rule["product"], rule["channel"]))
+            product_channels.add((rule["product"], getFallbackChannel(rule["channel"])))
+    for product_channel in product_channels:
+        cache.put("updates_disabled", product_channel, product_channel in shutoffs)
+
+
+def warm_releases(names, trans):
+    """Caches the named releases, the releases that any superblobs among them
+    respond with, and the releases that all of their partials are from. Each
+    of those sets of releases is retrieved with a single query."""
+    memo = ReleaseBlobMemo(trans)
+    memo.load(names)
+    response_blobs = set()
+    for name in names:
+        blob = memo.get(name)
+        if blob:
+            response_blobs.update(blob.getResponseBlobs() or ())
+    memo.load(response_blobs)
+
+    referenced_releases = set()
+    for name in set(names) | response_blobs:
+        blob = memo.get(name)
+        if blob:
+            referenced_releases.update(blob.getCachedReferencedReleases())
+    referenced_releases.discard("*")
+    memo.load(referenced_releases)
+    return len(memo.blobs)
+
+
+def warm_caches(trans):
+    """Loads the data that the public app needs to serve most requests into
+    the caches: the rules, the emergency shutoffs, the pinnable releases, and
+    the releases that rules or pinnable releases point at (see warm_releases).
+    Returns the number of releases that were loaded."""
+    rules = warm_rules(trans)
+    warm_emergency_shutoffs(rules, trans)
+
+    names = set()
+    for rule in rules:
+        names.update((rule["mapping"], rule["fallbackMapping"]))
+    names.update(dbo.pinnable_releases.getPinMappings(transaction=trans).values())
+    names.discard(None)
+    return warm_releases(sorted(names), trans)
+
+
+class CacheWarmer(object):
+    """Runs warm_caches. A failure only means that the caches will be filled
+    by requests instead. This should be run before the app's workers are
+    forked (see uwsgi/public.wsgi), so that they all start out with the same
+    warm caches, and the database only gets one set of queries per host.
+
+    When an `invalidator` (see auslib.services.invalidation) is given, it's
+    started before the caches are warmed, so that the changes made while
+    they're being warmed, or before a worker's first check, are evicted from
+    them by the workers' first checks.
+
+    `presign` is called with the transaction once the caches are warm, and
+    returns the number of responses that it signed (see
+    auslib.web.public.client.presign_responses)."""
+
+    def __init__(self, invalidator=None, presign=None):
+        self.invalidator = invalidator
+        self.presign = presign
+
+    def run(self):
+        start = time.time()
+        try:
+            with dbo.begin() as trans:
+                if self.invalidator:
+                    self.invalidator.start(transaction=trans)
+                count = warm_caches(trans)
+                signed = self.presign(trans) if self.presign else 0
+            log.info("Warmed caches with %d releases, and signed %d responses, in %.2f seconds", count, signed, time.time() - start)
+        except Exception:
+            log.exception("Failed to warm caches")
@@ -2,6 +2,7 @@ from base64 import b64encode
 from hashlib import sha384
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests_hawk import HawkAuth
 
 from auslib.util.retry import retry_sync
@@ -10,21 +11,45 @@ SIGNATURE_PREFIX = "Content-Signature:\x00"
 
 
 def make_hash(content):
+    """Returns the hash of content (a str, or ASCII encoded bytes) that
+    Autograph needs to sign it."""
+    if isinstance(content, bytes):
+        if not content.isascii():
+            raise ValueError("Only ASCII content can be signed")
+        return sha384(SIGNATURE_PREFIX.encode("ascii") + content).digest()
     templated = f"{SIGNATURE_PREFIX}{content}".encode("ascii")
     return sha384(templated).digest()
 
 
-def _sign_hash(autograph_uri, keyid, id_, key, hash_):
-    auth = HawkAuth(id=id_, key=key)
-    with requests.Session() as session:
-        body = [{"input": b64encode(hash_).decode("ascii"), "keyid": keyid}]
-        r = session.post(f"{autograph_uri}/sign/hash", json=body, auth=auth)
-        r.raise_for_status()
-        response = r.json()
-        if len(response) != 1:
-            raise Exception("Response is not length 1, cannot parse it")
-        return response[0]["signature"], response[0]["x5u"]
+def make_session(pool_size=10):
+    """Returns a Session that keeps up to pool_size connections to each
+    Autograph host open, so that they can be reused by subsequent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
-def sign_hash(autograph_uri, keyid, id, key, hash):
-    return retry_sync(_sign_hash, args=(autograph_uri, keyid, id, key, hash), attempts=3, sleeptime_kwargs={"delay_factor": 2.0})
+def _sign_hash(autograph_uri, keyid, id_, key, hash_, session=None):
+    auth = HawkAuth(id=id_, key=key)
+    body = [{"input": b64encode(hash_).decode("ascii"), "keyid": keyid}]
+    if session is None:
+        with requests.Session() as session:
+            r = session.post(f"{autograph_uri}/sign/hash", json=body, auth=auth)
+    else:
+        r = session.post(f"{autograph_uri}/sign/hash", json=body, auth=auth)
+    r.raise_for_status()
+    response = r.json()
+    if len(response) != 1:
+        raise Exception("Response is not length 1, cannot parse it")
+    return response[0]["signature"], response[0]["x5u"]
+
+
+def sign_hash(autograph_uri, keyid, id, key, hash, session=None):
+    args = (autograph_uri, keyid, id, key, hash)
+    # The session is only passed along when there is one, so that _sign_hash
+    # can be replaced with something that doesn't accept it (eg: in tests).
+    if session is not None:
+        args += (session,)
+    return retry_sync(_sign_hash, args=args, attempts=3, sleeptime_kwargs={"delay_factor": 2.0})
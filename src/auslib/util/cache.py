@@ -1,9 +1,258 @@
+import hashlib
+import json
+import logging
+import pickle
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
 from copy import deepcopy
+from types import ModuleType
 
 from repoze.lru import ExpiringLRUCache
 
+from auslib.util.data_structures import freeze
+
 uncached_sentinel = object()
 
+log = logging.getLogger(__name__)
+
+# Values in shared caches are prefixed with the time that they expire at,
+# so that the remaining time can be carried over to the local cache.
+EXPIRES = struct.Struct("!d")
+
+
+class CopiedValue(object):
+    """Holds a copy of a value that couldn't be frozen, which needs to be
+    copied again every time it's retrieved from the cache."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CacheStats(object):
+    """Counters for one of MaybeCacher's caches, which add to the ones that
+    ExpiringLRUCache keeps itself. Those are reset whenever the cache is
+    cleared, so they're added to these first (see MaybeCacher.clear)."""
+
+    __slots__ = ("lookups", "hits", "misses", "evictions", "expirations", "shared_hits", "stale_hits", "loads", "load_errors", "load_time")
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, 0)
+
+    def absorb(self, lru_cache):
+        self.lookups += lru_cache.lookups
+        self.hits += lru_cache.hits
+        self.misses += lru_cache.misses
+        self.evictions += lru_cache.evictions
+
+
+def approximate_size(values):
+    """Returns the approximate number of bytes used by the given values,
+    including everything that they contain. Objects that are referred to more
+    than once are only counted once."""
+    seen = set()
+    size = 0
+    pending = list(values)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (type, ModuleType)) or callable(obj):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float)):
+            if hasattr(obj, "__dict__"):
+                pending.append(obj.__dict__)
+            for attr in getattr(type(obj), "__slots__", ()):
+                if hasattr(obj, attr):
+                    pending.append(getattr(obj, attr))
+    return size
+
+
+def estimated_size(value):
+    """Returns an estimate of the number of bytes used by the value, which is
+    the length of its JSON serialization, for values that can be serialized.
+    That's cheaper to calculate than approximate_size for large blobs, but
+    is a fraction of the memory that they actually use."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    try:
+        return len(json.dumps(value, separators=(",", ":")))
+    except (TypeError, ValueError):
+        return approximate_size([value])
+
+
+class SizedLRUCache(object):
+    """An LRU cache with the same interface as repoze.lru's ExpiringLRUCache,
+    which is bounded by the estimated number of bytes used by its values (see
+    estimated_size) as well as by the number of them. Values are sized once,
+    when they're put in the cache, and ones that are larger than the entire
+    budget aren't cached at all. Like ExpiringLRUCache, expired values are
+    left in place until they're replaced or evicted."""
+
+    def __init__(self, size, default_timeout, maxbytes):
+        self.size = size
+        self.default_timeout = default_timeout
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # Values are (bytes, value, expires) triplets, in least to most recently used order.
+            self.data = OrderedDict()
+            self.bytes = 0
+            self.lookups = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        entry = self.data.get(key)
+        if entry is None or entry[2] <= time.time():
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        try:
+            self.data.move_to_end(key)
+        # It may have been evicted by another thread since we got it.
+        except KeyError:
+            pass
+        return entry[1]
+
+    def put(self, key, val, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        size = estimated_size(val)
+        with self.lock:
+            self._remove(key)
+            if size > self.maxbytes:
+                log.debug("Not caching %s, which is larger than the cache (%d bytes)", key, size)
+                return
+
+            self.data[key] = (size, val, time.time() + timeout)
+            self.bytes += size
+            while self.bytes > self.maxbytes or len(self.data) > self.size:
+                _, (evicted_size, _, _) = self.data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[0]
+
+
+class PendingLoad(object):
+    """A value that's being loaded by one thread, which other threads can
+    wait for rather than loading it themselves."""
+
+    __slots__ = ("thread", "done", "value", "error")
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SharedCache(object):
+    """Base class for caches that are shared between processes, such as the
+    workers of a uWSGI app. MaybeCacher uses them as a second level behind its
+    own in-process caches, so that values only need to be loaded once per
+    host rather than once per process. Shared caches store bytes, keyed by
+    strings, and are responsible for expiring them after the given timeout."""
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def put(self, key, value, timeout):
+        raise NotImplementedError()
+
+    def contains(self, key):
+        return self.get(key) is not None
+
+    def invalidate(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class LocalSharedCache(SharedCache):
+    """A SharedCache that isn't shared with anything, which is useful for
+    testing and local development."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, 0))
+        if expires <= time.time():
+            return None
+        return value
+
+    def put(self, key, value, timeout):
+        self.data[key] = (value, time.time() + timeout)
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+class UWSGISharedCache(SharedCache):
+    """A SharedCache backed by one of uWSGI's caches (see
+    https://uwsgi-docs.readthedocs.io/en/latest/Caching.html), which must be
+    configured with a cache2 option of the same name. Its blocksize (or its
+    number of blocks, when bitmap mode is used) must be large enough for the
+    largest value that's put into it, otherwise those values won't be shared."""
+
+    def __init__(self, name):
+        # The uwsgi module only exists inside of uWSGI processes.
+        import uwsgi
+
+        self.uwsgi = uwsgi
+        self.name = name
+
+    def get(self, key):
+        return self.uwsgi.cache_get(key, self.name)
+
+    def put(self, key, value, timeout):
+        # uWSGI's expiry is in whole seconds, and 0 means never.
+        self.uwsgi.cache_update(key, value, max(int(timeout), 1), self.name)
+
+    def contains(self, key):
+        return bool(self.uwsgi.cache_exists(key, self.name))
+
+    def invalidate(self, key):
+        self.uwsgi.cache_del(key, self.name)
+
+    def clear(self):
+        self.uwsgi.cache_clear(self.name)
+
 
 class MaybeCacher(object):
     """MaybeCacher is a very simple wrapper to work around the fact that we
@@ -13,9 +262,34 @@ class MaybeCacher(object):
     blob versions can change frequently). This class is intended to be
     instantiated as a global object, and then have caches created by consumers
     through calls to make_cache. Consumers that make changes (ie: the admin
-    app) generally also set make_copies to True to get the cache to copy values
-    on get/put to avoid the possibility of accidental cache pollution. For
-    performance reasons, this should be disabled when not necessary.
+    app) generally also set make_copies to True to avoid the possibility of
+    accidental cache pollution. When it is set, values are frozen (see
+    auslib.util.data_structures.freeze) as they go into the cache, and the
+    frozen values are returned by get, so they're only copied once rather than
+    on every access. Anything that wants to modify a value it got from the
+    cache needs to thaw() it first. Values that can't be frozen are copied
+    on every get/put instead. For performance reasons, this should be disabled
+    when not necessary.
+
+    Caches may also be given a SharedCache, which is looked in when a key
+    isn't found in the process' own cache, and has everything that's put into
+    that cache put into it as well. Values in shared caches are pickled, and
+    their keys are derived from the repr of the keys they're given, so they can
+    only be used for caches whose keys have stable reprs (eg: strings, numbers
+    and tuples of them). Values that can't be pickled are only cached locally.
+
+    When a key isn't cached, only one thread calls value_getter for it at
+    a time. Other threads that want the same key wait for it to finish, and
+    get the same value (or exception) that it does. Caches that are created
+    with a stale_timeout return an expired value to those threads instead, as
+    long as it expired less than stale_timeout seconds ago, so that only the
+    thread that reloads it has to wait.
+
+    Caches that are created with a maxbytes are bounded by the estimated size
+    of their values as well as by the number of them (see SizedLRUCache).
+
+    Statistics about each cache, such as how often values are found in it,
+    and how long it takes to load them when they aren't, are returned by stats.
 
     If the cache given to get/put/clear/invalidate doesn't exist, these methods
     are essentially no-ops. In a world where bug 1109295 is fixed, we might
@@ -23,6 +297,11 @@ class MaybeCacher(object):
 
     def __init__(self):
         self.caches = {}
+        self.shared = {}
+        self.stale_timeouts = {}
+        self._stats = {}
+        self._loads = {}
+        self._loads_lock = threading.Lock()
         self._make_copies = False
 
     @property
@@ -35,13 +314,69 @@ class MaybeCacher(object):
             raise TypeError("make_copies must be True or False")
         self._make_copies = value
 
-    def make_cache(self, name, maxsize, timeout):
+    def make_cache(self, name, maxsize, timeout, shared=None, stale_timeout=None, maxbytes=None):
         if name in self.caches:
             raise Exception()
-        self.caches[name] = ExpiringLRUCache(maxsize, timeout)
+        if maxbytes is not None:
+            self.caches[name] = SizedLRUCache(maxsize, timeout, maxbytes)
+        else:
+            self.caches[name] = ExpiringLRUCache(maxsize, timeout)
+        self._stats[name] = CacheStats()
+        if shared is not None:
+            self.shared[name] = shared
+        if stale_timeout is not None:
+            self.stale_timeouts[name] = stale_timeout
+
+    def has_cache(self, name):
+        return name in self.caches
+
+    def contains(self, name, key):
+        """Returns True if the key has an unexpired value in the named cache.
+        Unlike get, this isn't counted as a lookup in the cache's statistics."""
+        if name not in self.caches:
+            return False
+
+        entry = self.caches[name].data.get(key)
+        if entry is not None and entry[2] > time.time():
+            return True
+        return name in self.shared and self.shared[name].contains(self._shared_key(key))
 
     def reset(self):
         self.caches.clear()
+        self.shared.clear()
+        self.stale_timeouts.clear()
+        self._stats.clear()
+
+    def stats(self, sizes=False):
+        """Returns the statistics of every cache, keyed by name. The number of
+        bytes that each one uses is only estimated when `sizes` is True,
+        because it involves walking through everything in it."""
+        stats = {}
+        for name, lru_cache in sorted(self.caches.items()):
+            counters = self._stats[name]
+            stats[name] = {
+                "size": len(lru_cache.data),
+                "maxsize": lru_cache.size,
+                "timeout": lru_cache.default_timeout,
+                "shared": name in self.shared,
+                "lookups": counters.lookups + lru_cache.lookups,
+                "hits": counters.hits + lru_cache.hits,
+                "misses": counters.misses + lru_cache.misses,
+                "evictions": counters.evictions + lru_cache.evictions,
+                "expirations": counters.expirations,
+                "shared_hits": counters.shared_hits,
+                "stale_hits": counters.stale_hits,
+                "loads": counters.loads,
+                "load_errors": counters.load_errors,
+                "load_time": round(counters.load_time, 6),
+            }
+            if isinstance(lru_cache, SizedLRUCache):
+                stats[name]["maxbytes"] = lru_cache.maxbytes
+                stats[name]["estimated_bytes"] = lru_cache.bytes
+            if sizes:
+                # The list is taken first, because other threads may change the cache while we're walking it.
+                stats[name]["bytes"] = approximate_size([entry[1] for entry in list(lru_cache.data.values())])
+        return stats
 
     def get(self, name, key, value_getter=None):
         """Returns the value of the specified key from the named cache.
@@ -57,40 +392,148 @@ class MaybeCacher(object):
 
         value = None
         cached_value = self.caches[name].get(key, uncached_sentinel)
+        if cached_value is uncached_sentinel:
+            # ExpiringLRUCache leaves expired entries in place until they're replaced or evicted.
+            if key in self.caches[name].data:
+                self._stats[name].expirations += 1
+            if name in self.shared:
+                cached_value = self._get_shared(name, key)
         # If we got something other than a sentinel value, the key was in the cache, and we should return it
-        if cached_value != uncached_sentinel:
+        if cached_value is not uncached_sentinel:
             value = cached_value
         else:
-            # If we know how to look up the value, go do it, cache it, and return it
+            # If we know how to look up the value, go do it, cache it, and return it.
+            # We return the cached version of it, so that callers get the same
+            # type of object regardless of whether or not it was cached already.
             if callable(value_getter):
-                value = value_getter()
-                self.put(name, key, value)
+                value = self._load(name, key, value_getter)
 
-        if self.make_copies:
-            return deepcopy(value)
+        if isinstance(value, CopiedValue):
+            return deepcopy(value.value)
         else:
             return value
 
+    def _load(self, name, key, value_getter):
+        """Calls value_getter and caches the value it returns, unless another
+        thread is already doing that for the same key, in which case we wait
+        for it to finish (or return a stale value, if we're allowed to)."""
+        load_key = (name, key)
+        with self._loads_lock:
+            load = self._loads.get(load_key)
+            if load is None:
+                load = self._loads[load_key] = PendingLoad()
+                loading = True
+            else:
+                loading = False
+
+        if not loading:
+            # A value_getter that looks up its own key would otherwise wait for itself forever.
+            if load.thread == threading.get_ident():
+                return self._prepare(value_getter())
+            stale_value = self._get_stale(name, key)
+            if stale_value is not uncached_sentinel:
+                self._stats[name].stale_hits += 1
+                return stale_value
+            return load.wait()
+
+        stats = self._stats[name]
+        start = time.perf_counter()
+        try:
+            value = value_getter()
+            stats.loads += 1
+            stats.load_time += time.perf_counter() - start
+            self._put_shared(name, key, value)
+            load.value = self._prepare(value)
+            self.caches[name].put(key, load.value)
+            return load.value
+        except Exception as e:
+            stats.load_errors += 1
+            load.error = e
+            raise
+        finally:
+            with self._loads_lock:
+                del self._loads[load_key]
+            load.done.set()
+
+    def _get_stale(self, name, key):
+        """Returns the expired value of the key from the named cache, if it
+        expired less than the cache's stale_timeout ago, or uncached_sentinel."""
+        if name not in self.stale_timeouts:
+            return uncached_sentinel
+
+        entry = self.caches[name].data.get(key)
+        if entry is None or entry[2] + self.stale_timeouts[name] <= time.time():
+            return uncached_sentinel
+        return entry[1]
+
     def put(self, name, key, value):
         if name not in self.caches:
             return
 
-        if self.make_copies:
-            value = deepcopy(value)
-        return self.caches[name].put(key, value)
+        self._put_shared(name, key, value)
+        return self.caches[name].put(key, self._prepare(value))
+
+    def _shared_key(self, key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def _get_shared(self, name, key):
+        """Returns the value of the key from the named shared cache, or
+        uncached_sentinel if it isn't there. Values that are found are also
+        put into the local cache, until they expire from the shared one."""
+        data = self.shared[name].get(self._shared_key(key))
+        if data is None:
+            return uncached_sentinel
+
+        (expires,) = EXPIRES.unpack_from(data)
+        timeout = expires - time.time()
+        if timeout <= 0:
+            return uncached_sentinel
+
+        value = self._prepare(pickle.loads(data[EXPIRES.size :]))
+        self.caches[name].put(key, value, timeout)
+        self._stats[name].shared_hits += 1
+        return value
+
+    def _put_shared(self, name, key, value):
+        if name not in self.shared:
+            return
+
+        timeout = self.caches[name].default_timeout
+        try:
+            data = EXPIRES.pack(time.time() + timeout) + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            log.debug("Not sharing unpicklable value of %s in %s", key, name)
+            return
+        self.shared[name].put(self._shared_key(key), data, timeout)
+
+    def _prepare(self, value):
+        if not self.make_copies:
+            return value
+        try:
+            return freeze(value)
+        except TypeError:
+            return CopiedValue(deepcopy(value))
 
     def clear(self, name=None):
         if name and name not in self.caches:
             return
 
         if not name:
-            for c in self.caches.values():
+            for n, c in self.caches.items():
+                self._stats[n].absorb(c)
+                c.clear()
+            for c in self.shared.values():
                 c.clear()
         else:
+            self._stats[name].absorb(self.caches[name])
             self.caches[name].clear()
+            if name in self.shared:
+                self.shared[name].clear()
 
     def invalidate(self, name, key):
         if name not in self.caches:
             return
 
         self.caches[name].invalidate(key)
+        if name in self.shared:
+            self.shared[name].invalidate(self._shared_key(key))
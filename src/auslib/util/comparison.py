@@ -1,7 +1,8 @@
+import functools
 import operator
 import re
 
-from auslib.util.versions import MozillaVersion
+from auslib.util.versions import VERSION_CACHE_SIZE, MozillaVersion
 
 operators = {">=": operator.ge, ">": operator.gt, "<": operator.lt, "<=": operator.le}
 
@@ -31,6 +32,7 @@ def either_eq(value, operand):
     return operator.eq(value, operand) or operator.eq(operand, value)
 
 
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
 def get_op(pattern):
     # ending with a glob means either_eq
     if pattern.endswith("*"):
@@ -1,6 +1,6 @@
 import operator
 from collections import defaultdict
-from functools import reduce
+from functools import lru_cache, reduce
 
 
 def infinite_defaultdict():
@@ -33,3 +33,123 @@ def ensure_path_exists(root, items):
         if i not in cur:
             cur[i] = {}
         cur = cur[i]
+
+
+class HashCachingTuple(tuple):
+    """A tuple that only computes its hash once, for large tuples that are
+    used as (part of) cache keys on every request."""
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = super(HashCachingTuple, self).__hash__()
+            return self._hash
+
+    def __reduce__(self):
+        # String hashes differ between processes, so the cached hash must
+        # not survive pickling.
+        return (self.__class__, (tuple(self),))
+
+
+def _frozen(self, *args, **kwargs):
+    raise TypeError("'{}' object is frozen, use thaw() to get a mutable copy of it".format(type(self).__name__))
+
+
+class FrozenDict(dict):
+    """A dict that can't be modified. See freeze() for details."""
+
+    __slots__ = ()
+    # The type that thaw() turns instances of this class back into.
+    _thawed_class = dict
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _frozen
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (freeze, (thaw(self),))
+
+
+class FrozenList(list):
+    """A list that can't be modified. See freeze() for details."""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = reverse = sort = _frozen
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (freeze, (thaw(self),))
+
+
+_IMMUTABLE_TYPES = frozenset((str, bytes, int, float, bool, type(None)))
+
+
+@lru_cache(maxsize=None)
+def _frozen_dict_class(cls):
+    """Returns a frozen version of the given dict subclass (eg: a Blob), which
+    keeps all of its methods and still passes isinstance checks against it."""
+    return type("Frozen" + cls.__name__, (FrozenDict, cls), {"__slots__": (), "__module__": cls.__module__, "_thawed_class": cls})
+
+
+def _rebuild_dict(cls, value, convert):
+    new = cls.__new__(cls)
+    dict.update(new, ((k, convert(v)) for k, v in value.items()))
+    # Instance attributes of dict subclasses, eg: Blob.data_versions
+    state = getattr(value, "__dict__", None)
+    if state:
+        new.__dict__.update((k, convert(v)) for k, v in state.items())
+    return new
+
+
+def freeze(value):
+    """Returns an immutable version of value, which must be built out of dicts
+    (including subclasses of dict, such as Blobs), lists, tuples and scalars.
+    Dicts and lists are replaced by FrozenDicts and FrozenLists, which are
+    still instances of their original types, so they can be read, compared
+    and serialized like the originals, but raise a TypeError if anything
+    tries to modify them. Because of that, frozen values can be safely shared
+    by everything that reads them, rather than being copied for each reader.
+
+    A TypeError is also raised if value contains anything that can't be
+    frozen."""
+    cls = type(value)
+    if cls in _IMMUTABLE_TYPES or isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return _rebuild_dict(FrozenDict if cls is dict else _frozen_dict_class(cls), value, freeze)
+    if isinstance(value, list):
+        new = FrozenList.__new__(FrozenList)
+        list.extend(new, (freeze(v) for v in value))
+        return new
+    if isinstance(value, tuple):
+        items = tuple(freeze(v) for v in value)
+        if all(a is b for a, b in zip(items, value)):
+            return value
+        if cls is tuple:
+            return items
+    raise TypeError("Can't freeze '{}' object".format(cls.__name__))
+
+
+def thaw(value):
+    """Returns a mutable deep copy of value, which may be a (partially) frozen
+    value returned by freeze(). Anything that wants to modify a frozen value
+    must thaw it first."""
+    if isinstance(value, dict):
+        cls = type(value)
+        return _rebuild_dict(cls._thawed_class if issubclass(cls, FrozenDict) else cls, value, thaw)
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    if type(value) is tuple:
+        return tuple(thaw(v) for v in value)
+    return value
@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+from auslib.util.rulematching import RulePredicate
+
+GLOB_METACHARACTERS = frozenset("^$+?()[]{}|\\")
+
+
+class ChannelTrie(object):
+    """A prefix trie of rule channels. Exact channels are stored in a plain
+    dict, while globbed channels (eg: "nightly*") are inserted into the trie
+    by the part that precedes the glob. Looking up a channel walks the trie
+    once, collecting the rules of every glob whose prefix the channel starts
+    with.
+
+    This mirrors the semantics of auslib.util.rulematching.matchRegex: a glob
+    is only honoured when the channel is at least 3 characters long (including
+    the "*"), and only the final "*" is treated as a wildcard. Globs whose
+    prefix contains regex metacharacters (which matchRegex does not escape)
+    can't be represented in the trie, so they are returned for every lookup
+    and left for the caller's channel check to filter."""
+
+    def __init__(self):
+        self.exact = defaultdict(list)
+        self.root = {}
+        self.any = []
+
+    def add(self, channel, rule):
+        """Adds a rule to the trie. rule may be any value that can be used as a
+        set member; RuleIndex stores (negated priority, position) tuples."""
+        if channel is None:
+            self.any.append(rule)
+        elif channel.endswith("*"):
+            # Short globs never match anything, so there's no reason to store them.
+            if len(channel) < 3:
+                return
+            if any(c in GLOB_METACHARACTERS for c in channel[:-1]):
+                self.any.append(rule)
+                return
+            node = self.root
+            for c in channel[:-1]:
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(rule)
+        else:
+            self.exact[channel].append(rule)
+
+    def _lookup(self, channel, found):
+        found.update(self.exact.get(channel, ()))
+        node = self.root
+        for c in channel:
+            node = node.get(c)
+            if node is None:
+                return
+            found.update(node.get(None, ()))
+
+    def lookup(self, channel, fallbackChannel):
+        found = set(self.any)
+        self._lookup(channel, found)
+        if fallbackChannel != channel:
+            self._lookup(fallbackChannel, found)
+        return found
+
+
+class RuleIndex(object):
+    """An in-memory index of the entire rules table. Rules are grouped by the
+    columns that Rules.getRulesMatchingQuery used to filter on in SQL (product,
+    buildTarget, headerArchitecture and distVersion), and within each group
+    they are stored in a ChannelTrie. A lookup returns a RulePredicate for
+    every rule that matches those columns and the channel, ordered by
+    descending priority. The other columns still need to be checked by the
+    caller.
+
+    data_versions is an opaque, comparable value that identifies the state of
+    the rules table the index was built from. Callers should rebuild the index
+    when it changes."""
+
+    def __init__(self, rules, data_versions=None):
+        self.data_versions = data_versions
+        self.rules = list(rules)
+        self.predicates = [RulePredicate(rule) for rule in self.rules]
+        self.groups = defaultdict(ChannelTrie)
+        for pos, rule in enumerate(self.rules):
+            key = (rule["product"], rule["buildTarget"], rule["headerArchitecture"], rule["distVersion"])
+            # The tries store sortable keys rather than the rules themselves. They
+            # include the position we received the rule in, so that rules with
+            # equal priority are returned in the same order that the database
+            # gave them to us.
+            self.groups[key].add(rule["channel"], (-(rule["priority"] or 0), pos))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def lookup(self, updateQuery, fallbackChannel):
+        products = {updateQuery["product"], None}
+        buildTargets = {updateQuery["buildTarget"], None}
+        # Queries without headerArchitecture or distVersion only match rules
+        # that don't specify them.
+        headerArchitectures = {updateQuery["headerArchitecture"], None} if "headerArchitecture" in updateQuery else {None}
+        distVersions = {updateQuery["distVersion"], None} if "distVersion" in updateQuery else {None}
+
+        candidates = set()
+        for product in products:
+            for buildTarget in buildTargets:
+                for headerArchitecture in headerArchitectures:
+                    for distVersion in distVersions:
+                        trie = self.groups.get((product, buildTarget, headerArchitecture, distVersion))
+                        if trie is not None:
+                            candidates.update(trie.lookup(updateQuery["channel"], fallbackChannel))
+
+        return [self.predicates[pos] for _, pos in sorted(candidates)]
@@ -1,24 +1,31 @@
+import functools
 import logging
 import re
 
-from auslib.util.comparison import int_compare, string_compare, version_compare
+from auslib.util.comparison import get_op, int_compare, string_compare, version_compare
 from auslib.util.versions import MozillaVersion
 
 
-def matchRegex(foo, bar):
+@functools.lru_cache(maxsize=1024)
+def compileGlob(glob):
+    """Returns a compiled regex for a glob that ends with "*", or None if the
+    glob is too short to match anything."""
     # Expand wildcards and use ^/$ to make sure we don't succeed on partial
     # matches. Eg, 3.6* matches 3.6, 3.6.1, 3.6b3, etc.
     # Channel length must be strictly greater than two
     # And globbing is allowed at the end of channel-name only
+    if len(glob) < 3:
+        return None
+    test = glob.replace(".", r"\.").replace("*", r"\*", glob.count("*") - 1)
+    return re.compile("^{}.*$".format(test[:-1]))
+
+
+def matchRegex(foo, bar):
     if foo.endswith("*"):
-        if len(foo) >= 3:
-            test = foo.replace(".", r"\.").replace("*", r"\*", foo.count("*") - 1)
-            test = "^{}.*$".format(test[:-1])
-            if re.match(test, bar):
-                return True
-            return False
-        else:
-            return False
+        regex = compileGlob(foo)
+        if regex and regex.match(bar):
+            return True
+        return False
     elif foo == bar:
         return True
     else:
@@ -167,3 +174,106 @@ def matchBoolean(ruleValue, queryValue):
         if queryValue is None or ruleValue != queryValue:
             return False
     return True
+
+
+class RulePredicate(object):
+    """A rule that has been compiled into a predicate. All of the string
+    parsing that the match* functions above do for every query (splitting
+    comma separated values, compiling channel globs, and parsing comparison
+    operators) is done once, when the predicate is created. Each of the match*
+    methods has exactly the same semantics as the function of the same name
+    (or matchSimpleExpression/matchCsv, for the columns that use those).
+
+    Errors that the match* functions would raise for malformed rule values
+    are still raised when matching, rather than when the predicate is created,
+    so that a single bad rule doesn't break the creation of every other one."""
+
+    __slots__ = (
+        "rule",
+        "channel",
+        "channelIsGlob",
+        "channelRegex",
+        "versions",
+        "buildID",
+        "memory",
+        "osVersion",
+        "instructionSet",
+        "distribution",
+        "locale",
+        "mig64",
+        "jaws",
+    )
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.channel = rule["channel"]
+        self.channelIsGlob = self.channel is not None and self.channel.endswith("*")
+        self.channelRegex = compileGlob(self.channel) if self.channelIsGlob else None
+        self.versions = None if rule["version"] is None else tuple(get_op(v) for v in rule["version"].split(","))
+        self.buildID = None if rule["buildID"] is None else get_op(rule["buildID"])
+        self.memory = None if rule["memory"] is None else get_op(rule["memory"])
+        self.osVersion = None
+        if rule["osVersion"] is not None:
+            self.osVersion = tuple(tuple(part.strip() for part in subRule.split("&&")) for subRule in rule["osVersion"].split(","))
+        self.instructionSet = None if rule["instructionSet"] is None else frozenset(rule["instructionSet"].split(","))
+        self.distribution = None if rule["distribution"] is None else frozenset(rule["distribution"].split(","))
+        self.locale = None if rule["locale"] is None else frozenset(rule["locale"].split(","))
+        self.mig64 = rule["mig64"]
+        self.jaws = rule["jaws"]
+
+    def _matchChannel(self, channel):
+        if self.channelIsGlob:
+            return self.channelRegex is not None and self.channelRegex.match(channel) is not None
+        return self.channel == channel
+
+    def matchChannel(self, queryChannel, fallbackChannel):
+        if self.channel is None:
+            return True
+        return self._matchChannel(queryChannel) or self._matchChannel(fallbackChannel)
+
+    def matchVersion(self, queryVersion, versionClass=MozillaVersion):
+        if self.versions is None:
+            return True
+        for opfunc, operand in self.versions:
+            if opfunc(versionClass(queryVersion), versionClass(operand)):
+                return True
+        return False
+
+    def matchBuildID(self, queryBuildID):
+        if self.buildID is None:
+            return True
+        opfunc, operand = self.buildID
+        return opfunc(queryBuildID, operand)
+
+    def matchMemory(self, queryMemory):
+        if self.memory is None or queryMemory is None:
+            return True
+        try:
+            queryMemory = int(queryMemory)
+        except (TypeError, ValueError):
+            return True
+        opfunc, operand = self.memory
+        return opfunc(queryMemory, int(operand))
+
+    def matchOsVersion(self, queryOsVersion):
+        if self.osVersion is None:
+            return True
+        for subRule in self.osVersion:
+            if all(part in queryOsVersion for part in subRule):
+                return True
+        return False
+
+    def matchInstructionSet(self, queryInstructionSet):
+        return self.instructionSet is None or queryInstructionSet in self.instructionSet
+
+    def matchDistribution(self, queryDistribution):
+        return self.distribution is None or queryDistribution in self.distribution
+
+    def matchLocale(self, queryLocale):
+        return self.locale is None or queryLocale in self.locale
+
+    def matchMig64(self, queryMig64):
+        return matchBoolean(self.mig64, queryMig64)
+
+    def matchJaws(self, queryJaws):
+        return matchBoolean(self.jaws, queryJaws)
@@ -0,0 +1,183 @@
+from operator import attrgetter, itemgetter
+
+# Every parameter that an update query can have, in sorted order, so that
+# UpdateQuery.items() doesn't need to sort them.
+QUERY_FIELDS = (
+    "IMEI",
+    "avast",
+    "buildID",
+    "buildTarget",
+    "channel",
+    "distVersion",
+    "distribution",
+    "force",
+    "headerArchitecture",
+    "instructionSet",
+    "jaws",
+    "locale",
+    "memory",
+    "mig64",
+    "osVersion",
+    "pin",
+    "platformVersion",
+    "product",
+    "queryVersion",
+    "version",
+)
+_QUERY_FIELD_SET = frozenset(QUERY_FIELDS)
+_get_fields = attrgetter(*QUERY_FIELDS)
+# The value of the fields that a query doesn't have.
+_MISSING = object()
+
+
+class UpdateQuery(object):
+    """The parameters of an update query. Each of them is stored in a slot,
+    rather than in a dict, but they're accessed in the same way that they are
+    in a dict (with [], get, in, items, etc.), so rule matching and blobs can
+    be given either.
+
+    Parameters that a query doesn't have are set to a sentinel, and aren't
+    `in` it. The only parameters that aren't in QUERY_FIELDS are ones that were
+    tacked onto the force parameter by Avast, which are kept in `extra`."""
+
+    __slots__ = QUERY_FIELDS + ("extra",)
+
+    def __init__(
+        self,
+        IMEI=_MISSING,
+        avast=_MISSING,
+        buildID=_MISSING,
+        buildTarget=_MISSING,
+        channel=_MISSING,
+        distVersion=_MISSING,
+        distribution=_MISSING,
+        force=_MISSING,
+        headerArchitecture=_MISSING,
+        instructionSet=_MISSING,
+        jaws=_MISSING,
+        locale=_MISSING,
+        memory=_MISSING,
+        mig64=_MISSING,
+        osVersion=_MISSING,
+        pin=_MISSING,
+        platformVersion=_MISSING,
+        product=_MISSING,
+        queryVersion=_MISSING,
+        version=_MISSING,
+    ):
+        self.IMEI = IMEI
+        self.avast = avast
+        self.buildID = buildID
+        self.buildTarget = buildTarget
+        self.channel = channel
+        self.distVersion = distVersion
+        self.distribution = distribution
+        self.force = force
+        self.headerArchitecture = headerArchitecture
+        self.instructionSet = instructionSet
+        self.jaws = jaws
+        self.locale = locale
+        self.memory = memory
+        self.mig64 = mig64
+        self.osVersion = osVersion
+        self.pin = pin
+        self.platformVersion = platformVersion
+        self.product = product
+        self.queryVersion = queryVersion
+        self.version = version
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, fields):
+        query = cls()
+        for field, value in fields.items():
+            query[field] = value
+        return query
+
+    def __getitem__(self, field):
+        if field in _QUERY_FIELD_SET:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                return value
+        elif self.extra and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field in _QUERY_FIELD_SET:
+            setattr(self, field, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[field] = value
+
+    def __delitem__(self, field):
+        if field in _QUERY_FIELD_SET:
+            if getattr(self, field) is not _MISSING:
+                setattr(self, field, _MISSING)
+                return
+        elif self.extra and field in self.extra:
+            del self.extra[field]
+            return
+        raise KeyError(field)
+
+    def __contains__(self, field):
+        if field in _QUERY_FIELD_SET:
+            return getattr(self, field) is not _MISSING
+        return bool(self.extra) and field in self.extra
+
+    def get(self, field, default=None):
+        if field in _QUERY_FIELD_SET:
+            value = getattr(self, field)
+            return default if value is _MISSING else value
+        if self.extra:
+            return self.extra.get(field, default)
+        return default
+
+    def items(self):
+        items = [item for item in zip(QUERY_FIELDS, _get_fields(self)) if item[1] is not _MISSING]
+        if self.extra:
+            items.extend(self.extra.items())
+            items.sort(key=itemgetter(0))
+        return items
+
+    def keys(self):
+        return [field for field, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def update(self, fields):
+        for field, value in dict(fields).items():
+            self[field] = value
+
+    def copy(self):
+        query = UpdateQuery(*_get_fields(self))
+        if self.extra:
+            query.extra = self.extra.copy()
+        return query
+
+    def key(self):
+        """Returns a hashable value that identifies the query, which is much
+        cheaper to build than tuple(sorted(query.items()))."""
+        if self.extra:
+            return _get_fields(self) + tuple(sorted(self.extra.items()))
+        return _get_fields(self)
+
+    def __eq__(self, other):
+        if isinstance(other, UpdateQuery):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "UpdateQuery({!r})".format(dict(self.items()))
@@ -1,13 +1,172 @@
+import functools
 import re
-from distutils.version import LooseVersion, StrictVersion, Version
 
 from auslib.errors import BadDataError
 
+# Update requests and rules only ever contain a few thousand distinct versions,
+# so parsed versions are memoized. Version objects are never modified after
+# they're parsed, which makes it safe to share them between callers.
+VERSION_CACHE_SIZE = 4096
+
+
+class Version(object):
+    """A replacement for distutils.version.Version, which is gone as of
+    Python 3.12. Like the original, the constructor parses the version string
+    (unless it is empty), and rich comparisons are routed to _cmp."""
+
+    __slots__ = ()
+
+    def __init__(self, vstring=None):
+        if vstring:
+            self.parse(vstring)
+
+    def __repr__(self):
+        return "{} ('{}')".format(self.__class__.__name__, str(self))
+
+    def __eq__(self, other):
+        c = self._cmp(other)
+        if c is NotImplemented:
+            return c
+        return c == 0
+
+    def __lt__(self, other):
+        c = self._cmp(other)
+        if c is NotImplemented:
+            return c
+        return c < 0
+
+    def __le__(self, other):
+        c = self._cmp(other)
+        if c is NotImplemented:
+            return c
+        return c <= 0
+
+    def __gt__(self, other):
+        c = self._cmp(other)
+        if c is NotImplemented:
+            return c
+        return c > 0
+
+    def __ge__(self, other):
+        c = self._cmp(other)
+        if c is NotImplemented:
+            return c
+        return c >= 0
+
+
+class StrictVersion(Version):
+    """A replacement for distutils.version.StrictVersion with identical
+    parsing and ordering. Versions have two or three numeric parts, and an
+    optional pre-release tag which sorts before the same version without one.
+
+    When it's parsed, each version also gets a sort key that is a plain tuple
+    of ints and strings, which lets most comparisons be done with a single
+    tuple comparison. Subclasses that can't be represented that way (eg:
+    GlobVersion) leave the key as None and fall back to comparing the version
+    and prerelease separately, exactly as distutils does."""
+
+    __slots__ = ("version", "prerelease", "_key")
+
+    version_re = re.compile(r"^(\d+) \. (\d+) (\. (\d+))? ([ab](\d+))?$", re.VERBOSE | re.ASCII)
+
+    def parse(self, vstring):
+        match = self.version_re.match(vstring)
+        if not match:
+            raise ValueError("invalid version number '%s'" % vstring)
+
+        (major, minor, patch, prerelease, prerelease_num) = match.group(1, 2, 4, 5, 6)
+
+        if patch:
+            self.version = (int(major), int(minor), int(patch))
+        else:
+            self.version = (int(major), int(minor), 0)
+
+        if prerelease:
+            self.prerelease = (prerelease[0], int(prerelease_num))
+            self._key = self.version + (0,) + self.prerelease
+        else:
+            self.prerelease = None
+            self._key = self.version + (1,)
+
+    def __str__(self):
+        if self.version[2] == 0:
+            vstring = ".".join(map(str, self.version[0:2]))
+        else:
+            vstring = ".".join(map(str, self.version))
+
+        if self.prerelease:
+            vstring = vstring + self.prerelease[0] + str(self.prerelease[1])
+
+        return vstring
+
+    def _cmp(self, other):
+        if isinstance(other, str):
+            other = StrictVersion(other)
+        elif not isinstance(other, StrictVersion):
+            return NotImplemented
+
+        if self._key is not None and other._key is not None:
+            if self._key == other._key:
+                return 0
+            return -1 if self._key < other._key else 1
+
+        if self.version != other.version:
+            if self.version < other.version:
+                return -1
+            else:
+                return 1
+
+        if not self.prerelease and not other.prerelease:
+            return 0
+        elif self.prerelease and not other.prerelease:
+            return -1
+        elif not self.prerelease and other.prerelease:
+            return 1
+        elif self.prerelease == other.prerelease:
+            return 0
+        elif self.prerelease < other.prerelease:
+            return -1
+        else:
+            return 1
+
+
+class LooseVersion(Version):
+    """A replacement for distutils.version.LooseVersion. Versions are split
+    into a tuple of numeric and alphabetic parts, which are compared
+    numerically and lexically respectively. Every string is a valid
+    LooseVersion."""
+
+    __slots__ = ("vstring", "version")
+
+    component_re = re.compile(r"(\d+ | [a-z]+ | \.)", re.VERBOSE)
+
+    def parse(self, vstring):
+        self.vstring = vstring
+        self.version = tuple(int(x) if x.isdecimal() else x for x in self.component_re.split(vstring) if x and x != ".")
+
+    def __str__(self):
+        return self.vstring
+
+    def _cmp(self, other):
+        if isinstance(other, str):
+            other = LooseVersion(other)
+        elif not isinstance(other, LooseVersion):
+            return NotImplemented
+
+        if self.version == other.version:
+            return 0
+        if self.version < other.version:
+            return -1
+        if self.version > other.version:
+            return 1
+
 
 class PostModernMozillaVersion(StrictVersion):
     """A version class that supports Firefox versions 5.0 and up, which
     may have "a1" but not "b2" tags in them"""
 
+    __slots__ = ()
+
     version_re = re.compile(
         r"""^(\d+) \. (\d+) (\. (\d+))?
                                 (a(\d+))?$""",
@@ -21,6 +180,8 @@ class ModernMozillaVersion(StrictVersion):
     alpha. This allows us to support the once-shipped "3.6.3plugin1" and
     similar versions."""
 
+    __slots__ = ()
+
     version_re = re.compile(
         r"""^(\d+) \. (\d+) (\. (\d+))?
                                 ([a-zA-Z]+(\d+))?$""",
@@ -36,6 +197,8 @@ class AncientMozillaVersion(StrictVersion):
     It also supports versions w.x.y.z by transmuting to w.x.z, which
     is useful for versions like 1.5.0.x and 2.0.0.y"""
 
+    __slots__ = ()
+
     version_re = re.compile(
         r"""^(\d+) \. (\d+) \. \d (\. (\d+))
                                 ([a-zA-Z]+(\d+))?$""",
@@ -44,6 +207,8 @@ class AncientMozillaVersion(StrictVersion):
 
 
 class GlobVersionTuple(tuple):
+    __slots__ = ()
+
     def __eq__(self, value):
         if len(value) < len(self):
             return False
@@ -65,7 +230,9 @@ class GlobVersion(StrictVersion):
         r"""^(\d+) \. (\d+\.\*|\*)$""",
         re.VERBOSE,
     )
+    __slots__ = ("vstring",)
     prerelease = None
+    _key = None
 
     def parse(self, vstring):
         self.vstring = vstring
@@ -82,6 +249,7 @@ class GlobVersion(StrictVersion):
         return self.vstring
 
 
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
 def MozillaVersion(version):
     try:
         if version.count(".") in (1, 2):
@@ -130,9 +298,14 @@ def decrement_version(version):
     return ".".join(map(str, parts))
 
 
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
+def parse_loose_version(version):
+    return LooseVersion(version)
+
+
 def get_version_class(product):
     if product in ("FirefoxVPN", "Guardian"):
-        return LooseVersion
+        return parse_loose_version
 
     return MozillaVersion
 
@@ -158,6 +331,8 @@ class PinVersion(Version):
     auslib.util.comparison.version_compare, which only supports equality
     checking for GlobVersion."""
 
+    __slots__ = ("version",)
+
     version_re = re.compile(r"^(\d+) \. ((\d+) \.)?$", re.VERBOSE)
 
     def parse(self, vstring):
@@ -199,3 +374,8 @@ class PinVersion(Version):
         elif self.version > other_trimmed_version:
             return 1
         return 0
+
+
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
+def parse_pin_version(version):
+    return PinVersion(version)
@@ -0,0 +1,41 @@
+import re
+
+UNESCAPED_AMPERSAND = re.compile("&(?!amp;)")
+
+
+def escape_ampersands(text):
+    """Escapes every ampersand in text that isn't already the start of an
+    "&amp;" entity. This is the only escaping that update XML gets: the values
+    in it (mostly URLs) are assumed to be free of other special characters."""
+    if "&" not in text:
+        return text
+    return UNESCAPED_AMPERSAND.sub("&amp;", text)
+
+
+class XMLBuilder(object):
+    """Builds an XML document out of lines, which are escaped (see
+    escape_ampersands) as they're added, rather than by a pass over the whole
+    document once it's finished. Most lines don't have any ampersands in them
+    at all, so they don't need to be copied. The result is the same either
+    way, because the lines are joined with newlines, which the lookahead
+    of the escaping can't see past."""
+
+    __slots__ = ("lines",)
+
+    def __init__(self, lines=()):
+        self.lines = []
+        self.extend(lines)
+
+    def append(self, line):
+        self.lines.append(escape_ampersands(line))
+
+    def extend(self, lines):
+        self.lines.extend(escape_ampersands(line) for line in lines)
+
+    def getvalue(self, squash=False):
+        """Returns the document as UTF-8 encoded bytes. If squash is True,
+        newlines and 4 space indents are removed from it."""
+        xml = "\n".join(self.lines)
+        if squash:
+            xml = xml.replace("\n", "").replace("    ", "")
+        return xml.encode("utf-8")
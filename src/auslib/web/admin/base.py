@@ -86,6 +86,14 @@ def setup_request():
             request.username = username
 
 
+@app.before_request
+def log_cache_stats():
+    # See auslib.services.cachestats.
+    stats_logger = app.config.get("CACHE_STATS_LOGGER")
+    if stats_logger:
+        stats_logger.check()
+
+
 @app.after_request
 def complete_request(response):
     if hasattr(request, "transaction"):
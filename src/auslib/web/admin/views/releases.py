@@ -8,6 +8,7 @@ from auslib.blobs.base import createBlob
 from auslib.db import OutdatedDataError
 from auslib.errors import BlobValidationError, ReadOnlyError
 from auslib.global_state import dbo
+from auslib.util.data_structures import thaw
 from auslib.util.signoffs import serialize_signoff_requirements
 from auslib.web.admin.views.base import AdminView, requirelogin
 from auslib.web.admin.views.problem import problem
@@ -275,6 +276,7 @@ class SingleReleaseView(AdminView):
             return False
 
         def commit(rel, product, newReleaseData, releaseData, old_data_version, extraArgs):
+            releaseData = thaw(releaseData)
             releaseData.update(newReleaseData)
             blob = createBlob(releaseData)
             return dbo.releases.update(
@@ -1,5 +1,6 @@
 import logging
 import re
+from functools import partial
 from os import path
 
 import connexion
@@ -10,7 +11,9 @@ from specsynthase.specbuilder import SpecBuilder
 
 import auslib.web
 from auslib.errors import BadDataError
+from auslib.services.signing import SigningError
 from auslib.web.admin.views.problem import problem
+from auslib.web.public.fastpath import UpdateFastPath
 
 try:
     import html
@@ -37,15 +40,14 @@ spec = (
 connexion_app.add_api(spec, strict_validation=True)
 
 
-@app.after_request
-def apply_security_headers(response):
+def set_security_headers(response, path):
     # There's no use cases for content served by Balrog to load additional content
     # nor be embedded elsewhere, so we apply a strict Content Security Policy.
     # We also need to set X-Content-Type-Options to nosniff for Firefox to obey this.
     # See https://bugzilla.mozilla.org/show_bug.cgi?id=1332829#c4 for background.
     response.headers["Strict-Transport-Security"] = app.config.get("STRICT_TRANSPORT_SECURITY", "max-age=31536000;")
     response.headers["X-Content-Type-Options"] = app.config.get("CONTENT_TYPE_OPTIONS", "nosniff")
-    if re.match("^/ui/", request.path):
+    if re.match("^/ui/", path):
         # This enables swagger-ui to dynamically fetch and
         # load the swagger specification JSON file containing API definition and examples.
         response.headers["X-Frame-Options"] = "SAMEORIGIN"
@@ -54,6 +56,11 @@ def apply_security_headers(response):
     return response
 
 
+@app.after_request
+def apply_security_headers(response):
+    return set_security_headers(response, request.path)
+
+
 @app.errorhandler(404)
 def fourohfour(error):
     if re.match("^/update", request.path):
@@ -73,6 +80,20 @@ def unicode(error):
     return problem(400, "Unicode Error", "Connexion was unable to parse some unicode data correctly.")
 
 
+# Clients reject content that isn't signed, so when a response's signature
+# couldn't be obtained in time (see auslib.services.signing), we ask them to
+# come back later instead, without letting anything cache that.
+@app.errorhandler(SigningError)
+def signing_error(error):
+    log.warning("Not serving unsigned content: %s", error)
+    return Response(
+        status=503,
+        mimetype="text/plain",
+        response="Content signature unavailable, try again later.",
+        headers={"Retry-After": str(app.config.get("SIGNING_RETRY_AFTER", 60)), "Cache-Control": "no-store"},
+    )
+
+
 @app.errorhandler(Exception)
 def generic(error):
     """Deals with any unhandled exceptions. If the exception is not a
@@ -125,6 +146,34 @@ def set_cache_control():
     setattr(app, "cacheControl", app.config.get("CACHE_CONTROL", "public, max-age=90"))
 
 
+@app.before_request
+def evict_changed_cache_entries():
+    # When set, this watches for changes made by the admin app, and evicts the
+    # cache entries that are affected by them. See auslib.services.invalidation.
+    invalidator = app.config.get("CACHE_INVALIDATOR")
+    if invalidator:
+        invalidator.check()
+
+
+@app.before_request
+def log_cache_stats():
+    # When set, this logs the statistics of our caches every so often.
+    # See auslib.services.cachestats.
+    stats_logger = app.config.get("CACHE_STATS_LOGGER")
+    if stats_logger:
+        stats_logger.check()
+
+
+@app.before_request
+def refresh_content_signatures():
+    # When set, content signatures are obtained in the background, and this
+    # refreshes the ones that are in use before they expire.
+    # See auslib.services.signing.
+    signing_service = app.config.get("SIGNING_SERVICE")
+    if signing_service:
+        signing_service.check()
+
+
 @app.route("/debug/api.yml")
 def get_yaml():
     if app.config.get("SWAGGER_DEBUG", False):
@@ -133,3 +182,14 @@ def get_yaml():
         app_spec = yaml.dump(spec)
         return Response(mimetype="text/plain", response=app_spec)
     return Response(status=404)
+
+
+# When UPDATE_FAST_PATH is set, update queries are handled before they get to
+# Connexion (or Flask's routing). They're given the same treatment as they
+# are by the hooks above, which don't need a request context to do it.
+app.wsgi_app = UpdateFastPath(
+    app,
+    app.wsgi_app,
+    before_request=(set_cache_control, evict_changed_cache_entries, log_cache_stats, refresh_content_signatures),
+    after_request=(partial(set_security_headers, path="/update"),),
+)
@@ -1,16 +1,20 @@
 import logging
-import re
 import sys
+from collections import defaultdict
+from functools import lru_cache, partial
 
 from connexion import request
 from flask import current_app as app
 from flask import make_response
 
 from auslib.AUS import FORCE_FALLBACK_MAPPING, FORCE_MAIN_MAPPING
-from auslib.blobs.base import createBlob
-from auslib.global_state import dbo
+from auslib.global_state import cache
 from auslib.services import releases
-from auslib.web.public.helpers import AUS, get_aus_metadata_headers, get_content_signature_headers, with_transaction
+from auslib.services.warmup import warm_rules
+from auslib.util.comparison import strip_operator
+from auslib.util.updatequery import UpdateQuery
+from auslib.util.xmlbuilder import XMLBuilder
+from auslib.web.public.helpers import AUS, PRESIGN_AUS, get_aus_metadata_headers, get_content_signature_headers, with_transaction
 
 try:
     from urllib import unquote
@@ -70,186 +74,358 @@ def getSystemCapabilities(systemCapabilities):
     return caps
 
 
-def getCleanQueryFromURL(url):
-    query = url.copy()
-    # Any of the fields (except queryVersion, which is hardcoded) could contain Unicode data.
-    # The lower level of Balrog is not ready to support Unicode yet, and any valid data will
-    # not contain Unicode characters - so for now, we simply encode to ascii and replace the
-    # Unicode characters.
-    # Until the lower level of Balrog supports Unicode better, the simplest thing to do
-    # is simply pretend these strings are ascii (which is the case for any valid query).
-    for field in query:
-        if field == "queryVersion":
+# There aren't many distinct OS versions, and clients send the same one with
+# every query, so it's cheaper to remember how they're unquoted.
+unquote_os_version = lru_cache(maxsize=2048)(unquote)
+FORCE_MAPPINGS = {FORCE_MAIN_MAPPING.query_value: FORCE_MAIN_MAPPING, FORCE_FALLBACK_MAPPING.query_value: FORCE_FALLBACK_MAPPING}
+
+
+def getQueryFromURL(url, query_version, user_agent=None):
+    """Builds the UpdateQuery for the parameters of an update URL, as Connexion
+    gives them to us. query_version is the version of the URL's route."""
+    # Underlying code depends on osVersion being set. Since the version 1 route
+    # only exists to support ancient queries, and all newer versions have osVersion
+    # in them it's easier to set this here than make the all of the underlying
+    # code support queries without it.
+    query = UpdateQuery(queryVersion=query_version, osVersion="")
+    # Connexion rejects any parameters that aren't in our spec, so each of these
+    # is one of the fields of UpdateQuery (apart from systemCapabilities).
+    for field, value in url.items():
+        if field == "systemCapabilities":
+            for capability, capability_value in getSystemCapabilities(value).items():
+                setattr(query, capability, capability_value)
             continue
-        query[field] = query[field].encode("ascii", "replace").decode()
+        # Any of the fields could contain Unicode data. The lower level of Balrog is
+        # not ready to support Unicode yet, and any valid data will not contain
+        # Unicode characters - so for now, we simply encode to ascii and replace the
+        # Unicode characters.
+        # Until the lower level of Balrog supports Unicode better, the simplest thing to do
+        # is simply pretend these strings are ascii (which is the case for any valid query).
+        if not value.isascii():
+            value = value.encode("ascii", "replace").decode()
+        setattr(query, field, value)
+
+    force = query.get("force")
     # Some versions of Avast make requests and blindly append "?avast=1" to
     # them, which breaks query string parsing if ?force=1 is already
     # there. Because we're nice people we'll fix it up.
-    if "force" in query and "avast" in query["force"]:
-        force_value = query["force"]
-        force_split = force_value.split("?", 1)
+    if force is not None and "avast" in force:
+        force_split = force.split("?", 1)
 
         if len(force_split) < 2:
-            force_split = force_value.split("%3F", 1)
+            force_split = force.split("%3F", 1)
 
-        query["force"] = force_split[0]
+        query.force = force_split[0]
 
         avast_parameter = force_split[1]
         avast_split = avast_parameter.split("=")
         query[avast_split[0]] = int(avast_split[1])
+        force = query.force
+    query.force = FORCE_MAPPINGS.get(force)
 
     # Some versions of Avast have a bug in them that prepends "x86 "
-    if "locale" in query:
-        query["locale"] = query["locale"].replace("x86 ", "")
-
+    if "x86 " in query.locale:
+        query.locale = query.locale.replace("x86 ", "")
+    if "%" in query.osVersion:
+        query.osVersion = unquote_os_version(query.osVersion)
+    query.headerArchitecture = getHeaderArchitecture(query.buildTarget, user_agent)
+    # "1" is the only value that official clients send. We ignore any other values
+    # by setting mig64 to False.
+    mig64 = query.get("mig64")
+    query.mig64 = None if mig64 is None else mig64 == "1"
     return query
 
 
-def getQueryFromURL(url):
-    query = getCleanQueryFromURL(url)
-    if "systemCapabilities" in query:
-        query.update(getSystemCapabilities(url["systemCapabilities"]))
-        del query["systemCapabilities"]
-    query["osVersion"] = unquote(query["osVersion"])
-    ua = request.headers.get("User-Agent")
-    query["headerArchitecture"] = getHeaderArchitecture(query["buildTarget"], ua)
-    force = query.get("force")
-    query["force"] = {FORCE_MAIN_MAPPING.query_value: FORCE_MAIN_MAPPING, FORCE_FALLBACK_MAPPING.query_value: FORCE_FALLBACK_MAPPING}.get(force)
-    if "mig64" in query:
-        # "1" is the only value that official clients send. We ignore any other values
-        # by setting mig64 to None.
-        if query.get("mig64") == "1":
-            query["mig64"] = True
-        else:
-            query["mig64"] = False
-    else:
-        query["mig64"] = None
-    return query
+def get_response_cache_key(query, release, update_type, response_blobs, eval_metadata):
+    """Returns the key that a rendered response can be cached with, or None if
+    it can't be cached. Responses are keyed on everything that they're rendered
+    from: the query, the rule that matched it, and the data versions of every
+    release that contributes to the response. The outcome of the backgroundRate
+    dice roll doesn't need to be in the key because it decides which release is
+    served. Releases that only exist in the old releases table don't have data
+    versions, so responses that include them are never cached."""
+    if release.data_versions is None or any(b["response_release"].data_versions is None for b in response_blobs):
+        return None
+    return (
+        query.key(),
+        eval_metadata["rule_id"],
+        eval_metadata["rule_data_version"],
+        update_type,
+        release["name"],
+        release.data_versions,
+        tuple(
+            (b["product_query"]["product"], b["response_update_type"], b["response_release"]["name"], b["response_release"].data_versions)
+            for b in response_blobs
+        ),
+    )
+
+
+def render_update_xml(query, release, update_type, response_blobs, squash_response):
+    """Returns the update XML for the given release and response blobs, as
+    UTF-8 encoded bytes."""
+    # getHeaderXML() returns outermost header for an update which
+    # is same for all release type
+    xml = XMLBuilder(release.getHeaderXML())
+    # we assume that all blobs will have similar ones. We might want to
+    # verify that all of them are indeed the same in the future.
+
+    # Appending Header
+    # In case of superblob Extracting Header form parent release
+    xml.append(release.getInnerHeaderXML(query, update_type, app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]))
+    for response_blob in response_blobs:
+        xml.extend(
+            response_blob["response_release"].getInnerXML(
+                response_blob["product_query"], response_blob["response_update_type"], app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]
+            )
+        )
+    # Appending Footer
+    # In case of superblob Extracting Header form parent release
+    xml.append(release.getInnerFooterXML(query, update_type, app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]))
+    xml.append(release.getFooterXML())
+
+    # Bug 1517743 - remove newlines and 4 space indents
+    return xml.getvalue(squash=squash_response)
 
 
-def extract_query_version(request_url):
-    version = 0
-    pattern = r"^.*/update/(\d+)/.*\.xml.*$"
-    match = re.match(pattern, request_url)
-    if match:
-        version = int(match.group(1))
-    return version
+def get_signature_headers(xml, product):
+    if product in app.config.get("CONTENT_SIGNATURE_PRODUCTS", []):
+        return get_content_signature_headers(xml, product)
+    return {}
 
 
-@with_transaction
-def get_update_blob(transaction, **url):
-    url["queryVersion"] = extract_query_version(request.url)
-    # Underlying code depends on osVersion being set. Since this route only
-    # exists to support ancient queries, and all newer versions have osVersion
-    # in them it's easier to set this here than make the all of the underlying
-    # code support queries without it.
-    if url["queryVersion"] == 1:
-        url["osVersion"] = ""
+def resolve_update(query, transaction, aus=None):
+    """Evaluates the rules for query (with aus, if given), and finds the
+    releases that its response is made up of. Returns the release that the
+    matching rule points at, its update type, the releases to respond with
+    (which are the same release, unless it's a superblob), whether or not the
+    response should be squashed, and the metadata of the rule evaluation."""
     # Bug 1517743 - two Firefox nightlies can't parse update.xml when it contains the usual newlines or indentations
     squash_response = False
+    aus = aus or AUS
+    release, update_type, eval_metadata = aus.evaluateRules(query, transaction=transaction)
+    response_blobs = []
+    if not release:
+        return release, update_type, response_blobs, squash_response, eval_metadata
+
+    response_products = release.getResponseProducts()
+    response_blob_names = release.getResponseBlobs()
+    if response_products:
+        # if we have a SuperBlob of gmp, we process the response products and
+        # concatenate their inner XMLs. The releases that their rules point
+        # at are looked up all at once.
+        for product_query, response_release, response_update_type, eval_metadata in aus.evaluateRulesForProducts(
+            query, response_products, transaction=transaction
+        ):
+            if not response_release:
+                continue
+
+            response_blobs.append({"product_query": product_query, "response_release": response_release, "response_update_type": response_update_type})
+    elif response_blob_names:
+        # if we have a SuperBlob of systemaddons, we process the response products and
+        # concatenate their inner XMLs. The releases and their products are looked
+        # up all at once.
+        memo = releases.ReleaseBlobMemo(transaction)
+        memo.load(response_blob_names)
+        products = releases.get_release_products(response_blob_names, transaction)
+        for blob_name in response_blob_names:
+            response_release = memo.get(blob_name)
+            if not response_release:
+                LOG.warning("No release found with name: %s", blob_name)
+                continue
 
-    query = getQueryFromURL(url)
+            product_query = query.copy()
+            product_query["product"] = products.get(blob_name)
+            response_blobs.append({"product_query": product_query, "response_release": response_release, "response_update_type": update_type})
+    else:
+        response_blobs.append({"product_query": query, "response_release": release, "response_update_type": update_type})
+        # Bug 1517743 - we want a cheap test because this will be run on each request
+        if release["name"] == "Firefox-mozilla-central-nightly-latest" and query["buildID"] in ("20190103220533", "20190104093221"):
+            squash_response = True
+            LOG.debug("Busted nightly detected, will squash xml response")
+    return release, update_type, response_blobs, squash_response, eval_metadata
+
+
+def render_update(query, release, update_type, response_blobs, squash_response, transaction):
+    """Renders the update XML of a release returned by resolve_update."""
+    # The "from" releases of partials are looked up while rendering. Looking
+    # them all up in advance lets us do that with a single query, inside of
+    # this request's transaction.
+    referenced_releases = set()
+    for response_blob in response_blobs:
+        referenced_releases.update(response_blob["response_release"].getCachedReferencedReleases())
+    referenced_releases.discard("*")
+    with releases.memoize_release_blobs(transaction, referenced_releases):
+        return render_update_xml(query, release, update_type, response_blobs, squash_response)
+
+
+def build_update_xml(query, transaction):
+    """Returns the update XML for query, or None if it has no update. This is
+    used to render responses outside of requests, so that their signatures
+    can be obtained before they're served (see auslib.services.signing).
+    Rules with a backgroundRate below 100 always serve their mappings here,
+    rather than rolling the dice, so that the signed content is the content
+    that's served to the clients that do get the update. Other outcomes are
+    signed when they're first served."""
+    release, update_type, response_blobs, squash_response, _ = resolve_update(query, transaction, aus=PRESIGN_AUS)
+    if not release:
+        return None
+    return render_update(query, release, update_type, response_blobs, squash_response, transaction)
+
+
+def remember_signed_response(query, release, response_blobs):
+    """Registers the response to query with the signing service, so that it's
+    signed again as soon as any of the releases it's made up of change."""
+    signing_service = app.config.get("SIGNING_SERVICE")
+    if not signing_service or query["product"] not in app.config.get("CONTENT_SIGNATURE_PRODUCTS", []):
+        return
+    names = {release["name"]}
+    names.update(b["response_release"]["name"] for b in response_blobs)
+    signing_service.remember(query.key(), query["product"], names, partial(build_update_xml, query))
+
+
+# The values of the fields of the queries made up by get_presign_queries that
+# a rule doesn't give us.
+PRESIGN_QUERY_DEFAULTS = dict(version="1.0", buildID="1", locale="en-US", channel="release", osVersion="", distribution="default", distVersion="default")
+
+
+def get_presign_queries(rules, transaction):
+    """Makes up the update queries that clients of the products in
+    CONTENT_SIGNATURE_PRODUCTS are most likely to send, so that the responses
+    to them can be signed ahead of time (see presign_responses). There's one
+    for every build target that the release of each of those products' rules
+    (or the releases that it responds with) has a platform for, with the
+    rule's product, and the first channel, locale and version that it names.
+    Those don't necessarily match the rule they're made up from, in which
+    case the query's response is just the one that another rule serves."""
+    rules_by_product = defaultdict(list)
+    for rule in rules:
+        rules_by_product[rule["product"]].append(rule)
+    memo = releases.ReleaseBlobMemo(transaction)
+
+    def get_platforms(name):
+        blob = memo.get(name) if name else None
+        if not blob:
+            return set()
+        platforms = set(blob.get("platforms", ()))
+        for vendor in blob.get("vendors", {}).values():
+            platforms.update(vendor.get("platforms", ()))
+        for product in blob.getResponseProducts() or ():
+            for rule in rules_by_product[product]:
+                platforms.update(get_platforms(rule["mapping"]))
+        platforms.discard("default")
+        return platforms
+
+    queries = {}
+    for product in app.config.get("CONTENT_SIGNATURE_PRODUCTS", []):
+        for rule in rules_by_product[product]:
+            values = dict(PRESIGN_QUERY_DEFAULTS, product=product)
+            for field in ("channel", "locale", "version"):
+                if rule[field]:
+                    values[field] = strip_operator(rule[field].split(",")[0]).rstrip("*").rstrip(".") or values[field]
+            build_targets = get_platforms(rule["mapping"]) | get_platforms(rule["fallbackMapping"])
+            if rule["buildTarget"]:
+                build_targets.add(rule["buildTarget"])
+            for build_target in sorted(build_targets):
+                query = UpdateQuery(queryVersion=3, buildTarget=build_target, force=None, mig64=None, **values)
+                query.headerArchitecture = getHeaderArchitecture(build_target, None)
+                queries[query.key()] = query
+    return list(queries.values())
+
+
+def render_empty_update_xml():
+    return XMLBuilder(['<?xml version="1.0"?>', "<updates>", "</updates>"]).getvalue()
+
+
+def presign_responses(transaction):
+    """Signs the empty responses of the products in CONTENT_SIGNATURE_PRODUCTS,
+    and the responses to the queries that get_presign_queries makes up, with
+    the signing service, in the calling thread. The responses are remembered,
+    so that they're signed again when their releases change. This is meant to
+    be done while the caches are warmed up, before uWSGI forks its workers,
+    so that they don't have to wait for Autograph for the responses that are
+    most likely to be asked for. Returns the number of responses that were
+    signed."""
+    signing_service = app.config.get("SIGNING_SERVICE")
+    if not signing_service:
+        return 0
+
+    signed = 0
+    for product in app.config.get("CONTENT_SIGNATURE_PRODUCTS", []):
+        signed += signing_service.presign(render_empty_update_xml(), product)
+    for query in get_presign_queries(warm_rules(transaction), transaction):
+        try:
+            release, update_type, response_blobs, squash_response, _ = resolve_update(query, transaction, aus=PRESIGN_AUS)
+            if not release:
+                continue
+            xml = render_update(query, release, update_type, response_blobs, squash_response, transaction)
+        except Exception:
+            LOG.exception("Failed to render the response to %s", query)
+            continue
+        signed += signing_service.presign(xml, query["product"])
+        remember_signed_response(query, release, response_blobs)
+    return signed
+
+
+@with_transaction
+def get_update_blob(transaction, query_version, **url):
+    query = getQueryFromURL(url, query_version, request.headers.get("User-Agent"))
+    return get_update_response(query, transaction)
+
+
+def get_update_response(query, transaction):
+    """Returns the response to an update query. This only needs an app
+    context, not a request context (see auslib.web.public.fastpath)."""
     LOG.debug("Got query: %s", query)
-    release, update_type, eval_metadata = AUS.evaluateRules(query, transaction=transaction)
+    release, update_type, response_blobs, squash_response, eval_metadata = resolve_update(query, transaction)
 
     # passing {},None returns empty xml
     if release:
-        response_products = release.getResponseProducts()
-        response_blobs = []
-        response_blob_names = release.getResponseBlobs()
-        if response_products:
-            # if we have a SuperBlob of gmp, we process the response products and
-            # concatenate their inner XMLs
-            for product in response_products:
-                product_query = query.copy()
-                product_query["product"] = product
-                response_release, response_update_type, eval_metadata = AUS.evaluateRules(product_query, transaction=transaction)
-                if not response_release:
-                    continue
-
-                response_blobs.append({"product_query": product_query, "response_release": response_release, "response_update_type": response_update_type})
-        elif response_blob_names:
-            for blob_name in response_blob_names:
-                # if we have a SuperBlob of systemaddons, we process the response products and
-                # concatenate their inner XMLs
-                product_query = query.copy()
-                release_row = releases.get_release(blob_name, transaction, include_sc=False)
-                response_release = None
-                if release_row:
-                    product_query["product"] = releases.get_product(blob_name, transaction)
-                    response_release = createBlob(release_row["blob"])
-                # TODO: remove me when old releases table dies
-                else:
-                    product = dbo.releases.getReleases(name=blob_name, limit=1, transaction=transaction)[0]["product"]
-                    product_query["product"] = product
-                    response_release = dbo.releases.getReleaseBlob(name=blob_name, transaction=transaction)
-                if not response_release:
-                    LOG.warning("No release found with name: %s", blob_name)
-                    continue
-
-                response_blobs.append({"product_query": product_query, "response_release": response_release, "response_update_type": update_type})
+        cache_key = get_response_cache_key(query, release, update_type, response_blobs, eval_metadata)
+        cached_response = cache.get("update_responses", cache_key) if cache_key else None
+        if cached_response:
+            LOG.debug("Using cached response")
+            xml, signature_headers = cached_response
         else:
-            response_blobs.append({"product_query": query, "response_release": release, "response_update_type": update_type})
-            # Bug 1517743 - we want a cheap test because this will be run on each request
-            if release["name"] == "Firefox-mozilla-central-nightly-latest" and query["buildID"] in ("20190103220533", "20190104093221"):
-                squash_response = True
-                LOG.debug("Busted nightly detected, will squash xml response")
-
-        # getHeaderXML() returns outermost header for an update which
-        # is same for all release type
-        xml = release.getHeaderXML()
-        # we assume that all blobs will have similar ones. We might want to
-        # verify that all of them are indeed the same in the future.
-
-        # Appending Header
-        # In case of superblob Extracting Header form parent release
-        xml.append(release.getInnerHeaderXML(query, update_type, app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]))
-        for response_blob in response_blobs:
-            xml.extend(
-                response_blob["response_release"].getInnerXML(
-                    response_blob["product_query"], response_blob["response_update_type"], app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]
-                )
-            )
-        # Appending Footer
-        # In case of superblob Extracting Header form parent release
-        xml.append(release.getInnerFooterXML(query, update_type, app.config["ALLOWLISTED_DOMAINS"], app.config["SPECIAL_FORCE_HOSTS"]))
-        xml.append(release.getFooterXML())
-        # ensure valid xml by using the right entity for ampersand
-        xml = re.sub("&(?!amp;)", "&amp;", "\n".join(xml))
+            xml = render_update(query, release, update_type, response_blobs, squash_response, transaction)
+            signature_headers = get_signature_headers(xml, query["product"])
+            if cache_key:
+                cache.put("update_responses", cache_key, (xml, signature_headers))
+            remember_signed_response(query, release, response_blobs)
     else:
-        xml = ['<?xml version="1.0"?>']
-        xml.append("<updates>")
-        xml.append("</updates>")
-        xml = "\n".join(xml)
-
-    # Bug 1517743 - remove newlines and 4 space indents
-    if squash_response:
-        xml = xml.replace("\n", "").replace("    ", "")
+        xml = render_empty_update_xml()
+        signature_headers = get_signature_headers(xml, query["product"])
 
     LOG.debug("Sending XML: %s", xml)
     response = make_response(xml)
     response.headers["Cache-Control"] = app.cacheControl
     response.headers.extend(get_aus_metadata_headers(eval_metadata))
-    if query["product"] in app.config.get("CONTENT_SIGNATURE_PRODUCTS", []):
-        response.headers.extend(get_content_signature_headers(xml, query["product"]))
+    response.headers.extend(signature_headers)
     response.mimetype = "text/xml"
     return response
 
 
-def _set_functions(function_names, function):
+def _make_update_blob_function(query_version):
+    def get_update_blob_for_version(**url):
+        return get_update_blob(query_version=query_version, **url)
+
+    return get_update_blob_for_version
+
+
+def _set_functions(functions):
     module = sys.modules[__name__]
-    for function_name in function_names:
+    for function_name, function in functions.items():
         setattr(module, function_name, function)
 
 
-update_blob_functions = [
-    "get_update_blob_1",
-    "get_update_blob_2",
-    "get_update_blob_3",
-    "get_update_blob_3_esrpre",
-    "get_update_blob_4",
-    "get_update_blob_5",
-    "get_update_blob_6",
-]
+# The query version of each update URL comes from the route that it matches.
+update_blob_functions = {
+    "get_update_blob_1": 1,
+    "get_update_blob_2": 2,
+    "get_update_blob_3": 3,
+    "get_update_blob_3_esrpre": 3,
+    "get_update_blob_4": 4,
+    "get_update_blob_5": 5,
+    "get_update_blob_6": 6,
+}
 
-_set_functions(update_blob_functions, get_update_blob)
+_set_functions({function_name: _make_update_blob_function(query_version) for function_name, query_version in update_blob_functions.items()})
@@ -1,6 +1,6 @@
 from flask import current_app
 
-from auslib.dockerflow import get_version, heartbeat_response, lbheartbeat_response
+from auslib.dockerflow import cache_stats_response, get_version, heartbeat_response, lbheartbeat_response
 
 
 def heartbeat():
@@ -18,3 +18,7 @@ def lbheartbeat():
 def version():
     version_file = current_app.config.get("VERSION_FILE")
     return get_version(version_file)
+
+
+def cache_stats():
+    return cache_stats_response(sizes=current_app.config.get("CACHE_STATS_SIZES", False))
@@ -0,0 +1,126 @@
+import logging
+from urllib.parse import parse_qsl
+
+from auslib.global_state import dbo
+from auslib.web.public.client import get_update_response, getQueryFromURL
+
+log = logging.getLogger(__name__)
+
+# The path parameters of each version of the update URL, in the order that
+# they appear in it (see swagger/api.yml), and the query parameters that each
+# of them accepts.
+UPDATE_URL_PARAMETERS = {
+    "1": ("product", "version", "buildID", "buildTarget", "locale", "channel"),
+    "2": ("product", "version", "buildID", "buildTarget", "locale", "channel", "osVersion"),
+    "3": ("product", "version", "buildID", "buildTarget", "locale", "channel", "osVersion", "distribution", "distVersion"),
+    "4": ("product", "version", "buildID", "buildTarget", "locale", "channel", "osVersion", "distribution", "distVersion", "platformVersion"),
+    "5": ("product", "version", "buildID", "buildTarget", "locale", "channel", "osVersion", "distribution", "distVersion", "IMEI"),
+    "6": ("product", "version", "buildID", "buildTarget", "locale", "channel", "osVersion", "systemCapabilities", "distribution", "distVersion"),
+}
+UPDATE_URL_QUERY_PARAMETERS = {
+    "1": frozenset(("avast", "force", "mig64", "pin")),
+    "2": frozenset(("avast", "force", "mig64")),
+    "3": frozenset(("avast", "force", "mig64", "pin")),
+    "4": frozenset(("avast", "force", "mig64", "pin")),
+    "5": frozenset(("avast", "force", "mig64", "pin")),
+    "6": frozenset(("avast", "force", "mig64", "pin")),
+}
+
+
+def parse_update_url(path_info, query_string):
+    """Returns the query version and parameters of an update URL, in the form
+    that Connexion would pass them to the update views in. None is returned
+    for anything that isn't a well formed update URL, including anything that
+    Connexion would reject, which the full app needs to respond to."""
+    # This is how Werkzeug decodes the path before routing it.
+    segments = path_info.encode("latin-1").decode("utf-8", "replace").split("/")
+    if len(segments) < 4 or segments[0] or segments[1] != "update" or segments[-1] != "update.xml":
+        return None
+    version = segments[2]
+    names = UPDATE_URL_PARAMETERS.get(version)
+    values = segments[3:-1]
+    if names is None or len(names) != len(values) or not all(values):
+        return None
+
+    url = dict(zip(names, values))
+    # bug 1133250 - old-style nightly ESR versions have their own route, which
+    # strips "esrpre" from them.
+    if version == "3" and url["version"].endswith("esrpre") and url["version"] != "esrpre":
+        url["version"] = url["version"][: -len("esrpre")]
+
+    if query_string:
+        allowed = UPDATE_URL_QUERY_PARAMETERS[version]
+        for name, value in parse_qsl(query_string, keep_blank_values=True):
+            if name not in allowed or name in url or not value:
+                return None
+            url[name] = value
+    return int(version), url
+
+
+class UpdateFastPath(object):
+    """WSGI middleware that serves update queries without going through
+    Connexion and Flask's request handling, which is much cheaper than the
+    query itself when everything it needs is cached. The database is only
+    connected to when something isn't cached (see LazyAUSTransaction).
+
+    Responses are built by the same code as the update views, and are given
+    the same headers, so they are identical to the ones that the full app
+    would send. Only well formed update URLs are handled here. Everything
+    else is passed on to the full app, which takes care of rejecting it, as
+    are requests whose query can't be built. Once a query has been started,
+    any error it raises is responded to by the app's error handlers, rather
+    than running the query again.
+
+    The before_request functions are called before each query that's handled
+    here, and the after_request functions are called with its response. They
+    must not need a request context. This is only enabled when the
+    UPDATE_FAST_PATH config option is set."""
+
+    def __init__(self, app, wsgi_app, before_request=(), after_request=()):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.before_request = before_request
+        self.after_request = after_request
+
+    def __call__(self, environ, start_response):
+        if not self.app.config.get("UPDATE_FAST_PATH") or environ.get("REQUEST_METHOD") != "GET":
+            return self.wsgi_app(environ, start_response)
+        parsed = parse_update_url(environ.get("PATH_INFO", ""), environ.get("QUERY_STRING", ""))
+        if parsed is None:
+            return self.wsgi_app(environ, start_response)
+
+        query_version, url = parsed
+        with self.app.app_context():
+            try:
+                for func in self.before_request:
+                    func()
+                query = getQueryFromURL(url, query_version, environ.get("HTTP_USER_AGENT"))
+            except Exception:
+                log.debug("Passing %s on to the full app", environ.get("PATH_INFO"), exc_info=True)
+                query = None
+            if query is not None:
+                response = self.get_response(environ, query)
+        if query is None:
+            return self.wsgi_app(environ, start_response)
+        return response(environ, start_response)
+
+    def get_response(self, environ, query):
+        try:
+            with dbo.begin(lazy=True) as transaction:
+                response = get_update_response(query, transaction)
+        except Exception as e:
+            return self.handle_exception(environ, e)
+        for func in self.after_request:
+            response = func(response)
+        return response
+
+    def handle_exception(self, environ, error):
+        """Responds to an error in the way that the full app would: with its
+        error handlers and after_request functions, which need a request
+        context. Errors that aren't handled are handled (and logged) by
+        Flask, like they are in the full app."""
+        with self.app.request_context(environ):
+            try:
+                return self.app.finalize_request(self.app.handle_user_exception(error))
+            except Exception as e:
+                return self.app.handle_exception(e)
@@ -28,18 +28,26 @@ def get_aus_metadata_headers(eval_metadata):
 
 
 def get_content_signature_headers(content, product):
+    """Returns the Content-Signature header for content. When a signing service
+    is configured, signatures come from it, and are refreshed in the
+    background (see auslib.services.signing)."""
     headers = {}
-    if product:
-        product += "_"
-    if app.config.get("AUTOGRAPH_%sURL" % product):
+    prefix = product + "_" if product else ""
+    if app.config.get("AUTOGRAPH_%sURL" % prefix):
+        signing_service = app.config.get("SIGNING_SERVICE")
+        if signing_service:
+            headers = signing_service.get_headers(content, product)
+            log.debug("Added header: %s" % headers)
+            return headers
+
         hash_ = make_hash(content)
 
         def sign():
             return sign_hash(
-                app.config["AUTOGRAPH_%sURL" % product],
-                app.config["AUTOGRAPH_%sKEYID" % product],
-                app.config["AUTOGRAPH_%sUSERNAME" % product],
-                app.config["AUTOGRAPH_%sPASSWORD" % product],
+                app.config["AUTOGRAPH_%sURL" % prefix],
+                app.config["AUTOGRAPH_%sKEYID" % prefix],
+                app.config["AUTOGRAPH_%sUSERNAME" % prefix],
+                app.config["AUTOGRAPH_%sPASSWORD" % prefix],
                 hash_,
             )
 
@@ -49,4 +57,9 @@ def get_content_signature_headers(content, product):
     return headers
 
 
+# Renders responses ahead of time (see auslib.web.public.client.build_update_xml).
+# Every backgroundRate dice roll comes up as serving the rule's mapping, so
+# that what's rendered is always the response that clients are updated with.
+PRESIGN_AUS = AUS()
+PRESIGN_AUS.rand = lambda: 0
 AUS = AUS()
@@ -1,5 +1,7 @@
 import mock
 
+from auslib.global_state import cache
+
 from .base import ViewTest
 
 
@@ -43,3 +45,10 @@ class TestDockerflowEndpoints(ViewTest):
         ret = self.client.get("/__lbheartbeat__")
         self.assertEqual(ret.status_code, 200)
         self.assertEqual(ret.headers["Cache-Control"], "no-cache")
+
+    def testCacheStats(self):
+        cache.make_cache("blob", 500, 3600)
+        ret = self.client.get("/__cache__")
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.headers["Cache-Control"], "no-cache")
+        self.assertIn("blob", ret.get_json())
@@ -27,7 +27,7 @@ from auslib.blobs.apprelease import (
 )
 from auslib.blobs.base import createBlob
 from auslib.errors import BadDataError, BlobValidationError
-from auslib.global_state import dbo
+from auslib.global_state import cache, dbo
 from auslib.web.public.base import app
 
 from ..fakes import FakeGCSHistory
@@ -4023,3 +4023,61 @@ class TestAdditionalPatchAttributesXMLMixin(unittest.TestCase):
         additionalPatchAttributes = self.mixin_instance._getAdditionalPatchAttributes(patch)
 
         self.assertEqual(expected_additional_patch_attributes, additionalPatchAttributes)
+
+
+class TestSchema4BlobWithFragmentCache(TestSchema4Blob):
+    """Runs the TestSchema4Blob tests with release fragments cached, to make
+    sure that their cache keys include everything that they depend on."""
+
+    def setUp(self):
+        super(TestSchema4BlobWithFragmentCache, self).setUp()
+        cache.reset()
+        cache.make_cache("release_fragments", 100, 60)
+        self.blobH2.data_versions = ((".", 1),)
+        self.blobH3.data_versions = ((".", 1),)
+
+    def tearDown(self):
+        cache.reset()
+
+    def testWarmCache(self):
+        self.testSchema4WithPartials()
+        self.testSchema4NoPartials()
+        lookups = cache.caches["release_fragments"].lookups
+        hits = cache.caches["release_fragments"].hits
+        self.testSchema4WithPartials()
+        self.testSchema4NoPartials()
+        # Everything should come from the cache the second time around.
+        self.assertEqual(cache.caches["release_fragments"].lookups, lookups * 2)
+        self.assertEqual(cache.caches["release_fragments"].hits, hits + lookups)
+
+    def testNewDataVersionIsNotServedFromCache(self):
+        self.testSchema4WithPartials()
+        hits = cache.caches["release_fragments"].hits
+        self.blobH2.data_versions = ((".", 2),)
+        self.testSchema4WithPartials()
+        # The only hits are the ones from within the test itself, just like the first time.
+        self.assertEqual(cache.caches["release_fragments"].hits, hits * 2)
+
+
+class TestSchema9BlobWithFragmentCache(TestSchema9Blob):
+    """Runs the TestSchema9Blob tests with release fragments cached. updateLine
+    groups match on the channel, version and buildID in the query, so those
+    must be part of the cache key for the update line."""
+
+    def setUp(self):
+        super(TestSchema9BlobWithFragmentCache, self).setUp()
+        cache.reset()
+        cache.make_cache("release_fragments", 100, 60)
+        self.blobH2.data_versions = ((".", 1),)
+
+    def tearDown(self):
+        cache.reset()
+
+    def testWarmCache(self):
+        for _ in range(2):
+            self.testWithActions()
+            self.testWithoutActionsByLocale()
+            self.testWithoutActionsByChannel()
+            self.testWithoutActionsByVersion()
+            self.testWithoutActionsByBuildID()
+        self.assertGreater(cache.caches["release_fragments"].hits, 0)
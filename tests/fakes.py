@@ -1,4 +1,6 @@
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 from auslib.db import GCSHistory, GCSHistoryAsync
 
@@ -65,3 +67,55 @@ class FakeGCSHistoryAsync(GCSHistoryAsync):
 
     def _getBucket(self, identifier):
         return lambda session: self.bucket
+
+
+class FakeAutograph:
+    """A local Autograph server, which answers /sign/hash requests with a
+    signature that's numbered in the order that the requests arrive in. The
+    base64 encoded hashes that it's asked to sign are recorded in `hashes`.
+    Responses are held back while `released` isn't set, and the next `fail`
+    requests get a 500."""
+
+    def __init__(self):
+        self.hashes = []
+        self.fail = 0
+        self.released = threading.Event()
+        self.released.set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def make_handler(self):
+        autograph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                autograph.released.wait(10)
+                if self.path != "/sign/hash" or autograph.fail > 0:
+                    autograph.fail = max(autograph.fail - 1, 0)
+                    self.send_response(500 if self.path == "/sign/hash" else 404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                autograph.hashes.append(body[0]["input"])
+                response = json.dumps([{"signature": "sig{}".format(len(autograph.hashes)), "x5u": autograph.url + "/x5u"}]).encode("ascii")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.released.set()
+        self.server.shutdown()
+        self.server.server_close()
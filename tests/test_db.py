@@ -3,6 +3,7 @@ import logging
 import os
 import re
 import sys
+import threading
 import unittest
 from copy import deepcopy
 from itertools import chain
@@ -40,6 +41,7 @@ from auslib.errors import BlobValidationError, ReadOnlyError
 from auslib.global_state import cache, dbo
 from auslib.services import releases
 from auslib.util.compat import query_params, whereclause
+from auslib.util.ruleindex import RuleIndex
 
 from .fakes import FakeGCSHistory, FakeGCSHistoryAsync
 
@@ -3898,6 +3900,28 @@ class TestReleasesJSON(unittest.TestCase, MemoryDatabaseMixin):
     def tearDown(self):
         dbo.reset()
 
+    def testGetReleasesWithAssets(self):
+        self.release_assets.t.insert().execute(name="Firefox-61.0-build1", path=".platforms.WINNT_x86-msvc.locales.de", data_version=2, data={})
+        releases = self.releases.getReleasesWithAssets(["Firefox-60.0-build1", "Firefox-61.0-build1", "Firefox-62.0-build1"])
+        self.assertEqual(set(releases), {"Firefox-60.0-build1", "Firefox-61.0-build1"})
+        self.assertEqual(
+            releases["Firefox-60.0-build1"],
+            (
+                self.releases.select(where={"name": "Firefox-60.0-build1"})[0],
+                self.release_assets.select(where={"name": "Firefox-60.0-build1"}),
+            ),
+        )
+        self.assertEqual(
+            releases["Firefox-61.0-build1"],
+            (None, [{"name": "Firefox-61.0-build1", "path": ".platforms.WINNT_x86-msvc.locales.de", "data": {}, "data_version": 2}]),
+        )
+
+    def testGetReleasesWithAssetsVersionsOnly(self):
+        base_row, asset_rows = self.releases.getReleasesWithAssets(["Firefox-60.0-build1"], versions_only=True)["Firefox-60.0-build1"]
+        self.assertEqual(base_row["data_version"], 1)
+        self.assertIsNone(base_row["data"])
+        self.assertEqual(asset_rows, [{"name": "Firefox-60.0-build1", "path": ".platforms.Linux_x86_64-gcc3.locales.en-US", "data": None, "data_version": 1}])
+
     @pytest.mark.asyncio
     @mock.patch("time.time", mock.MagicMock(return_value=1.0))
     async def testInsertCreatesCorrectHistory(self):
@@ -4208,6 +4232,136 @@ class TestRulesCaching(unittest.TestCase, MemoryDatabaseMixin, RulesTestMixin):
             self._checkCacheStats(cache.caches["rules"], 5, 3, 2)
 
 
+@pytest.mark.usefixtures("current_db_schema")
+class TestRulesIndex(unittest.TestCase, MemoryDatabaseMixin, RulesTestMixin):
+    def setUp(self):
+        MemoryDatabaseMixin.setUp(self)
+        cache.reset()
+        cache.make_cache("rules_index", 1, 3600)
+        cache.make_cache("rules_data_versions", 1, 4)
+        self.db = AUSDatabase(self.dburi)
+        self.metadata.create_all(self.db.engine)
+        self.rules = self.db.rules
+        self.rules.t.insert().execute(rule_id=1, priority=100, version="3.5", buildTarget="d", backgroundRate=100, mapping="c", update_type="z", data_version=1)
+        self.rules.t.insert().execute(rule_id=2, priority=100, version="3.3", buildTarget="d", backgroundRate=100, mapping="b", update_type="z", data_version=1)
+        self.rules.t.insert().execute(
+            rule_id=3, priority=90, version="3.5", buildTarget="a", channel="nightly*", backgroundRate=100, mapping="a", update_type="z", data_version=1
+        )
+        self.rules.t.insert().execute(
+            rule_id=4, priority=110, product="b", buildTarget="a", channel="nightly", backgroundRate=100, mapping="d", update_type="z", data_version=1
+        )
+        self.rules.t.insert().execute(
+            rule_id=5, priority=120, buildTarget="a", headerArchitecture="PPC", backgroundRate=100, mapping="e", update_type="z", data_version=1
+        )
+
+    def tearDown(self):
+        cache.reset()
+
+    def _query(self, **kwargs):
+        query = dict(
+            product="b",
+            version="3.5",
+            channel="nightly",
+            buildTarget="a",
+            buildID="",
+            locale="",
+            osVersion="",
+            distribution="",
+            force=False,
+            queryVersion=3,
+        )
+        query.update(kwargs)
+        return query
+
+    def testMatchesAreOrderedByPriority(self):
+        rules = self.rules.getRulesMatchingQuery(self._query(headerArchitecture="PPC"), fallbackChannel="nightly")
+        self.assertEqual([r["rule_id"] for r in rules], [5, 4, 3])
+
+    def testMatchesAreTheSameWithoutIndex(self):
+        queries = (
+            (self._query(), "nightly"),
+            (self._query(headerArchitecture="PPC"), "nightly"),
+            (self._query(headerArchitecture="Intel", channel="nightly-cck-foo"), "nightly"),
+            (self._query(product="c", channel="nightlytest"), "nightlytest"),
+            (self._query(buildTarget="d", channel="release"), "release"),
+            (self._query(buildTarget="d", version="3.3", distVersion="1"), "nightly"),
+        )
+        indexed = [sorted(r["rule_id"] for r in self.rules.getRulesMatchingQuery(q, fallbackChannel=fc)) for q, fc in queries]
+        cache.reset()
+        unindexed = [sorted(r["rule_id"] for r in self.rules.getRulesMatchingQuery(q, fallbackChannel=fc)) for q, fc in queries]
+        self.assertEqual(indexed, unindexed)
+        self.assertEqual(indexed, [[3, 4], [3, 4, 5], [3, 4], [3], [1], [2]])
+
+    def testIndexIsOnlyRebuiltWhenDataVersionsChange(self):
+        with mock.patch("time.time") as t, mock.patch("auslib.db.RuleIndex", wraps=RuleIndex) as ri:
+            t.return_value = 0
+            for i in range(3):
+                rules = self.rules.getRulesMatchingQuery(self._query(), fallbackChannel="nightly")
+                self.assertEqual([r["mapping"] for r in rules], ["d", "a"])
+                t.return_value += 1
+            self.assertEqual(ri.call_count, 1)
+
+            self.rules.t.update(values=dict(mapping="f", data_version=2)).where(self.rules.rule_id == 4).execute()
+
+            # The data versions are still cached, so we get the old rules.
+            rules = self.rules.getRulesMatchingQuery(self._query(), fallbackChannel="nightly")
+            self.assertEqual([r["mapping"] for r in rules], ["d", "a"])
+            self.assertEqual(ri.call_count, 1)
+
+            # Once they expire, the index is rebuilt.
+            t.return_value = 10
+            rules = self.rules.getRulesMatchingQuery(self._query(), fallbackChannel="nightly")
+            self.assertEqual([r["mapping"] for r in rules], ["f", "a"])
+            self.assertEqual(ri.call_count, 2)
+
+            self.rules.t.delete().where(self.rules.rule_id == 4).execute()
+            t.return_value = 20
+            rules = self.rules.getRulesMatchingQuery(self._query(), fallbackChannel="nightly")
+            self.assertEqual([r["mapping"] for r in rules], ["a"])
+            self.assertEqual(ri.call_count, 3)
+
+    def testConcurrentRebuildsOnlyLoadTheRulesOnce(self):
+        rules = self.rules.select(order_by=[self.rules.rule_id])
+        cache.put("rules_data_versions", "rules", self.rules.getDataVersions())
+        loading = threading.Event()
+        loaded = threading.Event()
+
+        def select(*args, **kwargs):
+            loading.set()
+            self.assertTrue(loaded.wait(5))
+            return rules
+
+        # Counts the threads that want the lock, which is how we know that
+        # they've all found the index to be out of date.
+        lock = self.rules.rule_index_lock
+        waiting = threading.Semaphore(0)
+
+        class CountingLock(object):
+            def __enter__(self):
+                waiting.release()
+                lock.acquire()
+
+            def __exit__(self, *args):
+                lock.release()
+
+        indexes = []
+        threads = [threading.Thread(target=lambda: indexes.append(self.rules.getRuleIndex())) for _ in range(4)]
+        with mock.patch.object(self.rules, "select", side_effect=select) as mocked_select, mock.patch.object(self.rules, "rule_index_lock", CountingLock()):
+            threads[0].start()
+            self.assertTrue(loading.wait(5))
+            for thread in threads[1:]:
+                thread.start()
+            for _ in threads:
+                self.assertTrue(waiting.acquire(timeout=5))
+            loaded.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(mocked_select.call_count, 1)
+        self.assertEqual(len(indexes), 4)
+        self.assertEqual([len(index.rules) for index in indexes], [5, 5, 5, 5])
+
+
 @pytest.mark.usefixtures("current_db_schema")
 class TestBlobCaching(unittest.TestCase, MemoryDatabaseMixin):
     def setUp(self):
@@ -5350,6 +5504,19 @@ class TestPinnableReleases(unittest.TestCase, MemoryDatabaseMixin):
         )
         self.assertEqual(self.pinnable_releases.getPinMapping(product=product, version=version, channel=channel), None)
 
+    def testGetPinMappingFromCache(self):
+        cache.reset()
+        cache.make_cache("pin_mappings", 1, 3600)
+        try:
+            self.pinnable_releases.insert(changed_by="bob", product="Firefox", version="60.", channel="beta", mapping="Firefox-60.0-build1")
+            self.assertEqual(self.pinnable_releases.getPinMappings(), {("Firefox", "beta", "60."): "Firefox-60.0-build1"})
+            with mock.patch.object(self.pinnable_releases, "select") as select:
+                self.assertEqual(self.pinnable_releases.getPinMapping(product="Firefox", version="60.", channel="beta"), "Firefox-60.0-build1")
+                self.assertEqual(self.pinnable_releases.getPinMapping(product="Firefox", version="61.", channel="beta"), None)
+            self.assertEqual(select.call_count, 0)
+        finally:
+            cache.reset()
+
     def testCannotInsertNonexistentRelease(self):
         with dbo.begin() as trans:
             with self.assertRaises(ValueError):
@@ -5630,6 +5797,84 @@ class TestDockerflow(unittest.TestCase, MemoryDatabaseMixin):
         self.assertEqual(entry["watchdog"], 2)
 
 
+@pytest.mark.usefixtures("current_db_schema")
+class TestChangeLog(unittest.TestCase, MemoryDatabaseMixin):
+    def setUp(self):
+        MemoryDatabaseMixin.setUp(self)
+        self.db = AUSDatabase(self.dburi)
+        self.metadata.create_all(self.db.engine)
+        self.change_log = self.db.changeLog
+        self.db.permissions.t.insert().execute(permission="admin", username="bob", data_version=1)
+
+    def getChanges(self, change_id=0):
+        return [(c["table_name"], c["row_key"]) for c in self.change_log.getChangesSince(change_id)]
+
+    def testNothingRecorded(self):
+        self.assertEqual(self.change_log.getLatestChangeId(), 0)
+        self.assertEqual(self.getChanges(), [])
+
+    def testReleaseChangesAreRecordedWithTheirName(self):
+        self.db.releases_json.insert(changed_by="bob", name="a", product="a", data={"name": "a", "schema_version": 9})
+        self.db.release_assets.insert(changed_by="bob", name="a", path=".platforms.p", data={"buildID": "1"})
+        self.db.release_assets.update(where={"name": "a", "path": ".platforms.p"}, what={"data": {"buildID": "2"}}, changed_by="bob", old_data_version=1)
+        self.db.release_assets.delete(where={"name": "a", "path": ".platforms.p"}, changed_by="bob", old_data_version=2)
+        self.db.releases_json.delete(where={"name": "a"}, changed_by="bob", old_data_version=1)
+
+        self.assertEqual(
+            self.getChanges(),
+            [("releases_json", "a"), ("release_assets", "a"), ("release_assets", "a"), ("release_assets", "a"), ("releases_json", "a")],
+        )
+        self.assertEqual(self.change_log.getLatestChangeId(), 5)
+        self.assertEqual(self.getChanges(3), [("release_assets", "a"), ("releases_json", "a")])
+
+    def testRuleAndShutoffChangesAreRecordedWithoutKey(self):
+        rule_id = self.db.rules.insert(changed_by="bob", product="a", channel="a", backgroundRate=100, priority=100, update_type="minor")
+        self.db.rules.update(where={"rule_id": rule_id}, what={"priority": 90}, changed_by="bob", old_data_version=1)
+        self.db.emergencyShutoffs.insert(changed_by="bob", product="a", channel="a")
+
+        self.assertEqual(self.getChanges(), [("rules", None), ("rules", None), ("emergency_shutoffs", None)])
+
+    def testOtherTablesAreNotRecorded(self):
+        self.db.permissions.insert(changed_by="bob", permission="rule", username="cathy")
+        self.db.rules.scheduled_changes.insert(
+            changed_by="bob",
+            when=4000000000000,
+            change_type="insert",
+            base_product="a",
+            base_channel="a",
+            base_backgroundRate=100,
+            base_priority=100,
+            base_update_type="minor",
+        )
+        self.db.dockerflow.incrementWatchdogValue(changed_by="bob")
+
+        self.assertEqual(self.getChanges(), [])
+
+    def testDryrunIsNotRecorded(self):
+        self.db.rules.insert(changed_by="bob", dryrun=True, product="a", channel="a", backgroundRate=100, priority=100, update_type="minor")
+
+        self.assertEqual(self.getChanges(), [])
+
+    def testRolledBackChangeIsNotRecorded(self):
+        with self.assertRaises(ValueError):
+            with self.db.begin() as trans:
+                self.db.releases_json.insert(changed_by="bob", name="a", product="a", data={"name": "a", "schema_version": 9}, transaction=trans)
+                raise ValueError("oops")
+
+        self.assertEqual(self.getChanges(), [])
+
+    def testPrune(self):
+        with mock.patch("auslib.db.getMillisecondTimestamp", return_value=1000):
+            self.change_log.record("rules")
+        with mock.patch("auslib.db.getMillisecondTimestamp", return_value=2000):
+            self.change_log.record("releases_json", "a")
+
+        self.assertEqual(self.change_log.prune(2000), 1)
+        self.assertEqual(self.getChanges(), [("releases_json", "a")])
+        # Pruning doesn't reset the counter
+        self.assertEqual(self.change_log.getLatestChangeId(), 2)
+
+
 class TestDB(unittest.TestCase):
     def testSetDburiAlreadySetup(self):
         db = AUSDatabase("sqlite:///:memory:")
@@ -5814,6 +6059,7 @@ class TestDBModel(unittest.TestCase, NamedFileDatabaseMixin):
     def setUpClass(cls):
         cls.db_tables = set(
             [
+                "change_log",
                 "dockerflow",
                 # TODO: dive into this more
                 # Migrate version only exists in production-like databases.
@@ -6177,6 +6423,13 @@ class TestDBModel(unittest.TestCase, NamedFileDatabaseMixin):
             for table_name in emergency_shutoff_sc_tables:
                 self.assertNotIn("base_comment", metadata.tables[table_name].c)
 
+    def _add_change_log_table(self, db, upgrade=True):
+        metadata = self._get_reflected_metadata(db)
+        if upgrade:
+            self.assertIn("change_log", metadata.tables)
+        else:
+            self.assertNotIn("change_log", metadata.tables)
+
     def _add_release_json_tables(self, db, upgrade=True):
         metadata = self._get_reflected_metadata(db)
         releases_tables = [
@@ -6286,6 +6539,7 @@ class TestDBModel(unittest.TestCase, NamedFileDatabaseMixin):
             pass
 
         versions_migrate_tests_dict = {
+            36: self._add_change_log_table,
             35: self._add_emergency_shutoff_comments,
             34: self._add_pinnable_releases_tables,
             33: self._add_release_json_tables,
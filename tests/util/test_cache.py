@@ -1,8 +1,11 @@
+import threading
 import unittest
 
 import mock
 
-from auslib.util.cache import MaybeCacher
+from auslib.services.cachestats import CacheStatsLogger
+from auslib.util.cache import LocalSharedCache, MaybeCacher, PendingLoad, SizedLRUCache, UWSGISharedCache, approximate_size, estimated_size
+from auslib.util.data_structures import FrozenList
 
 
 class TestMaybeCacher(unittest.TestCase):
@@ -72,3 +75,386 @@ class TestMaybeCacher(unittest.TestCase):
         cache.put("cache1", "foo", obj)
         cached_obj = cache.caches["cache1"].data["foo"]
         self.assertNotEqual(id(obj), id(cached_obj))
+
+    def testCopiesAreFrozen(self):
+        cache = MaybeCacher()
+        cache.make_cache("cache1", 5, 5)
+        cache.make_copies = True
+        obj = {"foo": [1, 2, 3]}
+        cache.put("cache1", "foo", obj)
+        cached_obj = cache.get("cache1", "foo")
+        self.assertEqual(cached_obj, obj)
+        self.assertIsInstance(cached_obj["foo"], FrozenList)
+        self.assertRaises(TypeError, cached_obj["foo"].append, 4)
+        # Frozen values are safe to share, so they aren't copied again.
+        self.assertEqual(id(cached_obj), id(cache.get("cache1", "foo")))
+
+    def testValueGetterResultIsFrozen(self):
+        cache = MaybeCacher()
+        cache.make_cache("cache1", 5, 5)
+        cache.make_copies = True
+        obj = [1, 2, 3]
+        cached_obj = cache.get("cache1", "foo", lambda: obj)
+        self.assertNotEqual(id(obj), id(cached_obj))
+        self.assertIsInstance(cached_obj, FrozenList)
+
+    def testUnfreezableValuesAreCopied(self):
+        cache = MaybeCacher()
+        cache.make_cache("cache1", 5, 5)
+        cache.make_copies = True
+        obj = [set([1])]
+        cache.put("cache1", "foo", obj)
+        obj[0].add(2)
+        cached_obj = cache.get("cache1", "foo")
+        self.assertEqual(cached_obj, [set([1])])
+        cached_obj[0].add(3)
+        self.assertEqual(cache.get("cache1", "foo"), [set([1])])
+
+    def testContains(self):
+        cache = MaybeCacher()
+        self.assertFalse(cache.contains("cache1", "foo"))
+        cache.make_cache("cache1", 5, 5)
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            cache.put("cache1", "foo", "bar")
+            self.assertTrue(cache.contains("cache1", "foo"))
+            self.assertFalse(cache.contains("cache1", "baz"))
+            t.return_value = 200
+            self.assertFalse(cache.contains("cache1", "foo"))
+        self.assertEqual(cache.caches["cache1"].lookups, 0)
+
+
+class TestCacheStats(unittest.TestCase):
+    def setUp(self):
+        self.cache = MaybeCacher()
+        self.cache.make_cache("cache1", 2, 5)
+
+    def testCountsLookups(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache.put("cache1", "foo", "bar")
+            self.cache.get("cache1", "foo")
+            self.cache.get("cache1", "baz")
+            t.return_value = 200
+            self.cache.get("cache1", "foo")
+            self.cache.put("cache1", "a", "a")
+            self.cache.put("cache1", "b", "b")
+
+        stats = self.cache.stats(sizes=False)["cache1"]
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["maxsize"], 2)
+        self.assertEqual(stats["timeout"], 5)
+        self.assertEqual(stats["lookups"], 3)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertNotIn("bytes", stats)
+
+    def testCountsLoads(self):
+        self.cache.get("cache1", "foo", lambda: "bar")
+        self.cache.get("cache1", "foo", lambda: "bar")
+        with self.assertRaises(ValueError):
+            self.cache.get("cache1", "baz", mock.Mock(side_effect=ValueError()))
+
+        stats = self.cache.stats(sizes=True)["cache1"]
+        self.assertEqual(stats["loads"], 1)
+        self.assertEqual(stats["load_errors"], 1)
+        self.assertGreaterEqual(stats["load_time"], 0)
+        self.assertGreater(stats["bytes"], 0)
+
+    def testCountsSurviveClear(self):
+        self.cache.put("cache1", "foo", "bar")
+        self.cache.get("cache1", "foo")
+        self.cache.clear("cache1")
+        self.cache.get("cache1", "foo")
+        self.cache.clear()
+
+        stats = self.cache.stats(sizes=True)["cache1"]
+        self.assertEqual(stats["size"], 0)
+        self.assertEqual(stats["lookups"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["bytes"], 0)
+
+    def testApproximateSize(self):
+        value = {"foo": ["a" * 1000, "b" * 1000]}
+        self.assertGreater(approximate_size([value]), 2000)
+        # Values that are referred to more than once are only counted once.
+        self.assertEqual(approximate_size([value, value]), approximate_size([value]))
+
+    def testLogger(self):
+        self.cache.put("cache1", "foo", "bar")
+        with mock.patch("auslib.services.cachestats.cache", self.cache), mock.patch("auslib.services.cachestats.log") as log, mock.patch("time.time") as t:
+            t.return_value = 100
+            stats_logger = CacheStatsLogger(60)
+            self.assertFalse(stats_logger.check())
+            t.return_value = 160
+            self.assertTrue(stats_logger.check())
+            self.assertFalse(stats_logger.check())
+
+        self.assertEqual(log.info.call_count, 1)
+        extra = log.info.call_args[1]["extra"]
+        self.assertEqual(extra["cache"], "cache1")
+        self.assertEqual(extra["size"], 1)
+
+
+class TestSizedLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = MaybeCacher()
+        self.cache.make_cache("cache1", 10, 5, maxbytes=100)
+
+    def testEstimatedSize(self):
+        self.assertEqual(estimated_size("a" * 10), 10)
+        self.assertEqual(estimated_size({"a": [1, 2]}), len('{"a":[1,2]}'))
+        # Values that can't be serialized fall back to approximate_size.
+        self.assertGreater(estimated_size({("a", "b"): 1}), 0)
+
+    def testEvictsLeastRecentlyUsedWhenOverBudget(self):
+        self.cache.put("cache1", "a", "a" * 40)
+        self.cache.put("cache1", "b", "b" * 40)
+        self.assertEqual(self.cache.get("cache1", "a"), "a" * 40)
+        self.cache.put("cache1", "c", "c" * 40)
+
+        self.assertEqual(self.cache.get("cache1", "b"), None)
+        self.assertEqual(self.cache.get("cache1", "a"), "a" * 40)
+        self.assertEqual(self.cache.get("cache1", "c"), "c" * 40)
+        stats = self.cache.stats(sizes=False)["cache1"]
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["maxbytes"], 100)
+        self.assertEqual(stats["estimated_bytes"], 80)
+
+    def testEvictsWhenOverMaxsize(self):
+        for i in range(11):
+            self.cache.put("cache1", i, "x")
+        self.assertEqual(self.cache.get("cache1", 0), None)
+        self.assertEqual(len(self.cache.caches["cache1"].data), 10)
+
+    def testDoesntCacheValuesLargerThanBudget(self):
+        self.cache.put("cache1", "a", "a" * 40)
+        self.assertEqual(self.cache.get("cache1", "big", lambda: "b" * 101), "b" * 101)
+        self.assertFalse(self.cache.contains("cache1", "big"))
+        self.assertEqual(self.cache.get("cache1", "a"), "a" * 40)
+
+    def testReplaceAndInvalidate(self):
+        self.cache.put("cache1", "a", "a" * 40)
+        self.cache.put("cache1", "a", "a" * 10)
+        self.assertEqual(self.cache.caches["cache1"].bytes, 10)
+        self.cache.invalidate("cache1", "a")
+        self.assertEqual(self.cache.caches["cache1"].bytes, 0)
+        self.assertEqual(self.cache.get("cache1", "a"), None)
+
+    def testExpiry(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache.put("cache1", "a", "a")
+            t.return_value = 200
+            self.assertEqual(self.cache.get("cache1", "a"), None)
+        stats = self.cache.stats(sizes=False)["cache1"]
+        self.assertEqual(stats["expirations"], 1)
+
+    def testUsableDirectly(self):
+        lru = SizedLRUCache(2, 5, 100)
+        lru.put("a", "a", timeout=10)
+        self.assertEqual(lru.get("a"), "a")
+        self.assertEqual(lru.get("b", "default"), "default")
+        self.assertEqual((lru.lookups, lru.hits, lru.misses), (2, 1, 1))
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.shared = LocalSharedCache()
+        # Two processes that share a cache.
+        self.cache1 = MaybeCacher()
+        self.cache1.make_cache("cache1", 5, 5, shared=self.shared)
+        self.cache2 = MaybeCacher()
+        self.cache2.make_cache("cache1", 5, 5, shared=self.shared)
+
+    def testPutIsShared(self):
+        obj = {"foo": [1, 2, 3]}
+        self.cache1.put("cache1", ("foo", 1), obj)
+        cached_obj = self.cache2.get("cache1", ("foo", 1))
+        self.assertEqual(cached_obj, obj)
+        self.assertNotEqual(id(cached_obj), id(obj))
+        # Once it's been retrieved, it's cached locally as well.
+        self.assertEqual(id(cached_obj), id(self.cache2.get("cache1", ("foo", 1))))
+
+    def testValueGetterResultIsShared(self):
+        self.assertEqual(self.cache1.get("cache1", "foo", lambda: "bar"), "bar")
+        getter = mock.MagicMock()
+        self.assertEqual(self.cache2.get("cache1", "foo", getter), "bar")
+        self.assertFalse(getter.called)
+
+    def testLocalCopyExpiresWithSharedEntry(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache1.put("cache1", "foo", "bar")
+            t.return_value = 104
+            self.assertEqual(self.cache2.get("cache1", "foo"), "bar")
+            t.return_value = 106
+            self.assertEqual(self.cache2.get("cache1", "foo"), None)
+
+    def testContains(self):
+        self.cache1.put("cache1", "foo", "bar")
+        self.assertTrue(self.cache2.contains("cache1", "foo"))
+        self.assertFalse(self.cache2.contains("cache1", "baz"))
+
+    def testInvalidateIsShared(self):
+        self.cache1.put("cache1", "foo", "bar")
+        self.cache1.put("cache1", "baz", "bar")
+        self.cache1.invalidate("cache1", "foo")
+        self.assertEqual(self.cache2.get("cache1", "foo"), None)
+        self.assertEqual(self.cache2.get("cache1", "baz"), "bar")
+
+    def testClearIsShared(self):
+        self.cache1.put("cache1", "foo", "bar")
+        self.cache2.clear("cache1")
+        self.assertEqual(self.shared.data, {})
+
+    def testUnpicklableValuesAreOnlyCachedLocally(self):
+        obj = [lambda: None]
+        self.cache1.put("cache1", "foo", obj)
+        self.assertEqual(self.cache1.get("cache1", "foo"), obj)
+        self.assertEqual(self.cache2.get("cache1", "foo"), None)
+
+    def testSharedValuesAreFrozen(self):
+        self.cache1.put("cache1", "foo", {"foo": [1, 2, 3]})
+        self.cache2.make_copies = True
+        cached_obj = self.cache2.get("cache1", "foo")
+        self.assertIsInstance(cached_obj["foo"], FrozenList)
+
+    def testUWSGISharedCache(self):
+        uwsgi = mock.MagicMock()
+        with mock.patch.dict("sys.modules", {"uwsgi": uwsgi}):
+            shared = UWSGISharedCache("cache1")
+        shared.put("foo", b"bar", 0.5)
+        uwsgi.cache_update.assert_called_once_with("foo", b"bar", 1, "cache1")
+        uwsgi.cache_get.return_value = b"bar"
+        self.assertEqual(shared.get("foo"), b"bar")
+        uwsgi.cache_get.assert_called_once_with("foo", "cache1")
+        shared.invalidate("foo")
+        uwsgi.cache_del.assert_called_once_with("foo", "cache1")
+        shared.clear()
+        uwsgi.cache_clear.assert_called_once_with("cache1")
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.cache = MaybeCacher()
+        self.cache.make_cache("cache1", 5, 5)
+        self.cache.make_cache("stale", 5, 5, stale_timeout=10)
+        self.loading = threading.Event()
+        self.finish = threading.Event()
+
+    def slow_getter(self, value):
+        def getter():
+            self.loading.set()
+            self.finish.wait(5)
+            return value
+
+        return getter
+
+    def start_loading(self, name, key, value):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.cache.get(name, key, self.slow_getter(value))))
+        thread.start()
+        self.loading.wait(5)
+        return thread, results
+
+    def start_waiting(self, target):
+        """Runs target in a thread, and returns the thread once it's waiting
+        for a PendingLoad, so that the load can't finish before it gets there."""
+        waiting = threading.Event()
+        wait = PendingLoad.wait
+
+        def signal_and_wait(pending):
+            waiting.set()
+            return wait(pending)
+
+        with mock.patch.object(PendingLoad, "wait", signal_and_wait):
+            thread = threading.Thread(target=target)
+            thread.start()
+            self.assertTrue(waiting.wait(5))
+        return thread
+
+    def testConcurrentMissesAreLoadedOnce(self):
+        thread, results = self.start_loading("cache1", "foo", "bar")
+        getter = mock.MagicMock(return_value="baz")
+        waiter_results = []
+        waiter = self.start_waiting(lambda: waiter_results.append(self.cache.get("cache1", "foo", getter)))
+        self.finish.set()
+        thread.join()
+        waiter.join()
+
+        self.assertEqual(results, ["bar"])
+        self.assertEqual(waiter_results, ["bar"])
+        self.assertFalse(getter.called)
+
+    def testWaitersGetLoadersException(self):
+        def getter():
+            self.loading.set()
+            self.finish.wait(5)
+            raise ValueError("kaboom")
+
+        thread = threading.Thread(target=lambda: self.assertRaises(ValueError, self.cache.get, "cache1", "foo", getter))
+        thread.start()
+        self.loading.wait(5)
+        errors = []
+
+        def wait():
+            try:
+                self.cache.get("cache1", "foo", lambda: "bar")
+            except ValueError as e:
+                errors.append(e)
+
+        waiter = self.start_waiting(wait)
+        self.finish.set()
+        thread.join()
+        waiter.join()
+
+        self.assertEqual(len(errors), 1)
+        # Nothing is left behind, so the next miss loads it again.
+        self.assertEqual(self.cache.get("cache1", "foo", lambda: "bar"), "bar")
+
+    def testDifferentKeysAreLoadedConcurrently(self):
+        thread, results = self.start_loading("cache1", "foo", "bar")
+        self.assertEqual(self.cache.get("cache1", "baz", lambda: "qux"), "qux")
+        self.finish.set()
+        thread.join()
+
+    def testGetterThatLooksUpItsOwnKey(self):
+        self.assertEqual(self.cache.get("cache1", "foo", lambda: self.cache.get("cache1", "foo", lambda: "bar")), "bar")
+
+    def testStaleValueIsReturnedWhileReloading(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache.put("stale", "foo", "old")
+            t.return_value = 106
+            thread, results = self.start_loading("stale", "foo", "new")
+            self.assertEqual(self.cache.get("stale", "foo", lambda: "other"), "old")
+            self.finish.set()
+            thread.join()
+            self.assertEqual(results, ["new"])
+            self.assertEqual(self.cache.get("stale", "foo"), "new")
+
+    def testTooStaleValueIsNotReturned(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache.put("stale", "foo", "old")
+            t.return_value = 116
+            thread, results = self.start_loading("stale", "foo", "new")
+            waiter_results = []
+            waiter = threading.Thread(target=lambda: waiter_results.append(self.cache.get("stale", "foo", lambda: "other")))
+            waiter.start()
+            self.finish.set()
+            thread.join()
+            waiter.join()
+            self.assertEqual(waiter_results, ["new"])
+
+    def testStaleValueIsNotReturnedWithoutConcurrentLoad(self):
+        with mock.patch("time.time") as t:
+            t.return_value = 100
+            self.cache.put("stale", "foo", "old")
+            t.return_value = 106
+            self.assertEqual(self.cache.get("stale", "foo"), None)
+            self.assertEqual(self.cache.get("stale", "foo", lambda: "new"), "new")
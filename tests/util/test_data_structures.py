@@ -0,0 +1,97 @@
+import copy
+import pickle
+import unittest
+
+from auslib.blobs.apprelease import ReleaseBlobV1
+from auslib.util.data_structures import FrozenDict, FrozenList, HashCachingTuple, freeze, thaw
+
+
+class TestFreeze(unittest.TestCase):
+    def setUp(self):
+        self.value = {"a": [1, {"b": "c"}], "d": (1, 2), "e": None}
+
+    def testFrozenValueIsEqual(self):
+        frozen = freeze(self.value)
+        self.assertEqual(frozen, self.value)
+        self.assertIsInstance(frozen, FrozenDict)
+        self.assertIsInstance(frozen["a"], FrozenList)
+        self.assertIsInstance(frozen["a"][1], FrozenDict)
+
+    def testFrozenValueCantBeModified(self):
+        frozen = freeze(self.value)
+        for modify in (
+            lambda: frozen.__setitem__("a", 1),
+            lambda: frozen.__delitem__("a"),
+            lambda: frozen.update({"f": 1}),
+            lambda: frozen.setdefault("f", 1),
+            lambda: frozen.pop("a"),
+            lambda: frozen["a"].append(2),
+            lambda: frozen["a"].sort(),
+            lambda: frozen["a"][1].clear(),
+        ):
+            self.assertRaises(TypeError, modify)
+        self.assertEqual(frozen, self.value)
+
+    def testOriginalIsNotShared(self):
+        frozen = freeze(self.value)
+        self.value["a"][1]["b"] = "z"
+        self.assertEqual(frozen["a"][1]["b"], "c")
+
+    def testFreezingFrozenValueIsNoop(self):
+        frozen = freeze(self.value)
+        self.assertIs(freeze(frozen), frozen)
+
+    def testImmutableTuplesArentRebuilt(self):
+        value = HashCachingTuple((1, "a"))
+        self.assertIs(freeze(value), value)
+
+    def testUnfreezableValue(self):
+        self.assertRaises(TypeError, freeze, {"a": object()})
+        self.assertRaises(TypeError, freeze, {"a": set()})
+
+    def testThaw(self):
+        thawed = thaw(freeze(self.value))
+        self.assertEqual(thawed, self.value)
+        self.assertIs(type(thawed), dict)
+        self.assertIs(type(thawed["a"]), list)
+        self.assertIs(type(thawed["a"][1]), dict)
+        thawed["a"][1]["b"] = "z"
+
+    def testDeepcopyThaws(self):
+        copied = copy.deepcopy(freeze(self.value))
+        self.assertIs(type(copied["a"]), list)
+        copied["a"].append(2)
+
+    def testPickle(self):
+        frozen = freeze(self.value)
+        unpickled = pickle.loads(pickle.dumps(frozen))
+        self.assertEqual(unpickled, frozen)
+        self.assertIsInstance(unpickled, FrozenDict)
+
+
+class TestFreezeBlob(unittest.TestCase):
+    def setUp(self):
+        self.blob = ReleaseBlobV1(name="a", schema_version=1, platforms={"p": {"buildID": "1", "locales": {"l": {}}}})
+        self.blob.data_versions = ((".", 1),)
+
+    def testFrozenBlobKeepsItsClass(self):
+        frozen = freeze(self.blob)
+        self.assertIsInstance(frozen, ReleaseBlobV1)
+        self.assertIsInstance(frozen, FrozenDict)
+        self.assertEqual(frozen, self.blob)
+        self.assertEqual(frozen.data_versions, ((".", 1),))
+        self.assertEqual(frozen.getBuildID("p", "l"), "1")
+        self.assertEqual(frozen.getJSON(), self.blob.getJSON())
+        self.assertRaises(TypeError, frozen["platforms"].__setitem__, "q", {})
+
+    def testThawedBlob(self):
+        thawed = thaw(freeze(self.blob))
+        self.assertIs(type(thawed), ReleaseBlobV1)
+        self.assertEqual(thawed, self.blob)
+        self.assertEqual(thawed.data_versions, ((".", 1),))
+        thawed["platforms"]["q"] = {}
+
+    def testPickledFrozenBlob(self):
+        unpickled = pickle.loads(pickle.dumps(freeze(self.blob)))
+        self.assertIsInstance(unpickled, ReleaseBlobV1)
+        self.assertIsInstance(unpickled, FrozenDict)
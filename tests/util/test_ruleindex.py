@@ -0,0 +1,88 @@
+import pytest
+
+from auslib.util.ruleindex import ChannelTrie, RuleIndex
+from auslib.util.rulematching import matchChannel
+
+RULE_COLUMNS = (
+    "product",
+    "buildTarget",
+    "headerArchitecture",
+    "distVersion",
+    "channel",
+    "version",
+    "buildID",
+    "memory",
+    "osVersion",
+    "instructionSet",
+    "distribution",
+    "locale",
+    "mig64",
+    "jaws",
+)
+
+
+@pytest.mark.parametrize(
+    "rule_channel, channel, fallback_channel",
+    (
+        (None, "release", "release"),
+        ("release", "release", "release"),
+        ("release", "release-cck-foo", "release"),
+        ("release", "releasetest", "releasetest"),
+        ("release*", "releasetest", "releasetest"),
+        ("release*", "release", "release"),
+        ("release*", "beta", "beta"),
+        ("release*", "beta-cck-release", "beta"),
+        ("a*", "abc", "abc"),
+        ("*", "abc", "abc"),
+        ("ab*", "abc", "abc"),
+        ("a.b*", "a.bc", "a.bc"),
+        ("a.b*", "axbc", "axbc"),
+        ("a*b*", "a*bc", "a*bc"),
+        ("a*b*", "aabc", "aabc"),
+    ),
+)
+def test_channel_trie_matches_like_matchChannel(rule_channel, channel, fallback_channel):
+    trie = ChannelTrie()
+    trie.add(rule_channel, 1)
+    expected = bool(matchChannel(rule_channel, channel, fallback_channel))
+    assert (1 in trie.lookup(channel, fallback_channel)) is expected
+
+
+def test_channel_trie_returns_rules_once():
+    trie = ChannelTrie()
+    trie.add("release*", 1)
+    assert list(trie.lookup("release-cck-foo", "release")) == [1]
+
+
+@pytest.mark.parametrize("rule_channel, channel", (("rel(ease)*", "release"), ("b[eta]*", "be"), ("a+b*", "aab")))
+def test_channel_trie_returns_globs_with_metacharacters(rule_channel, channel):
+    trie = ChannelTrie()
+    trie.add(rule_channel, 1)
+    assert matchChannel(rule_channel, channel, channel)
+    assert 1 in trie.lookup(channel, channel)
+
+
+def test_rule_index_lookup():
+    def rule(rule_id, priority, **kwargs):
+        r = dict(rule_id=rule_id, priority=priority)
+        for column in RULE_COLUMNS:
+            r[column] = kwargs.get(column)
+        return r
+
+    rules = [
+        rule(1, 100, product="Firefox"),
+        rule(2, 100, product="Firefox", buildTarget="WINNT"),
+        rule(3, 200, product="Thunderbird"),
+        rule(4, 300, distVersion="1.0"),
+        rule(5, 50, headerArchitecture="Intel", channel="beta*"),
+        rule(6, 400, buildTarget="Darwin"),
+    ]
+    index = RuleIndex(rules)
+    assert len(index) == 6
+
+    query = dict(product="Firefox", buildTarget="WINNT", channel="beta", headerArchitecture="Intel")
+    assert [p.rule["rule_id"] for p in index.lookup(query, "beta")] == [1, 2, 5]
+    query["distVersion"] = "1.0"
+    assert [p.rule["rule_id"] for p in index.lookup(query, "beta")] == [4, 1, 2, 5]
+    del query["headerArchitecture"]
+    assert [p.rule["rule_id"] for p in index.lookup(query, "beta")] == [4, 1, 2]
@@ -1,6 +1,16 @@
 import unittest
 
-from auslib.util.rulematching import matchMemory, matchVersion
+from auslib.util.rulematching import (
+    RulePredicate,
+    matchBoolean,
+    matchBuildID,
+    matchChannel,
+    matchCsv,
+    matchLocale,
+    matchMemory,
+    matchSimpleExpression,
+    matchVersion,
+)
 
 
 class TestMatchMemory(unittest.TestCase):
@@ -34,3 +44,62 @@ class TestMatchVersion(unittest.TestCase):
         self.assertTrue(matchVersion("78.*", "78.8.0"))
         self.assertTrue(matchVersion("78.*", "78.9.0"))
         self.assertFalse(matchVersion("79.*", "78.9.0"))
+
+
+class TestRulePredicate(unittest.TestCase):
+    def _predicate(self, **kwargs):
+        rule = dict(
+            channel=None,
+            version=None,
+            buildID=None,
+            memory=None,
+            osVersion=None,
+            instructionSet=None,
+            distribution=None,
+            locale=None,
+            mig64=None,
+            jaws=None,
+        )
+        rule.update(kwargs)
+        return RulePredicate(rule)
+
+    def test_channel(self):
+        for ruleChannel in (None, "release", "release*", "a*", "a.b*", "a*b*", "rel(ease)*"):
+            predicate = self._predicate(channel=ruleChannel)
+            for channel, fallbackChannel in (("release", "release"), ("release-cck-foo", "release"), ("a*", "a*"), ("axbc", "axbc"), ("a*bc", "a*bc")):
+                with self.subTest(ruleChannel=ruleChannel, channel=channel):
+                    self.assertEqual(predicate.matchChannel(channel, fallbackChannel), bool(matchChannel(ruleChannel, channel, fallbackChannel)))
+
+    def test_version(self):
+        for ruleVersion in (None, "78.0", ">=78.0", "<78.0,79.*", "78.8.*", ">3.6b1", "79.*", "<80.0"):
+            predicate = self._predicate(version=ruleVersion)
+            for version in ("77.0", "78.0", "78.8.1", "79.0.1", "80.0a1", "3.6b2"):
+                with self.subTest(ruleVersion=ruleVersion, version=version):
+                    self.assertEqual(predicate.matchVersion(version), matchVersion(ruleVersion, version))
+
+    def test_buildID_and_memory(self):
+        for ruleValue in (None, "2048", ">2048", "<=2048"):
+            predicate = self._predicate(buildID=ruleValue, memory=ruleValue)
+            for value in ("1024", "2048", "4096", "", None, "trash"):
+                with self.subTest(ruleValue=ruleValue, value=value):
+                    self.assertEqual(predicate.matchMemory(value), matchMemory(ruleValue, value))
+                    if value is not None:
+                        self.assertEqual(predicate.matchBuildID(value), matchBuildID(ruleValue, value))
+
+    def test_csv_columns(self):
+        for ruleValue in (None, "SSE", "SSE,AMD", "Windows 10&&AMD,Linux"):
+            predicate = self._predicate(osVersion=ruleValue, instructionSet=ruleValue, distribution=ruleValue, locale=ruleValue)
+            for value in ("SSE", "SSE3", "AMD", "Windows 10.0 AMD", "Linux 5", ""):
+                with self.subTest(ruleValue=ruleValue, value=value):
+                    self.assertEqual(predicate.matchOsVersion(value), matchSimpleExpression(ruleValue, value))
+                    self.assertEqual(predicate.matchInstructionSet(value), matchCsv(ruleValue, value, substring=False))
+                    self.assertEqual(predicate.matchDistribution(value), matchCsv(ruleValue, value, substring=False))
+                    self.assertEqual(predicate.matchLocale(value), matchLocale(ruleValue, value))
+
+    def test_booleans(self):
+        for ruleValue in (None, True, False):
+            predicate = self._predicate(mig64=ruleValue, jaws=ruleValue)
+            for value in (None, True, False):
+                with self.subTest(ruleValue=ruleValue, value=value):
+                    self.assertEqual(predicate.matchMig64(value), matchBoolean(ruleValue, value))
+                    self.assertEqual(predicate.matchJaws(value), matchBoolean(ruleValue, value))
@@ -0,0 +1,49 @@
+import pytest
+
+from auslib.util.updatequery import UpdateQuery
+
+
+def test_behaves_like_a_dict():
+    fields = {"product": "Firefox", "version": "1.0", "channel": "release", "force": None, "avast": 1, "unknown": "x"}
+    query = UpdateQuery.from_dict(fields)
+
+    assert query == fields
+    assert query["product"] == "Firefox"
+    assert query.get("force", "default") is None
+    assert query.get("distVersion") is None
+    assert query.get("distVersion", "default") == "default"
+    assert query["unknown"] == "x"
+    assert "channel" in query
+    assert "distVersion" not in query
+    assert "other" not in query
+    assert sorted(query) == sorted(fields)
+    assert len(query) == len(fields)
+    assert query.key() == UpdateQuery.from_dict(fields).key()
+    assert query.key() != UpdateQuery.from_dict(dict(fields, unknown="y")).key()
+    with pytest.raises(KeyError):
+        query["distVersion"]
+    with pytest.raises(KeyError):
+        query["other"]
+
+
+def test_set_and_delete():
+    query = UpdateQuery(product="Firefox")
+    query["distVersion"] = "default"
+    query.update({"locale": "en-US", "other": 2})
+    del query["product"]
+
+    assert query == {"distVersion": "default", "locale": "en-US", "other": 2}
+    with pytest.raises(KeyError):
+        del query["product"]
+    with pytest.raises(KeyError):
+        del query["missing"]
+
+
+def test_copies_are_independent():
+    query = UpdateQuery.from_dict({"product": "Firefox", "other": 1})
+    copy = query.copy()
+    copy["product"] = "Thunderbird"
+    copy["other"] = 2
+
+    assert query == {"product": "Firefox", "other": 1}
+    assert copy == {"product": "Thunderbird", "other": 2}
@@ -1,7 +1,7 @@
 import unittest
 
 from auslib.errors import BadDataError
-from auslib.util.versions import MozillaVersion, PinVersion
+from auslib.util.versions import LooseVersion, MozillaVersion, PinVersion, StrictVersion, parse_loose_version, parse_pin_version
 
 
 class TestMozillaVersions(unittest.TestCase):
@@ -31,6 +31,17 @@ class TestMozillaVersions(unittest.TestCase):
         version = MozillaVersion("1.2.0")
         self.assertEqual(str(version), "1.2")
 
+    def test_parsed_versions_are_memoized(self):
+        self.assertIs(MozillaVersion("102.0.1"), MozillaVersion("102.0.1"))
+        self.assertIs(parse_pin_version("102."), parse_pin_version("102."))
+        self.assertIs(parse_loose_version("2.4.1"), parse_loose_version("2.4.1"))
+        self.assertEqual(parse_pin_version("102.").version, PinVersion("102.").version)
+
+    def test_invalid_versions_are_not_memoized(self):
+        self.assertRaises(BadDataError, MozillaVersion, "1.2.3.4.5")
+        self.assertRaises(BadDataError, MozillaVersion, "1.2.3.4.5")
+        self.assertRaises(ValueError, parse_pin_version, "102")
+
     def test_cmp_strict(self):
         versions = (
             ("1.5.1", "1.5.2b2", -1),
@@ -191,3 +202,34 @@ class TestMozillaVersions(unittest.TestCase):
         self.comprehensive_assert_greater(version, MozillaVersion("1.5.0.1"))
         self.comprehensive_assert_greater(version, MozillaVersion("1.5.0.1rc1"))
         self.comprehensive_assert_greater(version, MozillaVersion("3.6.3plugin1"))
+
+
+class TestStrictVersion(unittest.TestCase):
+    def test_compare_with_string(self):
+        self.assertTrue(StrictVersion("1.0") == "1.0.0")
+        self.assertTrue(StrictVersion("1.0b2") < "1.0")
+        self.assertTrue(MozillaVersion("70.0a1") < "70.0")
+
+    def test_unsupported_comparison(self):
+        self.assertRaises(TypeError, lambda: StrictVersion("1.0") < 1)
+
+    def test_empty_string_is_not_parsed(self):
+        self.assertFalse(hasattr(StrictVersion(""), "version"))
+
+    def test_invalid(self):
+        for version in ("1", "2.7.2.2", "1.3.a4", "1.3pl1", "1.3c4"):
+            self.assertRaises(ValueError, StrictVersion, version)
+
+
+class TestLooseVersion(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(LooseVersion("2.2beta29").version, (2, 2, "beta", 29))
+        self.assertEqual(LooseVersion("1.13++").version, (1, 13, "++"))
+        self.assertEqual(str(LooseVersion("1.13++")), "1.13++")
+
+    def test_cmp(self):
+        self.assertTrue(LooseVersion("2.10") > LooseVersion("2.4.1"))
+        self.assertTrue(LooseVersion("2.4") < LooseVersion("2.4.1"))
+        self.assertTrue(LooseVersion("1.5.2b2") < "161")
+        self.assertTrue(LooseVersion("3.4j") == LooseVersion("3.4j"))
+        self.assertRaises(TypeError, lambda: LooseVersion("3.4j") < LooseVersion("3.4.1"))
@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from auslib.util.autograph import make_hash
+from auslib.util.xmlbuilder import XMLBuilder, escape_ampersands
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("no ampersands", "no ampersands"),
+        ("a=1&b=2", "a=1&amp;b=2"),
+        ("a=1&amp;b=2", "a=1&amp;b=2"),
+        ("&amp&&amp;", "&amp;amp&amp;&amp;"),
+        ("&", "&amp;"),
+    ],
+)
+def test_escape_ampersands(text, expected):
+    assert escape_ampersands(text) == expected
+
+
+def test_builder_matches_escaping_the_whole_document():
+    lines = ['<?xml version="1.0"?>', "<updates>", '    <patch URL="http://a.com/?a=1&b=2&amp;c=3&"/>', "amp;", "</updates>"]
+    expected = re.sub("&(?!amp;)", "&amp;", "\n".join(lines))
+
+    builder = XMLBuilder(lines[:2])
+    builder.append(lines[2])
+    builder.extend(lines[3:])
+
+    assert builder.getvalue() == expected.encode("utf-8")
+    assert builder.getvalue(squash=True) == expected.replace("\n", "").replace("    ", "").encode("utf-8")
+
+
+def test_make_hash_of_bytes_matches_str():
+    assert make_hash(b"<updates/>") == make_hash("<updates/>")
+    with pytest.raises(ValueError):
+        make_hash("é".encode("utf-8"))
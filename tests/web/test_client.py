@@ -1,7 +1,9 @@
 # coding: latin-1
 import logging
 import os
+import time
 import unittest
+from concurrent.futures import Future
 from contextlib import ExitStack
 from tempfile import mkstemp
 from xml.dom import minidom
@@ -9,15 +11,21 @@ from xml.dom import minidom
 import mock
 import pytest
 from hypothesis import assume, example, given
-from hypothesis.strategies import characters, integers, just, text
+from hypothesis.strategies import characters, just, text
 
 import auslib.services.releases as releases_service
+import auslib.services.warmup as warmup
 import auslib.web.public.client as client_api
+from auslib.AUS import FORCE_MAIN_MAPPING
 from auslib.blobs.base import createBlob
 from auslib.errors import BadDataError
 from auslib.global_state import cache, dbo
+from auslib.services.invalidation import CacheInvalidator, evict
+from auslib.services.signing import SigningError, SigningService
 from auslib.web.public.base import app
-from auslib.web.public.client import extract_query_version
+from auslib.web.public.fastpath import parse_update_url
+
+from ..fakes import FakeAutograph
 
 mock_autograph_exception_count = 0
 
@@ -931,6 +939,60 @@ class ClientTest(ClientTestBase):
     def testGetHeaderArchitectureMacPPC(self):
         self.assertEqual(client_api.getHeaderArchitecture("Darwin_ppc-gcc3-u-ppc-i386", "Firefox PPC Mac"), "PPC")
 
+    def testGetQueryFromURL(self):
+        url = {
+            "product": "b",
+            "version": "1.0",
+            "buildID": "1",
+            "buildTarget": "Darwin_ppc-gcc3",
+            "locale": "x86 l",
+            "channel": "a",
+            "osVersion": "a%20b",
+            "systemCapabilities": "ISET:SSE3,MEM:6721",
+            "distribution": "d\u00e9",
+            "distVersion": "a",
+            "force": "1?avast=1",
+            "mig64": "1",
+        }
+        query = client_api.getQueryFromURL(url, 6, "Firefox PPC Mac")
+        self.assertEqual(
+            query,
+            {
+                "product": "b",
+                "version": "1.0",
+                "buildID": "1",
+                "buildTarget": "Darwin_ppc-gcc3",
+                "locale": "l",
+                "channel": "a",
+                "osVersion": "a b",
+                "instructionSet": "SSE3",
+                "memory": 6721,
+                "jaws": None,
+                "distribution": "d?",
+                "distVersion": "a",
+                "force": FORCE_MAIN_MAPPING,
+                "avast": 1,
+                "mig64": True,
+                "headerArchitecture": "PPC",
+                "queryVersion": 6,
+            },
+        )
+
+    def testGetQueryFromURLVersion1(self):
+        url = {"product": "b", "version": "1.0", "buildID": "1", "buildTarget": "p", "locale": "l", "channel": "a"}
+        query = client_api.getQueryFromURL(url, 1)
+        self.assertEqual(query["osVersion"], "")
+        self.assertEqual(query["queryVersion"], 1)
+        self.assertIsNone(query["force"])
+        self.assertIsNone(query["mig64"])
+        self.assertNotIn("distVersion", query)
+
+    def testQueryVersionComesFromTheRoute(self):
+        with mock.patch("auslib.web.public.client.getQueryFromURL", wraps=client_api.getQueryFromURL) as getQueryFromURL:
+            self.client.get("/update/3/b/1.0esrpre/1/p/l/a/a/a/a/update.xml")
+            self.client.get("/update/5/b/1.0/1/p/l/a/a/a/a/1/update.xml")
+        self.assertEqual([c[0][1] for c in getQueryFromURL.call_args_list], [3, 5])
+
     def testDontUpdateToYourself(self):
         ret = self.client.get("/update/3/b/1.0/2/p/l/a/a/a/a/update.xml")
         self.assertUpdatesAreEmpty(ret)
@@ -1445,19 +1507,6 @@ class ClientTest(ClientTestBase):
         ret = self.client.get("/update/3/product_that_should_not_be_updated/1.0/1/p/l/a/a/a/a/update.xml")
         self.assertUpdatesAreEmpty(ret)
 
-    @given(just("x"))
-    @example(invalid_version="1x")
-    @example(invalid_version="x1")
-    def testUpdateInvalidQueryVersion(self, invalid_version):
-        query_version = extract_query_version("/update/{}/a/b/c/update.xml".format(invalid_version))
-        self.assertEqual(query_version, 0)
-
-    @given(integers(min_value=1, max_value=100))
-    @example(qv=1)
-    def testUpdateQueryVersion(self, qv):
-        query_version = extract_query_version("/update/{}/a/b/c/update.xml".format(qv))
-        self.assertEqual(query_version, qv)
-
     # TODO: switch to text() after https://bugzilla.mozilla.org/show_bug.cgi?id=1387049 is ready
     # @given(text(min_size=1, max_size=20), text(min_size=1, max_size=20))
     @given(just("mig64"), just(1))
@@ -1533,81 +1582,94 @@ class ClientTest(ClientTestBase):
             mocked_get_asset_data_versions = stack.enter_context(
                 mock.patch.object(releases_service, "get_asset_data_versions", wraps=releases_service.get_asset_data_versions)
             )
+            mocked_get_releases_with_assets = stack.enter_context(
+                mock.patch.object(dbo.releases_json, "getReleasesWithAssets", wraps=dbo.releases_json.getReleasesWithAssets)
+            )
             t = stack.enter_context(mock.patch("time.time"))
-            # The lookups/hits/misses here come in multiples of 4 because we have:
+            # Each request looks up 4 releases:
             #  - a release that the rule is pointing to
             #  - 3 potential partials, all of which get looked at
+            # The partials are loaded into the caches together (with a single
+            # query, counted by "batch_loads") before they're looked up, so
+            # only the first of them can miss.
             args = [
                 {
-                    # The first query should be all misses
+                    # The first query should only miss the release the rule points at
                     "time": 10,
                     "lookups": 4,
-                    "hits": 0,
-                    "misses": 4,
+                    "hits": 3,
+                    "misses": 1,
                     "data_version_lookups": 4,
-                    "data_version_hits": 0,
-                    "data_version_misses": 4,
+                    "data_version_hits": 3,
+                    "data_version_misses": 1,
+                    "batch_loads": 1,
                 },
                 {
                     # Make sure a look up soon after will be fully cached (including data version)
                     "time": 13,
                     "lookups": 8,
-                    "hits": 4,
-                    "misses": 4,
+                    "hits": 7,
+                    "misses": 1,
                     "data_version_lookups": 8,
-                    "data_version_hits": 4,
-                    "data_version_misses": 4,
+                    "data_version_hits": 7,
+                    "data_version_misses": 1,
+                    "batch_loads": 1,
                 },
                 {
                     # And a look up after the data version cache expires should only invalidate data version caches
                     "time": 15,
                     "lookups": 12,
-                    "hits": 8,
-                    "misses": 4,
+                    "hits": 11,
+                    "misses": 1,
                     "data_version_lookups": 12,
-                    "data_version_hits": 4,
-                    "data_version_misses": 8,
+                    "data_version_hits": 10,
+                    "data_version_misses": 2,
+                    "batch_loads": 2,
                 },
                 {
                     # And make sure the main caches invalidate at the right time
                     "time": 20,
                     "lookups": 16,
-                    "hits": 8,
-                    "misses": 8,
+                    "hits": 14,
+                    "misses": 2,
                     "data_version_lookups": 16,
-                    "data_version_hits": 4,
-                    "data_version_misses": 12,
+                    "data_version_hits": 13,
+                    "data_version_misses": 3,
+                    "batch_loads": 3,
                 },
                 {
                     # After an update if data_version is expired but the blob is not we forcibly update the blob
                     "time": 25,
                     "lookups": 20,
-                    "hits": 12,
-                    "misses": 8,
+                    "hits": 18,
+                    "misses": 2,
                     "data_version_lookups": 20,
-                    "data_version_hits": 4,
-                    "data_version_misses": 16,
+                    "data_version_hits": 16,
+                    "data_version_misses": 4,
+                    "batch_loads": 4,
                     "update": True,
                 },
                 {
                     # Fresh query with expired caches
                     "time": 30,
                     "lookups": 24,
-                    "hits": 12,
-                    "misses": 12,
+                    "hits": 21,
+                    "misses": 3,
                     "data_version_lookups": 24,
-                    "data_version_hits": 4,
-                    "data_version_misses": 20,
+                    "data_version_hits": 19,
+                    "data_version_misses": 5,
+                    "batch_loads": 5,
                 },
                 {
                     # And now check the blob is updated after assets update
                     "time": 35,
                     "lookups": 28,
-                    "hits": 16,
-                    "misses": 12,
+                    "hits": 25,
+                    "misses": 3,
                     "data_version_lookups": 28,
-                    "data_version_hits": 4,
-                    "data_version_misses": 24,
+                    "data_version_hits": 22,
+                    "data_version_misses": 6,
+                    "batch_loads": 6,
                     "update_assets": True,
                 },
             ]
@@ -1656,6 +1718,7 @@ class ClientTest(ClientTestBase):
                 assert mocked_get_asset_rows.call_count == call_count
                 assert mocked_get_base_data_version.call_count == arg["data_version_misses"]
                 assert mocked_get_asset_data_versions.call_count == arg["data_version_misses"]
+                assert mocked_get_releases_with_assets.call_count == arg["batch_loads"]
 
             assert mocked_releases_json_scheduled_changes.select.call_count == 0
             assert mocked_release_assets_scheduled_changes.select.call_count == 0
@@ -1688,6 +1751,46 @@ class ClientTest(ClientTestBase):
             assert mocked_releases_json_scheduled_changes.select.call_count == 0
             assert mocked_release_assets_scheduled_changes.select.call_count == 0
 
+    def test_superblob_response_releases_are_loaded_together(self):
+        with ExitStack() as stack:
+            get_releases = stack.enter_context(mock.patch.object(dbo.releases_json, "getReleasesWithAssets", wraps=dbo.releases_json.getReleasesWithAssets))
+            get_base_row = stack.enter_context(mock.patch.object(releases_service, "get_base_row", wraps=releases_service.get_base_row))
+            ret = self.client.get("/update/3/SystemAddons/1.0/1/p/l/releasesjson/a/a/a/update.xml")
+
+        self.assertIn(b"timecop@mozilla.com", ret.get_data())
+        self.assertEqual(get_releases.call_count, 1)
+        self.assertEqual(set(get_releases.call_args[0][0]), {"hotfix-bug-1548973@mozilla.org-1.1.4", "timecop@mozilla.com-1.0"})
+        # Only the superblob itself is looked up on its own.
+        self.assertEqual([c[0][0] for c in get_base_row.call_args_list], ["Superblob-e8f4a19cfd695bf0eb66a2115313c31cc23a2369c0dc7b736d2f66d9075d7c66"])
+
+    def test_superblob_response_products_are_looked_up_together(self):
+        with mock.patch.object(releases_service, "get_product") as get_product, mock.patch.object(
+            dbo.releases_json, "select", wraps=dbo.releases_json.select
+        ) as select:
+            ret = self.client.get("/update/3/SystemAddons/1.0/1/p/l/releasesjson/a/a/a/update.xml")
+
+        self.assertIn(b"timecop@mozilla.com", ret.get_data())
+        self.assertEqual(get_product.call_count, 0)
+        # The products come from the rows that were cached when the releases were loaded.
+        product_selects = [c for c in select.call_args_list if any(column is dbo.releases_json.product for column in c[1].get("columns") or ())]
+        self.assertEqual(product_selects, [])
+
+    def test_get_release_products(self):
+        cache.reset()
+        with mock.patch.object(dbo.releases_json, "select", wraps=dbo.releases_json.select) as select:
+            products = releases_service.get_release_products(["timecop@mozilla.com-1.0", "q", "nonexistent"], None)
+
+        self.assertEqual(products, {"timecop@mozilla.com-1.0": "SystemAddons", "q": "q"})
+        self.assertEqual(select.call_count, 1)
+
+    def test_gmp_response_releases_are_loaded_together(self):
+        with mock.patch.object(releases_service, "load_releases", wraps=releases_service.load_releases) as load_releases:
+            ret = self.client.get("/update/4/gmp/1.0/1/p/l/a/a/a/a/1/update.xml")
+
+        self.assertEqual(ret.status_code, 200)
+        self.assertIn(b"http://a.com/public", ret.get_data())
+        self.assertEqual([set(c[0][0]) for c in load_releases.call_args_list], [{"response-a", "response-b"}])
+
     def test_serve_update_with_rule_information_in_header(self):
         ret = self.client.get("/update/6/c/1.0/1/p/l/a/a/SSE/default/a/update.xml")
         assert "Rule-ID" in ret.headers
@@ -2104,6 +2207,10 @@ class ClientTestEmergencyShutoff(ClientTestBase):
 """
         cache.reset()
 
+    def tearDown(self):
+        cache.reset()
+        super(ClientTestEmergencyShutoff, self).tearDown()
+
     def testShutoffUpdates(self):
         update_query = "/update/3/b/1.0/1/p/l/a/a/a/a/update.xml"
         ret = self.client.get(update_query)
@@ -2138,6 +2245,647 @@ class ClientTestEmergencyShutoff(ClientTestBase):
         ret = self.client.get(update_query)
         self.assertUpdatesAreEmpty(ret)
 
+    def testShutoffSnapshotCache(self):
+        cache.make_cache("emergency_shutoffs", 1, 100)
+        update_query = "/update/3/b/1.0/1/p/l/a-cck-foo/a/a/a/update.xml"
+        with mock.patch.object(dbo.emergencyShutoffs, "select", wraps=dbo.emergencyShutoffs.select) as select:
+            ret = self.client.get(update_query)
+            self.assertUpdateEqual(ret, self.update_xml)
+            ret = self.client.get("/update/3/b/1.0/1/p/l/a-cck-bar/a/a/a/update.xml")
+            self.assertUpdateEqual(ret, self.update_xml)
+        # Both channels, and their fallback channel, are checked against a single snapshot.
+        self.assertEqual(select.call_count, 1)
+
+        dbo.emergencyShutoffs.t.insert().execute(product="b", channel="a", data_version=1)
+        ret = self.client.get(update_query)
+        self.assertUpdateEqual(ret, self.update_xml)
+
+        cache.clear("emergency_shutoffs")
+        ret = self.client.get(update_query)
+        self.assertUpdatesAreEmpty(ret)
+
+
+class ClientTestResponseCache(ClientTestBase):
+    query = (
+        "/update/6/Firefox/54.0.1/20170628075643/WINNT_x86_64-msvc-x64/en-US/release"
+        "/Windows_NT 6.1.0.0 (x86)/ISET:SSE3,MEM:4096,JAWS:0/default/default/update.xml"
+    )
+
+    def setUp(self):
+        super(ClientTestResponseCache, self).setUp()
+        cache.reset()
+        cache.make_cache("update_responses", 10, 60)
+
+    def testIdenticalQueriesAreServedFromCache(self):
+        with mock.patch("auslib.web.public.client.render_update_xml", wraps=client_api.render_update_xml) as render:
+            first = self.client.get(self.query)
+            second = self.client.get(self.query)
+
+        self.assertHttpResponse(first)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(first.headers, second.headers)
+        self.assertIn(b'appVersion="56.0"', second.get_data())
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(cache.caches["update_responses"].hits, 1)
+        self.assertEqual(cache.caches["update_responses"].misses, 1)
+
+    def testDifferentQueriesAreCachedSeparately(self):
+        first = self.client.get(self.query)
+        second = self.client.get(self.query.replace("en-US", "de"))
+        self.assertHttpResponse(second)
+        self.assertNotEqual(first.get_data(), second.get_data())
+        self.assertEqual(cache.caches["update_responses"].hits, 0)
+        self.assertEqual(cache.caches["update_responses"].misses, 2)
+
+    def testReleaseChangeIsNotServedFromCache(self):
+        self.client.get(self.query)
+        dbo.releases_json.update(where={"name": "Firefox-56.0-build1"}, what={}, old_data_version=1)
+        with mock.patch("auslib.web.public.client.render_update_xml", wraps=client_api.render_update_xml) as render:
+            ret = self.client.get(self.query)
+        self.assertIn(b'appVersion="56.0"', ret.get_data())
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(cache.caches["update_responses"].misses, 2)
+
+    def testRuleChangeIsNotServedFromCache(self):
+        first = self.client.get(self.query)
+        dbo.rules.t.update().where(dbo.rules.channel == "release").values(data_version=2).execute()
+        second = self.client.get(self.query)
+        self.assertEqual(first.headers["Rule-Data-Version"], "1")
+        self.assertEqual(second.headers["Rule-Data-Version"], "2")
+        self.assertEqual(cache.caches["update_responses"].misses, 2)
+
+    def testBackgroundRateOutcomesAreCachedSeparately(self):
+        dbo.rules.t.insert().execute(
+            priority=200,
+            product="Firefox",
+            channel="release",
+            mapping="Firefox-56.0-build1",
+            fallbackMapping="Firefox-54.0.1-build1",
+            backgroundRate=50,
+            update_type="minor",
+            data_version=1,
+        )
+        with mock.patch.object(client_api.AUS, "rand") as rand:
+            rand.return_value = 0
+            served = self.client.get(self.query)
+            rand.return_value = 99
+            fallback = self.client.get(self.query)
+            rand.return_value = 0
+            served_again = self.client.get(self.query)
+
+        self.assertIn(b'appVersion="56.0"', served.get_data())
+        # The fallback release is older than the one in the query, so nothing is served.
+        self.assertUpdatesAreEmpty(fallback)
+        self.assertEqual(served.get_data(), served_again.get_data())
+        self.assertEqual(cache.caches["update_responses"].hits, 1)
+
+
+class ClientTestReleaseBlobCache(ClientTestBase):
+    query = (
+        "/update/6/Firefox/54.0.1/20170628075643/WINNT_x86_64-msvc-x64/en-US/release"
+        "/Windows_NT 6.1.0.0 (x86)/ISET:SSE3,MEM:4096,JAWS:0/default/default/update.xml"
+    )
+
+    def setUp(self):
+        super(ClientTestReleaseBlobCache, self).setUp()
+        cache.make_cache("release_blobs", 10, 60)
+
+    def testBlobsAreOnlyBuiltOnce(self):
+        with mock.patch("auslib.services.releases.createBlob", wraps=createBlob) as create:
+            first = self.client.get(self.query)
+            second = self.client.get(self.query)
+
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertIn(b'type="partial"', second.get_data())
+        # One for the mapping, one for the release its partial is from.
+        self.assertEqual(create.call_count, 2)
+        self.assertIsNotNone(cache.get("release_blobs", "Firefox-54.0.1-build1"))
+
+    def testFromReleasesAreLookedUpOnceInRequestTransaction(self):
+        with mock.patch.object(releases_service, "get_release_blob", wraps=releases_service.get_release_blob) as get_release_blob:
+            ret = self.client.get(self.query)
+
+        self.assertIn(b'type="partial"', ret.get_data())
+        names = [c[0][0] for c in get_release_blob.call_args_list]
+        self.assertIn("Firefox-54.0.1-build1", names)
+        self.assertEqual(len(names), len(set(names)))
+        for c in get_release_blob.call_args_list:
+            self.assertIsNotNone(c[0][1])
+
+    def testBlobIsRebuiltWhenReleaseChanges(self):
+        self.client.get(self.query)
+        old_blob = cache.get("release_blobs", "Firefox-56.0-build1")
+        dbo.releases_json.update(where={"name": "Firefox-56.0-build1"}, what={}, old_data_version=1)
+        # Pretend the cached data versions have expired.
+        cache.clear("releases_data_version")
+        with mock.patch("auslib.services.releases.createBlob", wraps=createBlob) as create:
+            ret = self.client.get(self.query)
+
+        self.assertIn(b'appVersion="56.0"', ret.get_data())
+        self.assertEqual(create.call_count, 1)
+        new_blob = cache.get("release_blobs", "Firefox-56.0-build1")
+        self.assertNotEqual(old_blob.data_versions, new_blob.data_versions)
+
+    def testBlobIsRebuiltWhenAssetChanges(self):
+        self.client.get(self.query)
+        dbo.release_assets.update(
+            where={"name": "Firefox-54.0.1-build1", "path": ".platforms.Darwin_x86_64-gcc3-u-i386-x86_64.locales.af"}, what={}, old_data_version=1
+        )
+        cache.clear("release_assets_data_versions")
+        with mock.patch("auslib.services.releases.createBlob", wraps=createBlob) as create:
+            self.client.get(self.query)
+
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(create.call_args[0][0]["name"], "Firefox-54.0.1-build1")
+
+
+class ClientTestAssembledReleaseCache(ClientTestBase):
+    query = (
+        "/update/6/Firefox/54.0.1/20170628075643/WINNT_x86_64-msvc-x64/en-US/release"
+        "/Windows_NT 6.1.0.0 (x86)/ISET:SSE3,MEM:4096,JAWS:0/default/default/update.xml"
+    )
+
+    def setUp(self):
+        super(ClientTestAssembledReleaseCache, self).setUp()
+        cache.make_cache("assembled_releases", 10, 60)
+
+    def testReleasesAreOnlyAssembledOnce(self):
+        with mock.patch.object(releases_service, "assemble_release", wraps=releases_service.assemble_release) as assemble:
+            first = self.client.get(self.query)
+            assembled = assemble.call_count
+            second = self.client.get(self.query)
+
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertIn(b'type="partial"', second.get_data())
+        self.assertGreater(assembled, 0)
+        self.assertEqual(assemble.call_count, assembled)
+
+    def testDataVersionsAreOnlyFlattenedOnce(self):
+        cache.make_cache("release_blobs", 10, 60)
+        with mock.patch.object(releases_service, "flatten_data_versions", wraps=releases_service.flatten_data_versions) as flatten:
+            self.client.get(self.query)
+            flattened = flatten.call_count
+            with mock.patch("auslib.services.releases.createBlob", wraps=createBlob) as create:
+                self.client.get(self.query)
+
+        self.assertGreater(flattened, 0)
+        self.assertEqual(flatten.call_count, flattened)
+        self.assertEqual(create.call_count, 0)
+
+    def testCachedRowsAreNotModified(self):
+        self.client.get(self.query)
+        base_row = cache.get("releases", "Firefox-56.0-build1")
+        for platform in base_row["data"]["platforms"].values():
+            self.assertNotIn("locales", platform)
+
+    def testAssetChangeIsReassembled(self):
+        self.client.get(self.query)
+        dbo.release_assets.update(
+            where={"name": "Firefox-56.0-build1", "path": ".platforms.WINNT_x86_64-msvc.locales.en-US"},
+            what={"data": {"buildID": "20170918210325"}},
+            old_data_version=1,
+        )
+        # Pretend the cached data versions have expired.
+        cache.clear("release_assets_data_versions")
+        with mock.patch.object(releases_service, "assemble_release", wraps=releases_service.assemble_release) as assemble:
+            ret = self.client.get(self.query)
+
+        self.assertEqual(assemble.call_count, 1)
+        self.assertIn(b'buildID="20170918210325"', ret.get_data())
+
+
+class ClientTestCacheInvalidation(ClientTestBase):
+    query = ClientTestAssembledReleaseCache.query
+
+    def setUp(self):
+        super(ClientTestCacheInvalidation, self).setUp()
+        # Nothing expires during these tests, so changes are only picked up
+        # when the affected entries are evicted.
+        cache.reset()
+        for name in ("releases", "releases_data_version", "release_assets", "release_assets_data_versions", "rules_index", "rules_data_versions"):
+            cache.make_cache(name, 50, 3600)
+        self.invalidator = CacheInvalidator(0)
+        app.config["CACHE_INVALIDATOR"] = self.invalidator
+
+    def tearDown(self):
+        del app.config["CACHE_INVALIDATOR"]
+        # Other test classes don't expect the rules to be cached.
+        cache.reset()
+        super(ClientTestCacheInvalidation, self).tearDown()
+
+    def testReleaseChangeIsPickedUp(self):
+        self.client.get(self.query)
+        dbo.release_assets.update(
+            where={"name": "Firefox-56.0-build1", "path": ".platforms.WINNT_x86_64-msvc.locales.en-US"},
+            what={"data": {"buildID": "20170918210325"}},
+            old_data_version=1,
+        )
+        ret = self.client.get(self.query)
+
+        self.assertIn(b'buildID="20170918210325"', ret.get_data())
+
+    def testUnrelatedReleasesAreNotEvicted(self):
+        self.client.get(self.query)
+        self.assertTrue(cache.contains("releases", "Firefox-54.0.1-build1"))
+        dbo.releases_json.update(where={"name": "Firefox-56.0-build1"}, what={}, old_data_version=1)
+        self.client.get("/__heartbeat__")
+
+        self.assertTrue(cache.contains("releases", "Firefox-54.0.1-build1"))
+        self.assertFalse(cache.contains("releases", "Firefox-56.0-build1"))
+
+    def testRuleChangeIsPickedUp(self):
+        self.client.get(self.query)
+        rule = dbo.rules.select(where={"channel": "release", "product": "Firefox"})[0]
+        dbo.rules.t.update().where(dbo.rules.rule_id == rule["rule_id"]).values(mapping="Firefox-100.0-build1", data_version=2).execute()
+        dbo.changeLog.record("rules")
+        ret = self.client.get(self.query)
+
+        self.assertIn(b'appVersion="100.0"', ret.get_data())
+
+    def testChangesCommittedOutOfOrderArePickedUp(self):
+        self.invalidator.check()
+        latest = dbo.changeLog.getLatestChangeId()
+        dbo.changeLog.t.insert().execute(change_id=latest + 2, table_name="releases_json", row_key="b", timestamp=1)
+        self.assertEqual(self.invalidator.check(), 1)
+        dbo.changeLog.t.insert().execute(change_id=latest + 1, table_name="releases_json", row_key="a", timestamp=1)
+        with mock.patch("auslib.services.invalidation.evict") as evict:
+            self.assertEqual(self.invalidator.check(), 1)
+            self.assertEqual(self.invalidator.check(), 0)
+
+        evict.assert_called_once_with("releases_json", "a")
+
+    def testChecksAreThrottled(self):
+        self.invalidator.interval = 3600
+        self.invalidator.check()
+        dbo.changeLog.record("rules")
+
+        self.assertEqual(self.invalidator.check(), 0)
+
+
+class ClientTestSigningService(ClientTestBase):
+    query = "/update/4/gmp/1.0/1/p/l/a/a/a/a/1/update.xml"
+
+    def setUp(self):
+        super(ClientTestSigningService, self).setUp()
+        self.autograph = FakeAutograph()
+        self.autograph.start()
+        app.config["AUTOGRAPH_gmp_URL"] = self.autograph.url
+        for field in ("KEYID", "USERNAME", "PASSWORD"):
+            app.config["AUTOGRAPH_gmp_%s" % field] = "fake"
+        self.signing_service = SigningService(app, workers=1)
+        app.config["SIGNING_SERVICE"] = self.signing_service
+
+    def tearDown(self):
+        self.signing_service.close()
+        self.autograph.stop()
+        for field in ("URL", "KEYID", "USERNAME", "PASSWORD"):
+            del app.config["AUTOGRAPH_gmp_%s" % field]
+        del app.config["SIGNING_SERVICE"]
+        super(ClientTestSigningService, self).tearDown()
+
+    def wait_for_signing(self):
+        # The service only has one thread, which does everything in the order
+        # it was asked to.
+        self.signing_service.executor.submit(lambda: None).result()
+
+    def run_in_this_thread(self, fn, *args):
+        # Rendering a response needs the database, which is in memory, and
+        # only visible to this thread.
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def assertSigned(self, ret, signature):
+        self.assertEqual(ret.headers["Content-Signature"], "x5u={}/x5u; p384ecdsa={}".format(self.autograph.url, signature))
+        self.assertEqual(ret.headers.getlist("Cache-Control"), [app.cacheControl])
+
+    def testContentIsSignedBeforeItsServed(self):
+        ret = self.client.get(self.query)
+        self.assertEqual(ret.status_code, 200)
+        self.assertSigned(ret, "sig1")
+        self.assertSigned(self.client.get(self.query), "sig1")
+        self.assertEqual(len(self.autograph.hashes), 1)
+
+    def testUnsignedContentIsntServed(self):
+        self.signing_service.timeout = 0.1
+        self.autograph.released.clear()
+        with self.assertRaises(SigningError):
+            self.signing_service.get_headers(b"<updates/>", "gmp")
+
+        # The signature is still used once Autograph gets around to it.
+        self.autograph.released.set()
+        self.wait_for_signing()
+        headers = self.signing_service.get_headers(b"<updates/>", "gmp")
+        self.assertEqual(headers["Content-Signature"], "x5u={}/x5u; p384ecdsa=sig1".format(self.autograph.url))
+        self.assertEqual(len(self.autograph.hashes), 1)
+
+    def testSignaturesInUseAreRefreshed(self):
+        self.client.get(self.query)
+        self.wait_for_signing()
+        self.client.get(self.query)
+        with mock.patch("time.time", return_value=time.time() + self.signing_service.refresh_after):
+            self.assertEqual(self.signing_service.check(), 1)
+        self.wait_for_signing()
+
+        self.assertEqual(len(self.autograph.hashes), 2)
+        self.assertSigned(self.client.get(self.query), "sig2")
+
+    def testUnusedSignaturesArentRefreshed(self):
+        self.assertTrue(self.signing_service.presign(b"<updates/>", "gmp"))
+        with mock.patch("time.time", return_value=time.time() + self.signing_service.refresh_after):
+            self.assertEqual(self.signing_service.check(), 0)
+
+    def testExpiredSignaturesArentServed(self):
+        content = self.client.get(self.query).get_data()
+        self.wait_for_signing()
+        self.assertIsNotNone(self.signing_service.get_headers(content, "gmp"))
+        with mock.patch("time.time", return_value=time.time() + self.signing_service.max_age):
+            headers = self.signing_service.get_headers(content, "gmp")
+        self.assertEqual(headers["Content-Signature"], "x5u={}/x5u; p384ecdsa=sig2".format(self.autograph.url))
+
+    def testResponsesAreSignedWhenRulesChange(self):
+        invalidator = CacheInvalidator(0)
+        invalidator.listeners.append(self.signing_service.release_changed)
+        app.config["CACHE_INVALIDATOR"] = invalidator
+        try:
+            self.client.get(self.query)
+            self.wait_for_signing()
+            rule = dbo.rules.select(where={"product": "response-a"})[0]
+            dbo.rules.t.update().where(dbo.rules.rule_id == rule["rule_id"]).values(mapping="response-b", data_version=2).execute()
+            dbo.changeLog.record("rules")
+            with mock.patch.object(self.signing_service.executor, "submit", self.run_in_this_thread):
+                self.assertEqual(invalidator.check(), 1)
+            ret = self.client.get(self.query)
+        finally:
+            del app.config["CACHE_INVALIDATOR"]
+
+        self.assertEqual(len(self.autograph.hashes), 2)
+        self.assertSigned(ret, "sig2")
+
+    def testOnlyAffectedResponsesAreSignedAgain(self):
+        self.client.get(self.query)
+        self.wait_for_signing()
+
+        with mock.patch.object(self.signing_service.executor, "submit", self.run_in_this_thread):
+            self.assertEqual(self.signing_service.release_changed("releases", "response-a"), 1)
+            self.assertEqual(self.signing_service.release_changed("releases", "Firefox-56.0-build1"), 0)
+            self.assertEqual(self.signing_service.release_changed("permissions", None), 0)
+        # The response hasn't changed, so there's nothing new to sign.
+        self.assertEqual(len(self.autograph.hashes), 1)
+
+    def testResponsesAreSignedWhenCachesAreWarmedUp(self):
+        dbo.rules.t.update().where(dbo.rules.product == "gmp").values(channel="a", locale="l", version=">=1.0").execute()
+        with app.app_context():
+            warmup.CacheWarmer(presign=client_api.presign_responses).run()
+        # The empty response, and the ones for the two build targets that the
+        # rule's releases have.
+        self.assertEqual(len(self.autograph.hashes), 3)
+        self.assertEqual(len(self.signing_service.responses), 2)
+
+        with mock.patch.object(self.signing_service.executor, "submit") as submit:
+            self.assertSigned(self.client.get("/update/3/gmp/1.0/1/p/l/a/a/default/default/update.xml"), "sig2")
+            self.assertSigned(self.client.get("/update/3/gmp/1.0/1/q/l/a/a/default/default/update.xml"), "sig3")
+            # No rule matches this channel.
+            self.assertSigned(self.client.get("/update/3/gmp/1.0/1/p/l/zzz/a/default/default/update.xml"), "sig1")
+        self.assertEqual(submit.call_count, 0)
+
+    def testResponsesAreRenderedWithoutRollingTheDice(self):
+        dbo.rules.t.update().where(dbo.rules.product == "response-a").values(backgroundRate=50).execute()
+        with mock.patch.object(client_api.AUS, "rand", return_value=0):
+            self.assertSigned(self.client.get(self.query), "sig1")
+
+        # If the dice were rolled again, response-a wouldn't be in the response.
+        with mock.patch.object(client_api.AUS, "rand", return_value=99):
+            with mock.patch.object(self.signing_service.executor, "submit", self.run_in_this_thread):
+                self.assertEqual(self.signing_service.release_changed("releases", "response-a"), 1)
+        self.assertEqual(len(self.autograph.hashes), 1)
+
+
+class ClientTestFastPath(ClientTestBase):
+    queries = (
+        ClientTestResponseCache.query,
+        ClientTestResponseCache.query.replace("en-US", "de") + "?force=1",
+        "/update/3/b/1.0/1/p/l/a/a/a/a/update.xml",
+        "/update/3/b/1.0esrpre/1/p/l/a/a/a/a/update.xml",
+        "/update/4/gmp/1.0/1/p/l/a/a/a/a/1/update.xml",
+        "/update/1/b/1.0/1/p/l/a/update.xml?mig64=1&avast=1",
+        "/update/5/b/1.0/1/p/x86%20l/a/a/a/a/1/update.xml",
+        # Queries that fail are responded to by the app's error handlers.
+        "/update/3/b/1.0/1/p/l/a/a/a/a/update.xml?pin=abc",
+        "/update/3/b/50.1.0zibj5/1/p/l/a/a/a/a/update.xml",
+        # Requests that Connexion rejects are handled by the full app.
+        "/update/2/b/1.0/1/p/l/a/a/update.xml?pin=1",
+        "/update/3/b/1.0/1/p/l/a/a/a/a/update.xml?force=1&force=2",
+        "/update/3/b/1.0/1/p/l/a/a/a/a/update.xml?unknown=1",
+        "/update/3/b/1.0/1/p/l/a/a/a/update.xml",
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        # The error handlers are kept, so that the responses to requests that
+        # fail can be compared as well.
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    def setUp(self):
+        super(ClientTestFastPath, self).setUp()
+        app.config["UPDATE_FAST_PATH"] = True
+
+    def tearDown(self):
+        del app.config["UPDATE_FAST_PATH"]
+        cache.reset()
+        super(ClientTestFastPath, self).tearDown()
+
+    def testParseUpdateURL(self):
+        self.assertEqual(
+            parse_update_url("/update/3/b/1.0esrpre/1/p/l/a/Windows 10/a/a/update.xml", "force=1"),
+            (
+                3,
+                {
+                    "product": "b",
+                    "version": "1.0",
+                    "buildID": "1",
+                    "buildTarget": "p",
+                    "locale": "l",
+                    "channel": "a",
+                    "osVersion": "Windows 10",
+                    "distribution": "a",
+                    "distVersion": "a",
+                    "force": "1",
+                },
+            ),
+        )
+        self.assertIsNone(parse_update_url("/update/7/b/1.0/1/p/l/a/update.xml", ""))
+        self.assertIsNone(parse_update_url("/update/1/b/1.0//p/l/a/update.xml", ""))
+        self.assertIsNone(parse_update_url("/update/1/b/1.0/1/p/l/a/update.xml", "force="))
+        self.assertIsNone(parse_update_url("/json/1/b/1.0/p/a/update.json", ""))
+
+    def testResponsesAreIdentical(self):
+        for query in self.queries:
+            with mock.patch("auslib.web.public.fastpath.get_update_response", wraps=client_api.get_update_response) as fast:
+                with mock.patch("auslib.web.public.client.resolve_update", wraps=client_api.resolve_update) as resolve:
+                    app.config["UPDATE_FAST_PATH"] = True
+                    expected_fast = parse_update_url(*query.partition("?")[::2]) is not None
+                    fast_ret = self.client.get(query)
+                    fast_resolves = resolve.call_count
+                    app.config["UPDATE_FAST_PATH"] = False
+                    ret = self.client.get(query)
+
+            self.assertEqual(fast.called, expected_fast, query)
+            # Queries are never run a second time, even when they fail.
+            self.assertEqual(fast_resolves, resolve.call_count - fast_resolves, query)
+            self.assertEqual(fast_ret.status_code, ret.status_code, query)
+            self.assertEqual(fast_ret.get_data(), ret.get_data(), query)
+            self.assertEqual(fast_ret.headers.to_wsgi_list(), ret.headers.to_wsgi_list(), query)
+
+    def testCachedResponsesDontConnectToTheDatabase(self):
+        cache.make_cache("rules_index", 1, 60)
+        cache.make_cache("rules_data_versions", 1, 60)
+        cache.make_cache("emergency_shutoffs", 1, 60)
+        cache.make_cache("pin_mappings", 1, 60)
+        cache.make_cache("update_responses", 10, 60)
+        first = self.client.get(ClientTestResponseCache.query)
+        with mock.patch.object(dbo.engine, "connect", wraps=dbo.engine.connect) as connect:
+            second = self.client.get(ClientTestResponseCache.query)
+
+        self.assertEqual(connect.call_count, 0)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertIn(b'appVersion="56.0"', second.get_data())
+
+
+class ClientTestNegativeCaching(ClientTestBase):
+    def setUp(self):
+        super(ClientTestNegativeCaching, self).setUp()
+        cache.make_cache("missing_releases", 50, 60)
+
+    def tearDown(self):
+        cache.reset()
+        super(ClientTestNegativeCaching, self).tearDown()
+
+    def testMissingReleaseIsntLookedUpAgain(self):
+        self.assertIsNone(releases_service.ReleaseBlobMemo(None).get("Firefox-0.0-build1"))
+        self.assertTrue(cache.contains("missing_releases", "Firefox-0.0-build1"))
+
+        with mock.patch("auslib.services.releases.load_releases") as load_releases, mock.patch.object(dbo.releases, "getReleaseBlob") as getReleaseBlob:
+            self.assertIsNone(releases_service.ReleaseBlobMemo(None).get("Firefox-0.0-build1"))
+        self.assertEqual(load_releases.call_count, 0)
+        self.assertEqual(getReleaseBlob.call_count, 0)
+
+    def testMissingMappingIsntLookedUpAgain(self):
+        rule = dict(rule_id=1, data_version=1, mapping="Firefox-0.0-build1", fallbackMapping=None, backgroundRate=100, update_type="minor")
+        self.assertEqual(client_api.AUS.evaluateRule({"force": None}, rule)[0], None)
+        self.assertTrue(cache.contains("missing_releases", "Firefox-0.0-build1"))
+
+        with mock.patch("auslib.services.releases.load_releases") as load_releases, mock.patch.object(dbo.releases, "getReleaseBlob") as getReleaseBlob:
+            self.assertEqual(client_api.AUS.evaluateRule({"force": None}, rule)[0], None)
+        self.assertEqual(load_releases.call_count, 0)
+        self.assertEqual(getReleaseBlob.call_count, 0)
+
+    def testExistingReleasesArentCachedAsMissing(self):
+        self.assertIsNotNone(releases_service.ReleaseBlobMemo(None).get("Firefox-56.0-build1"))
+        self.assertIsNotNone(releases_service.ReleaseBlobMemo(None).get("q"))
+        self.assertFalse(cache.contains("missing_releases", "Firefox-56.0-build1"))
+        self.assertFalse(cache.contains("missing_releases", "q"))
+
+    def testMissingReleaseIsEvictedWhenChanged(self):
+        releases_service.ReleaseBlobMemo(None).get("Firefox-0.0-build1")
+        evict("releases_json", "Firefox-0.0-build1")
+        self.assertFalse(cache.contains("missing_releases", "Firefox-0.0-build1"))
+
+    def testPinMappingsAreClearedWhenChanged(self):
+        cache.make_cache("pin_mappings", 1, 3600)
+        self.assertIsNone(dbo.pinnable_releases.getPinMapping("Firefox", "release", "56."))
+        dbo.pinnable_releases.t.insert().execute(data_version=1, product="Firefox", channel="release", version="56.", mapping="Firefox-56.0-build1")
+        self.assertIsNone(dbo.pinnable_releases.getPinMapping("Firefox", "release", "56."))
+
+        evict("pinnable_releases", None)
+        self.assertEqual(dbo.pinnable_releases.getPinMapping("Firefox", "release", "56."), "Firefox-56.0-build1")
+
+
+class ClientTestCacheWarmup(ClientTestBase):
+    def setUp(self):
+        super(ClientTestCacheWarmup, self).setUp()
+        cache.make_cache("rules_index", 1, 60)
+        cache.make_cache("rules_data_versions", 1, 60)
+        cache.make_cache("release_blobs", 50, 60)
+        cache.make_cache("updates_disabled", 50, 60)
+
+    def tearDown(self):
+        # Other test classes don't expect the rules to be cached.
+        cache.reset()
+        super(ClientTestCacheWarmup, self).tearDown()
+
+    def warm(self):
+        with dbo.begin() as trans:
+            return warmup.warm_caches(trans)
+
+    def testRulesAndShutoffsAreCached(self):
+        dbo.emergencyShutoffs.t.insert().execute(product="Firefox", channel="release100", data_version=1)
+        self.warm()
+
+        self.assertTrue(cache.contains("rules_index", "rules"))
+        self.assertIs(cache.get("updates_disabled", ("Firefox", "release100")), True)
+        self.assertIs(cache.get("updates_disabled", ("Firefox", "release")), False)
+        self.assertIs(cache.get("updates_disabled", ("SystemAddons", "releasesjson")), False)
+
+    def testShutoffSnapshotIsCached(self):
+        cache.make_cache("emergency_shutoffs", 1, 60)
+        dbo.emergencyShutoffs.t.insert().execute(product="Firefox", channel="release100", data_version=1)
+        self.warm()
+
+        self.assertEqual(cache.get("emergency_shutoffs", "emergency_shutoffs"), frozenset([("Firefox", "release100")]))
+        self.assertFalse(cache.contains("updates_disabled", ("Firefox", "release")))
+
+    def testReferencedReleasesAreCached(self):
+        dbo.pinnable_releases.t.insert().execute(data_version=1, product="Firefox", channel="release", version="56.", mapping="Firefox-56.0-build1")
+        with mock.patch.object(dbo.releases_json, "getReleasesWithAssets", wraps=dbo.releases_json.getReleasesWithAssets) as batch_loads:
+            self.warm()
+
+        for name in (
+            # Mapped to by rules
+            "Firefox-100.0-build1",
+            "Superblob-e8f4a19cfd695bf0eb66a2115313c31cc23a2369c0dc7b736d2f66d9075d7c66",
+            # Mapped to by a pin
+            "Firefox-56.0-build1",
+            # Included in the superblob's response
+            "hotfix-bug-1548973@mozilla.org-1.1.4",
+            # A partial of Firefox-100.0-build1 is from it
+            "Firefox-54.0.1-build1",
+        ):
+            self.assertTrue(cache.contains("releases", name), name)
+            self.assertTrue(cache.contains("release_blobs", name), name)
+        self.assertEqual(batch_loads.call_count, 3)
+
+    def testRequestsAfterWarmupDontLoadReleases(self):
+        self.warm()
+        with mock.patch.object(dbo.releases_json, "select") as select:
+            ret = self.client.get("/update/6/Firefox/54.0.1/20170628075643/WINNT_x86_64-msvc-x64/en-US/release100/default/default/default/default/update.xml")
+
+        self.assertIn(b'appVersion="100.0"', ret.get_data())
+        self.assertFalse(select.called)
+
+    def testFailedWarmupIsntFatal(self):
+        with mock.patch.object(warmup, "warm_caches", side_effect=Exception("kaboom")) as warm_caches:
+            warmup.CacheWarmer().run()
+
+        self.assertEqual(warm_caches.call_count, 1)
+
+    def testChangesAfterWarmupAreEvictedByTheFirstCheck(self):
+        invalidator = CacheInvalidator(0)
+        warmup.CacheWarmer(invalidator=invalidator).run()
+        self.assertTrue(cache.contains("rules_index", "rules"))
+        rule = dbo.rules.select(where={"channel": "release", "product": "Firefox"})[0]
+        dbo.rules.t.update().where(dbo.rules.rule_id == rule["rule_id"]).values(mapping="Firefox-54.0.1-build1", data_version=2).execute()
+        dbo.changeLog.record("rules")
+
+        self.assertEqual(invalidator.check(), 1)
+        self.assertFalse(cache.contains("rules_data_versions", "rules"))
+        rules = {r["rule_id"]: r for r in dbo.rules.getRuleIndex().rules}
+        self.assertEqual(rules[rule["rule_id"]]["mapping"], "Firefox-54.0.1-build1")
+
 
 class ClientTestWithErrorHandlers(ClientTestCommon):
     """Most of the tests are run without the error handler because it gives more
@@ -2179,6 +2927,17 @@ class ClientTestWithErrorHandlers(ClientTestCommon):
             ret = self.client.get("/update/4/b/1.0/1/p/l/a/a/a/a/1/update.xml")
             self.assertEqual(ret.headers.get("Content-Security-Policy"), "default-src 'none'; frame-ancestors 'none'")
 
+    def testUnsignedContentIsRetriedLater(self):
+        signing_service = mock.Mock()
+        signing_service.get_headers.side_effect = SigningError("Too slow")
+        with mock.patch.dict(app.config, {"AUTOGRAPH_b_URL": "fake", "SIGNING_SERVICE": signing_service, "CONTENT_SIGNATURE_PRODUCTS": ["b"]}):
+            ret = self.client.get("/update/4/b/1.0/1/p/l/a/a/a/a/1/update.xml")
+
+        self.assertEqual(ret.status_code, 503)
+        self.assertEqual(ret.headers.get("Retry-After"), "60")
+        self.assertEqual(ret.headers.get("Cache-Control"), "no-store")
+        self.assertNotIn("Content-Signature", ret.headers)
+
     def testStrictTransportSecurityIsSet(self):
         ret = self.client.get("/update/3/c/15.0/1/p/l/a/a/default/a/update.xml")
         self.assertEqual(ret.headers.get("Strict-Transport-Security"), "max-age=31536000;")
@@ -1,5 +1,7 @@
 import mock
 
+from auslib.web.public.base import app
+
 from .test_client import ClientTestBase
 
 
@@ -39,3 +41,17 @@ class TestDockerflowEndpoints(ClientTestBase):
         ret = self.client.get("/__lbheartbeat__")
         self.assertEqual(ret.status_code, 200)
         self.assertEqual(ret.headers["Cache-Control"], "no-cache")
+
+    def testCacheStats(self):
+        ret = self.client.get("/__cache__")
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.headers["Cache-Control"], "no-cache")
+        stats = ret.get_json()
+        self.assertEqual(stats["releases"]["maxsize"], 50)
+        self.assertNotIn("bytes", stats["releases"])
+
+    def testCacheStatsWithSizes(self):
+        with mock.patch.dict(app.config, {"CACHE_STATS_SIZES": True}):
+            ret = self.client.get("/__cache__")
+        self.assertEqual(ret.status_code, 200)
+        self.assertIn("bytes", ret.get_json()["releases"])